@@ -11,6 +11,7 @@ from datetime import datetime, date
 
 from db import Database
 from validators import validate_table_data
+from fk_picker import ForeignKeyPicker, picker_errors
 from sqlalchemy import Table
 
 class FieldLine:
@@ -35,7 +36,7 @@ class FieldLine:
             return None
 
 class InputBuilder:
-    def build_field(self, col) -> FieldLine:
+    def build_field(self, col, db=None) -> FieldLine:
         placeholder_parts = [str(col.type)]
         if col.primary_key:
             placeholder_parts.append("primary key")
@@ -55,6 +56,15 @@ class InputBuilder:
         error_label.setStyleSheet("color: red;")
         error_label.setVisible(False)
 
+        if db is not None and col.foreign_keys and not col.primary_key:
+            editor = ForeignKeyPicker(db, col.table.name, col.name)
+            container = QWidget()
+            vbox = QVBoxLayout(container)
+            vbox.setContentsMargins(0, 0, 0, 0)
+            vbox.addWidget(editor)
+            vbox.addWidget(error_label)
+            return FieldLine(container, editor, editor.value, error_label)
+
         if isinstance(col.type, SAEnum):
             editor = QComboBox()
             enums = getattr(col.type, "enums", []) or []
@@ -231,7 +241,7 @@ class AddDialog(QDialog):
             if col.autoincrement and col.primary_key:
                 continue
 
-            fl = builder.build_field(col)
+            fl = builder.build_field(col, db=self.db)
 
             label_text = col.name
             if not col.nullable:
@@ -274,6 +284,7 @@ class AddDialog(QDialog):
         self.clear_errors()
         raw = self.gather_raw()
         validated, errors = validate_table_data(self.table, raw, db=self.db)
+        errors.update({k: v for k, v in picker_errors(self.field_map).items() if k not in errors})
         if errors:
             self.set_errors(errors)
             return
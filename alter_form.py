@@ -1,14 +1,19 @@
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QWidget,
     QLineEdit, QComboBox, QCheckBox, QSpinBox, QMessageBox, QScrollArea,
-    QSizePolicy, QListWidget, QListWidgetItem, QPlainTextEdit, QInputDialog
+    QSizePolicy, QListWidget, QListWidgetItem, QPlainTextEdit, QInputDialog,
+    QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView
 )
 from PySide6.QtCore import Signal, Qt
 from PySide6.QtGui import QFont, QColor
 import re
+from datetime import datetime
 
 from sqlalchemy import text
 
+from config import settings
+from db import PARTITION_INTERVALS
+
 
 class RenameTableDialog(QDialog):
     def __init__(self, current_name: str, parent=None):
@@ -144,6 +149,7 @@ class ColumnEditorDialog(QDialog):
         enums = []
         if self.db is not None:
             try:
+                self.db.sync_enum_registry()
                 res = self.db.list_enums()
                 if isinstance(res, dict):
                     enums = list(res.keys())
@@ -260,11 +266,24 @@ class EnumManagerDialog(QDialog):
         row.addWidget(self.values_view, 2)
         self.layout.addLayout(row)
 
+        self.impact_label = QLabel("")
+        self.impact_label.setWordWrap(True)
+        self.layout.addWidget(self.impact_label)
+        self.impact_table = QTableWidget(0, 5)
+        self.impact_table.setHorizontalHeaderLabels(["Тип", "Объект", "Строк (оценка)", "Размер", "Перезапись"])
+        self.impact_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.impact_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.impact_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.impact_table.setVisible(False)
+        self.layout.addWidget(self.impact_table)
+
         btn_row = QHBoxLayout()
+        self.btn_impact = QPushButton("Анализ влияния")
         self.btn_new = QPushButton("Создать")
         self.btn_delete = QPushButton("Удалить")
         self.btn_assign = QPushButton("Назначить колонке")
         self.btn_close = QPushButton("Закрыть")
+        btn_row.addWidget(self.btn_impact)
         btn_row.addStretch(1)
         btn_row.addWidget(self.btn_new)
         btn_row.addWidget(self.btn_delete)
@@ -273,6 +292,7 @@ class EnumManagerDialog(QDialog):
         self.layout.addLayout(btn_row)
 
         self.enum_list.currentItemChanged.connect(self.on_enum_selected)
+        self.btn_impact.clicked.connect(self.show_impact)
         self.btn_new.clicked.connect(self.create_enum)
         self.btn_delete.clicked.connect(self.delete_enum)
         self.btn_assign.clicked.connect(self.assign_enum_to_column)
@@ -290,6 +310,7 @@ class EnumManagerDialog(QDialog):
             return
 
         try:
+            self.db.sync_enum_registry()
             res = self.db.list_enums()
             if isinstance(res, dict):
                 self.enum_map = res
@@ -304,8 +325,9 @@ class EnumManagerDialog(QDialog):
 
         if self.table_name and self.column_name:
             try:
-                cur = self.db.get_column_enum(self.table_name, self.column_name)
-                self.current_enum = cur
+                column = (self.table_name, self.column_name)
+                self.current_enum = next((e['name'] for e in self.db.enum_registry().values()
+                                          if column in e['columns']), None)
             except Exception:
                 self.current_enum = None
 
@@ -319,6 +341,8 @@ class EnumManagerDialog(QDialog):
             self.enum_list.addItem(item)
 
     def on_enum_selected(self, cur: QListWidgetItem):
+        self.impact_label.setText("")
+        self.impact_table.setVisible(False)
         if cur is None:
             self.values_view.setPlainText("")
             return
@@ -329,6 +353,61 @@ class EnumManagerDialog(QDialog):
         else:
             self.values_view.setPlainText('(значений нет или тип не возвращает список значений)')
 
+    @staticmethod
+    def _impact_summary(impact):
+        lines = []
+        for c in impact['columns']:
+            rows = "?" if c['rows'] is None else f"~{c['rows']:,}".replace(',', ' ')
+            lines.append(f"колонка {c['table']}.{c['column']}{'[]' if c['array'] else ''} ({rows} строк)")
+        for v in impact['views']:
+            lines.append(f"{'материализованное представление' if v['kind'] == 'matview' else 'представление'} "
+                         f"{v['name']}")
+        for f in impact['functions']:
+            lines.append(f"функция {f}")
+        return lines
+
+    def show_impact(self):
+        cur = self.enum_list.currentItem()
+        if not cur:
+            QMessageBox.information(self, "Не выбрано", "Выберите enum в списке")
+            return
+        try:
+            impact = self.db.enum_impact(cur.text())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось проанализировать зависимости: {e}")
+            return
+        self.impact_table.setRowCount(0)
+        entries = [("колонка", f"{c['table']}.{c['column']}{'[]' if c['array'] else ''}", c['rows'], c['bytes'],
+                    c['seconds']) for c in impact['columns']]
+        entries += [("матпредставление" if v['kind'] == 'matview' else "представление", v['name'], v['rows'],
+                     v['bytes'], None) for v in impact['views']]
+        entries += [("функция", f, None, None, None) for f in impact['functions']]
+        for kind, obj, rows, size, seconds in entries:
+            r = self.impact_table.rowCount()
+            self.impact_table.insertRow(r)
+            values = [
+                kind,
+                obj,
+                "" if rows is None else f"{rows:,}".replace(',', ' '),
+                "" if size is None else f"{size / 1048576:.1f} МБ",
+                "" if seconds is None else f"~{seconds:.1f} с",
+            ]
+            for c, v in enumerate(values):
+                self.impact_table.setItem(r, c, QTableWidgetItem(v))
+        self.impact_table.setVisible(bool(entries))
+        if not entries:
+            self.impact_label.setText("Enum ни от чего не используется, его можно менять и удалять без перезаписи.")
+            return
+        rows = f"{impact['rows']:,}".replace(',', ' ')
+        summary = (f"Изменение типа колонок перепишет таблицы целиком под ACCESS EXCLUSIVE: "
+                   f"~{rows} строк, {impact['bytes'] / 1048576:.1f} МБ с индексами, "
+                   f"оценка ~{impact['seconds']:.1f} с при {settings.REWRITE_MB_PER_SEC:g} МБ/с.")
+        if impact['views']:
+            summary += " Представления на этих колонках мешают ALTER TYPE, а замена колонки удалит их каскадом."
+        if any(c['rows'] is None for c in impact['columns']):
+            summary += " Для части таблиц нет статистики — выполните ANALYZE."
+        self.impact_label.setText(summary)
+
     def create_enum(self):
         name, ok = QInputDialog.getText(self, "Создать enum", "Имя enum:")
         if not ok or not name.strip():
@@ -355,12 +434,32 @@ class EnumManagerDialog(QDialog):
         if self.current_enum and name == self.current_enum:
             QMessageBox.warning(self, "Нельзя удалить", "Сначала смените тип колонки на другой, затем удаляйте этот enum.")
             return
-        dlg = QMessageBox.question(self, "Подтвердите", f"Удалить enum '{name}'?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        try:
+            impact = self.db.enum_impact(name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось проверить зависимости: {e}")
+            return
+        dependents = self._impact_summary(impact)
+        if dependents:
+            preview = "\n".join(dependents[:20])
+            if len(dependents) > 20:
+                preview += f"\n... ещё {len(dependents) - 20}"
+            dlg = QMessageBox.question(
+                self, "Enum используется",
+                f"От enum '{name}' зависят:\n\n{preview}\n\n"
+                "Удаление с CASCADE удалит эти колонки вместе с данными, а также представления и функции. "
+                "Удалить всё перечисленное?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+        else:
+            dlg = QMessageBox.question(self, "Подтвердите", f"Удалить enum '{name}'?",
+                                       QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         if dlg != QMessageBox.StandardButton.Yes:
             return
         try:
-            self.db.drop_enum(name)
+            self.db.drop_enum(name, cascade=bool(dependents))
             QMessageBox.information(self, "Успешно", f"Enum '{name}' удалён")
+            if impact['columns']:
+                self.tablesChanged.emit(self.table_name if self.table_name is not None else "")
             self.refresh()
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", str(e))
@@ -434,6 +533,258 @@ class EnumManagerDialog(QDialog):
         self.refresh()
 
 
+class PartitionDialog(QDialog):
+    tablesChanged = Signal(str)
+
+    def __init__(self, db, table_name: str, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table_name = table_name
+        self.info = None
+        self.setWindowTitle(f"Секционирование: {table_name}")
+        self.resize(720, 520)
+        self.layout = QVBoxLayout(self)
+
+        self.status_label = QLabel()
+        self.layout.addWidget(self.status_label)
+
+        self.convert_row = QWidget()
+        conv_l = QHBoxLayout(self.convert_row)
+        conv_l.setContentsMargins(0, 0, 0, 0)
+        self.column_combo = QComboBox()
+        self.interval_combo = QComboBox()
+        self.interval_combo.addItems(list(PARTITION_INTERVALS))
+        self.interval_combo.setCurrentText('month')
+        self.ahead_spin = QSpinBox()
+        self.ahead_spin.setRange(0, 120)
+        self.ahead_spin.setValue(settings.PARTITION_PERIODS_AHEAD)
+        self.drop_fks_cb = QCheckBox("Удалить входящие FK")
+        self.btn_convert = QPushButton("Секционировать")
+        conv_l.addWidget(QLabel("Ключ:"))
+        conv_l.addWidget(self.column_combo)
+        conv_l.addWidget(QLabel("Интервал:"))
+        conv_l.addWidget(self.interval_combo)
+        conv_l.addWidget(QLabel("Вперёд:"))
+        conv_l.addWidget(self.ahead_spin)
+        conv_l.addWidget(self.drop_fks_cb)
+        conv_l.addStretch(1)
+        conv_l.addWidget(self.btn_convert)
+        self.layout.addWidget(self.convert_row)
+
+        self.parts_table = QTableWidget(0, 5)
+        self.parts_table.setHorizontalHeaderLabels(["Секция", "С", "По", "Строк (оценка)", "Размер"])
+        self.parts_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.parts_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.parts_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.layout.addWidget(self.parts_table)
+
+        self.actions_row = QWidget()
+        act_l = QHBoxLayout(self.actions_row)
+        act_l.setContentsMargins(0, 0, 0, 0)
+        self.btn_ensure = QPushButton("Создать будущие")
+        self.btn_detach = QPushButton("Отсоединить")
+        self.btn_attach = QPushButton("Присоединить...")
+        self.btn_drop = QPushButton("Удалить")
+        act_l.addWidget(self.btn_ensure)
+        act_l.addWidget(self.btn_detach)
+        act_l.addWidget(self.btn_attach)
+        act_l.addWidget(self.btn_drop)
+        act_l.addStretch(1)
+        self.layout.addWidget(self.actions_row)
+
+        self.policy_row = QWidget()
+        pol_l = QHBoxLayout(self.policy_row)
+        pol_l.setContentsMargins(0, 0, 0, 0)
+        self.policy_ahead_spin = QSpinBox()
+        self.policy_ahead_spin.setRange(0, 120)
+        self.retention_spin = QSpinBox()
+        self.retention_spin.setRange(0, 1200)
+        self.retention_spin.setSpecialValueText("без ограничения")
+        self.drop_detached_cb = QCheckBox("Удалять отсоединённые")
+        self.btn_save_policy = QPushButton("Сохранить политику")
+        self.btn_maintain = QPushButton("Обслужить сейчас")
+        pol_l.addWidget(QLabel("Вперёд:"))
+        pol_l.addWidget(self.policy_ahead_spin)
+        pol_l.addWidget(QLabel("Хранить секций:"))
+        pol_l.addWidget(self.retention_spin)
+        pol_l.addWidget(self.drop_detached_cb)
+        pol_l.addStretch(1)
+        pol_l.addWidget(self.btn_save_policy)
+        pol_l.addWidget(self.btn_maintain)
+        self.layout.addWidget(self.policy_row)
+
+        bottom = QHBoxLayout()
+        self.btn_close = QPushButton("Закрыть")
+        bottom.addStretch(1)
+        bottom.addWidget(self.btn_close)
+        self.layout.addLayout(bottom)
+
+        self.btn_convert.clicked.connect(self.handle_convert)
+        self.btn_ensure.clicked.connect(self.handle_ensure)
+        self.btn_detach.clicked.connect(self.handle_detach)
+        self.btn_attach.clicked.connect(self.handle_attach)
+        self.btn_drop.clicked.connect(self.handle_drop)
+        self.btn_save_policy.clicked.connect(self.handle_save_policy)
+        self.btn_maintain.clicked.connect(self.handle_maintain)
+        self.btn_close.clicked.connect(self.accept)
+        self.refresh()
+
+    def refresh(self):
+        try:
+            self.info = self.db.partition_info(self.table_name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось получить секции: {e}")
+            self.info = None
+        partitioned = self.info is not None
+        self.convert_row.setVisible(not partitioned)
+        self.actions_row.setVisible(partitioned)
+        self.policy_row.setVisible(partitioned)
+        self.parts_table.setRowCount(0)
+        if not partitioned:
+            self.status_label.setText("Таблица не секционирована")
+            self.column_combo.clear()
+            try:
+                table = self.db.get_table(self.table_name)
+                for col in table.columns:
+                    type_text = str(col.type).upper()
+                    if "DATE" in type_text or "TIMESTAMP" in type_text:
+                        self.column_combo.addItem(col.name)
+            except Exception:
+                pass
+            self.btn_convert.setEnabled(self.column_combo.count() > 0)
+            return
+        parts = self.info['partitions']
+        self.status_label.setText(
+            f"{self.info['strategy'].upper()} по {self.info['key_column']}, "
+            f"интервал: {self.info['interval'] or '?'}, секций: {len(parts)}")
+        for p in parts:
+            r = self.parts_table.rowCount()
+            self.parts_table.insertRow(r)
+            values = [
+                p['name'],
+                "DEFAULT" if p['default'] else (p['from'].strftime('%Y-%m-%d') if p['from'] else "MINVALUE"),
+                "" if p['default'] else (p['to'].strftime('%Y-%m-%d') if p['to'] else "MAXVALUE"),
+                str(p['rows_estimate']),
+                f"{(p['bytes'] or 0) / 1048576:.1f} МБ",
+            ]
+            for c, v in enumerate(values):
+                self.parts_table.setItem(r, c, QTableWidgetItem(v))
+        policy = self.db.partition_policies().get(self.table_name) or {}
+        self.policy_ahead_spin.setValue(policy.get('periods_ahead') or settings.PARTITION_PERIODS_AHEAD)
+        self.retention_spin.setValue(policy.get('retention') or 0)
+        self.drop_detached_cb.setChecked(bool(policy.get('drop_detached')))
+
+    def _selected_partition(self):
+        row = self.parts_table.currentRow()
+        if row < 0:
+            QMessageBox.warning(self, "Внимание", "Выберите секцию")
+            return None
+        return self.parts_table.item(row, 0).text()
+
+    def _changed(self):
+        self.tablesChanged.emit(self.table_name)
+        self.refresh()
+
+    def handle_convert(self):
+        column = self.column_combo.currentText()
+        if not column:
+            return
+        dlg = ConfirmDialog(f"Пересоздать {self.table_name} как секционированную по {column}?\n"
+                            "Таблица будет заблокирована на время копирования данных.", self)
+        if dlg.exec() != QDialog.Accepted:
+            return
+        try:
+            res = self.db.convert_to_range_partitioned(
+                self.table_name, column, self.interval_combo.currentText(),
+                periods_ahead=self.ahead_spin.value(), drop_inbound_fks=self.drop_fks_cb.isChecked())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        msg = f"Создано секций: {len(res['partitions'])}"
+        if res['dropped_foreign_keys']:
+            msg += "\nУдалены внешние ключи: " + ", ".join(res['dropped_foreign_keys'])
+        QMessageBox.information(self, "Успешно", msg)
+        self._changed()
+
+    def handle_ensure(self):
+        try:
+            created = self.db.ensure_partitions(self.table_name, self.policy_ahead_spin.value())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        QMessageBox.information(self, "Успешно", "Создано: " + (", ".join(created) if created else "ничего"))
+        self.refresh()
+
+    def handle_detach(self):
+        part = self._selected_partition()
+        if not part:
+            return
+        if ConfirmDialog(f"Отсоединить секцию '{part}'? Она станет отдельной таблицей.", self).exec() != QDialog.Accepted:
+            return
+        try:
+            self.db.detach_partition(self.table_name, part)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        self._changed()
+
+    def handle_attach(self):
+        name, ok = QInputDialog.getText(self, "Присоединить", "Таблица:")
+        if not ok or not name.strip():
+            return
+        start_s, ok = QInputDialog.getText(self, "Присоединить", "С (ГГГГ-ММ-ДД):")
+        if not ok:
+            return
+        end_s, ok = QInputDialog.getText(self, "Присоединить", "По (ГГГГ-ММ-ДД, не включая):")
+        if not ok:
+            return
+        try:
+            start = datetime.fromisoformat(start_s.strip())
+            end = datetime.fromisoformat(end_s.strip())
+            self.db.attach_partition(self.table_name, name.strip(), start, end)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        self._changed()
+
+    def handle_drop(self):
+        part = self._selected_partition()
+        if not part:
+            return
+        if ConfirmDialog(f"Удалить секцию '{part}' вместе с данными?", self).exec() != QDialog.Accepted:
+            return
+        try:
+            self.db.drop_partition(self.table_name, part)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        self.refresh()
+
+    def handle_save_policy(self):
+        try:
+            self.db.set_partition_policy(self.table_name, self.policy_ahead_spin.value(),
+                                         self.retention_spin.value() or None, self.drop_detached_cb.isChecked())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        QMessageBox.information(self, "Успешно", "Политика сохранена")
+
+    def handle_maintain(self):
+        try:
+            res = self.db.maintain_partitions(self.table_name, self.policy_ahead_spin.value(),
+                                              self.retention_spin.value() or None, self.drop_detached_cb.isChecked())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        QMessageBox.information(
+            self, "Успешно",
+            f"Создано: {len(res['created'])}, отсоединено: {len(res['detached'])}, удалено: {len(res['dropped'])}")
+        if res['detached']:
+            self._changed()
+        else:
+            self.refresh()
+
+
 class AlterTableDialog(QDialog):
     tablesChanged = Signal(str)
 
@@ -447,8 +798,10 @@ class AlterTableDialog(QDialog):
         top_row = QHBoxLayout()
         self.label_table = QLabel(f"Table: {table_name}")
         btn_rename = QPushButton("Переименовать")
+        btn_partitions = QPushButton("Секционирование")
         top_row.addWidget(self.label_table)
         top_row.addStretch(1)
+        top_row.addWidget(btn_partitions)
         top_row.addWidget(btn_rename)
         self.layout.addLayout(top_row)
         self.scroll = QScrollArea()
@@ -467,6 +820,7 @@ class AlterTableDialog(QDialog):
         bottom_row.addWidget(self.btn_close)
         self.layout.addLayout(bottom_row)
         btn_rename.clicked.connect(self.handle_rename)
+        btn_partitions.clicked.connect(self.handle_partitions)
         self.btn_add.clicked.connect(self.handle_add)
         self.btn_close.clicked.connect(self.reject)
         self.refresh_from_db()
@@ -568,12 +922,15 @@ class AlterTableDialog(QDialog):
             meta_line.setReadOnly(True)
             meta_line.setToolTip(meta_full)
             meta_line.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+            btn_profile = QPushButton("Профиль")
             btn_edit = QPushButton("Изменить")
             btn_delete = QPushButton("Удалить")
+            btn_profile.setFixedWidth(90)
             btn_edit.setFixedWidth(90)
             btn_delete.setFixedWidth(90)
             hl.addWidget(name_label)
             hl.addWidget(meta_line)
+            hl.addWidget(btn_profile)
             hl.addWidget(btn_edit)
             hl.addWidget(btn_delete)
             self.columns_layout.addWidget(row)
@@ -595,6 +952,7 @@ class AlterTableDialog(QDialog):
             else:
                 btn_edit.clicked.connect(lambda _checked, c=col: self.handle_edit(c))
             btn_delete.clicked.connect(lambda _checked, c=col: self.handle_delete(c))
+            btn_profile.clicked.connect(lambda _checked, c=col: self.handle_profile(c))
             idx += 1
 
     def build_data_from_table(self, table):
@@ -713,6 +1071,18 @@ class AlterTableDialog(QDialog):
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", str(e))
 
+    def handle_partitions(self):
+        dlg = PartitionDialog(db=self.db, table_name=self.table_name, parent=self)
+        if self.table_manager:
+            dlg.tablesChanged.connect(self.table_manager.handle_external_change)
+        dlg.exec()
+        self.refresh_from_db()
+
+    def handle_profile(self, col):
+        from profile_form import ColumnProfileDialog
+        dlg = ColumnProfileDialog(self.db, self.table_name, col.name, parent=self)
+        dlg.exec()
+
     def handle_add(self):
         dlg = ColumnEditorDialog(parent=self, db=self.db)
         if dlg.exec() == QDialog.Accepted:
@@ -0,0 +1,405 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from db import Database
+
+logger = logging.getLogger("benchmark")
+
+BENCHMARK_VERSION = 1
+
+
+class ThrowawayPostgres:
+    def __init__(self, pg_bin=None, keep=False):
+        self.pg_bin = pg_bin
+        self.keep = keep
+        self.tmpdir = None
+        self.port = None
+
+    def _tool(self, name):
+        if self.pg_bin:
+            path = os.path.join(self.pg_bin, name)
+            if os.path.exists(path):
+                return path
+        path = shutil.which(name)
+        if path is None:
+            raise RuntimeError(f"Не найден {name}: укажите каталог с бинарниками PostgreSQL через --pg-bin")
+        return path
+
+    @staticmethod
+    def _free_port():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    @property
+    def data_dir(self):
+        return os.path.join(self.tmpdir, "data")
+
+    def start(self):
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise RuntimeError("initdb нельзя запускать от root: запустите бенчмарк от обычного пользователя")
+        self.tmpdir = tempfile.mkdtemp(prefix="db_kr2_bench_")
+        self.port = self._free_port()
+        subprocess.run(
+            [self._tool("initdb"), "-D", self.data_dir, "-U", "postgres", "-A", "trust", "-E", "UTF8", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        opts = (f"-p {self.port} -k {self.tmpdir} -c listen_addresses=localhost "
+                "-c fsync=off -c synchronous_commit=off -c full_page_writes=off")
+        subprocess.run(
+            [self._tool("pg_ctl"), "-D", self.data_dir, "-o", opts, "-l", os.path.join(self.tmpdir, "server.log"), "-w", "start"],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        logger.info("Временный PostgreSQL запущен на порту %s (%s)", self.port, self.tmpdir)
+        return {"user": "postgres", "host": "localhost", "port": self.port, "database": "postgres"}
+
+    def stop(self):
+        if self.tmpdir is None:
+            return
+        try:
+            subprocess.run(
+                [self._tool("pg_ctl"), "-D", self.data_dir, "-m", "fast", "-w", "stop"],
+                check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        finally:
+            if self.keep:
+                logger.info("Каталог кластера сохранён: %s", self.tmpdir)
+            else:
+                shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def _params_from_dsn(dsn):
+    url = make_url(dsn)
+    return {
+        "user": url.username or "",
+        "password": url.password or "",
+        "host": url.host or "localhost",
+        "port": url.port or 5432,
+        "database": url.database or "",
+    }
+
+
+def populate(db, images, seed=None, attack_skew=0.0, workers=None):
+    runs = max(20, images // 100)
+    experiments = max(5, runs // 20)
+    db.reset(experiments=experiments, runs=runs, images=images,
+             attack_skew=attack_skew, seed=seed, workers=workers)
+
+
+def row_counts(db):
+    with db.engine.connect() as conn:
+        return {t: conn.execute(text(f'SELECT count(*) FROM "{t}"')).scalar()
+                for t in ("experiments", "runs", "images")}
+
+
+def measure(fn, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(max(timings), 3),
+    }
+
+
+def _mark_uniques(db, table):
+    constrs = [i['column_names'][0] for i in db.insp.get_unique_constraints(table.name)]
+    for c in table.columns:
+        setattr(c, "_inspector_unique", c.name in constrs)
+
+
+def bench_load_and_build(db, repeat):
+    from view_results_form import TableResultWidget
+    widget = TableResultWidget(db, "SELECT * FROM images ORDER BY image_id")
+    try:
+        return measure(widget.load_and_build, repeat)
+    finally:
+        widget.deleteLater()
+
+
+def _sample_raw_rows(db, limit):
+    with db.engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT run_id, file_path, original_name, attack_type, added_date, coordinates "
+            "FROM images ORDER BY image_id LIMIT :n"), {"n": limit}).mappings().all()
+    out = []
+    for r in rows:
+        raw = {k: ("" if v is None else str(v)) for k, v in r.items()}
+        if r["coordinates"] is not None:
+            raw["coordinates"] = ",".join(str(x) for x in r["coordinates"])
+        raw["file_path"] = raw["file_path"] + ".new"
+        out.append(raw)
+    return out
+
+
+def bench_validate_table_data(db, repeat, rows=1000):
+    from validators import validate_table_data
+    table = db.get_table("images")
+    _mark_uniques(db, table)
+    sample = _sample_raw_rows(db, rows)
+
+    def run():
+        for raw in sample:
+            validate_table_data(table, raw)
+
+    return measure(run, repeat)
+
+
+def bench_check_uniques(db, repeat, rows=1000):
+    table = db.get_table("images")
+    _mark_uniques(db, table)
+    sample = [{"file_path": raw["file_path"]} for raw in _sample_raw_rows(db, rows)]
+
+    def run():
+        for data in sample:
+            db.check_uniques(table, data)
+
+    return measure(run, repeat)
+
+
+def bench_alter_table(db, repeat):
+    base = {
+        'name': 'bench_score', 'enum_name': None, 'not_null': False, 'unique': False,
+        'primary_key': False, 'default': None, 'check': None, 'length': None,
+        'array_elem_type': None, 'fk_table': None, 'fk_column': None,
+    }
+    as_int = dict(base, type='INTEGER', default='0')
+    as_bigint = dict(base, type='BIGINT', default='0')
+    db.alter_table("images", "images", {}, {0: as_int})
+    state = {"current": as_int}
+
+    def run():
+        target = as_bigint if state["current"] is as_int else as_int
+        db.alter_table("images", "images", {0: state["current"]}, {0: target})
+        state["current"] = target
+
+    try:
+        return measure(run, repeat)
+    finally:
+        db.alter_table("images", "images", {0: state["current"]}, {})
+
+
+def bench_replace_column_enum_by_swap(db, repeat):
+    labels = db._get_enum_values("attack_type_enum")
+    if not db._enum_exists("attack_type_enum_bench"):
+        db.create_enum("attack_type_enum_bench", labels)
+    state = {"current": "attack_type_enum"}
+
+    def run():
+        target = "attack_type_enum_bench" if state["current"] == "attack_type_enum" else "attack_type_enum"
+        db.replace_column_enum_by_swap("images", "attack_type", target)
+        state["current"] = target
+
+    try:
+        return measure(run, repeat)
+    finally:
+        if state["current"] != "attack_type_enum":
+            db.replace_column_enum_by_swap("images", "attack_type", "attack_type_enum")
+        db.drop_enum("attack_type_enum_bench")
+
+
+def bench_load_schema_from_db(db, repeat):
+    from view_form import SQLStubWindow
+    stub = SQLStubWindow(db=db)
+    try:
+        return measure(stub._load_schema_from_db, repeat, setup=db.metadata.clear)
+    finally:
+        stub.deleteLater()
+
+
+def _configure_join_query(stub):
+    stub.selected_columns = [("images", "image_id"), ("images", "attack_type"),
+                             ("runs", "accuracy"), ("experiments", "name")]
+    stub.joins = [
+        {'left': 'images', 'right': 'runs', 'lf': 'run_id', 'rf': 'run_id', 'type': 'INNER'},
+        {'left': 'runs', 'right': 'experiments', 'lf': 'experiment_id', 'rf': 'experiment_id', 'type': 'INNER'},
+    ]
+    stub.where_conditions = ["runs.flagged = true"]
+
+
+def _configure_group_query(stub):
+    stub.selected_columns = [("images", "attack_type")]
+    stub.aggregates = [("count", "images.image_id", "cnt")]
+    stub.group_by = ["images.attack_type"]
+
+
+def bench_build_sql(db, repeat, configure):
+    from view_form import SQLStubWindow
+    stub = SQLStubWindow(db=db)
+    configure(stub)
+
+    def run():
+        sql = stub.build_sql()
+        with db.engine.connect() as conn:
+            conn.execute(text(sql)).fetchall()
+
+    try:
+        return measure(run, repeat)
+    finally:
+        stub.deleteLater()
+
+
+BENCHMARKS = [
+    ("load_and_build", bench_load_and_build),
+    ("validate_table_data", bench_validate_table_data),
+    ("check_uniques", bench_check_uniques),
+    ("alter_table", bench_alter_table),
+    ("replace_column_enum_by_swap", bench_replace_column_enum_by_swap),
+    ("_load_schema_from_db", bench_load_schema_from_db),
+    ("build_sql_join", lambda db, repeat: bench_build_sql(db, repeat, _configure_join_query)),
+    ("build_sql_group", lambda db, repeat: bench_build_sql(db, repeat, _configure_group_query)),
+]
+
+
+def run_benchmarks(db, scale, repeat, only=None, seed=None, attack_skew=0.0, workers=None):
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    started = time.perf_counter()
+    populate(db, scale, seed=seed, attack_skew=attack_skew, workers=workers)
+    populate_ms = (time.perf_counter() - started) * 1000.0
+    db.metadata.clear()
+    db._invalidate_schema_snapshot()
+    with db.engine.begin() as conn:
+        conn.execute(text('ALTER TABLE images ADD CONSTRAINT "uniq_images_file_path" UNIQUE (file_path)'))
+    db.insp.clear_cache()
+
+    with db.engine.connect() as conn:
+        server_version = conn.execute(text("SHOW server_version")).scalar()
+
+    results = {}
+    for name, fn in BENCHMARKS:
+        if only and name not in only:
+            continue
+        logger.info("Бенчмарк %s ...", name)
+        results[name] = fn(db, repeat)
+        app.processEvents()
+        logger.info("%s: медиана %.1f мс", name, results[name]["median_ms"])
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "scale": scale,
+            "repeat": repeat,
+            "seed": seed,
+            "attack_skew": attack_skew,
+            "rows": row_counts(db),
+            "populate_ms": round(populate_ms, 3),
+            "postgres": server_version,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    lines = []
+    base_results = baseline.get("results", {})
+    for name, stats in current.get("results", {}).items():
+        base = base_results.get(name)
+        if not base or not base.get("median_ms"):
+            lines.append(f"{name:32} {stats['median_ms']:>12.1f} мс  (нет в базовом прогоне)")
+            continue
+        ratio = stats["median_ms"] / base["median_ms"]
+        flag = ""
+        if ratio > 1.0 + threshold:
+            flag = "  РЕГРЕССИЯ"
+            regressions.append(name)
+        lines.append(f"{name:32} {base['median_ms']:>12.1f} -> {stats['median_ms']:>12.1f} мс  x{ratio:.2f}{flag}")
+    if baseline.get("meta", {}).get("scale") != current.get("meta", {}).get("scale"):
+        lines.append("Внимание: масштаб базового прогона отличается от текущего")
+    return regressions, "\n".join(lines)
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Бенчмарк ключевых операций на синтетических данных")
+    p.add_argument("--scale", type=int, default=10000, help="число строк в images (10000 .. 10000000)")
+    p.add_argument("--repeat", type=int, default=3, help="повторов каждого замера")
+    p.add_argument("--seed", type=float, default=42, help="seed генератора данных")
+    p.add_argument("--skew", type=float, default=0.0, help="перекос распределения attack_type")
+    p.add_argument("--workers", type=int, help="параллельных потоков генерации")
+    p.add_argument("--pg-bin", default=os.environ.get("PG_BIN"), help="каталог с initdb и pg_ctl")
+    p.add_argument("--dsn", help="использовать существующую БД вместо временного кластера (схема public будет пересоздана)")
+    p.add_argument("--keep", action="store_true", help="не удалять каталог временного кластера")
+    p.add_argument("--only", nargs="*", help="запустить только указанные замеры")
+    p.add_argument("--output", "-o", help="файл для результатов в JSON")
+    p.add_argument("--compare", help="JSON базового прогона для поиска регрессий")
+    p.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление медианы (доля)")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
+
+    server = None
+    try:
+        if args.dsn:
+            params = _params_from_dsn(args.dsn)
+        else:
+            server = ThrowawayPostgres(pg_bin=args.pg_bin, keep=args.keep)
+            params = server.start()
+        db = Database(params)
+        db.engine.echo = False
+        try:
+            report = run_benchmarks(db, args.scale, args.repeat, only=set(args.only or []),
+                                    seed=args.seed, attack_skew=args.skew, workers=args.workers)
+        finally:
+            db.close()
+    finally:
+        if server is not None:
+            server.stop()
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, summary = compare(report, baseline, args.threshold)
+        print(summary)
+        if regressions:
+            print("Регрессии: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
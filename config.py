@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,6 +9,44 @@ class Settings(BaseSettings):
     DB_HOST: str
     DB_PORT: int
     DB_NAME: str
+    APP_DATA_DIR: Optional[str] = None
+    PARTITION_PERIODS_AHEAD: int = 3
+    MAINTENANCE_INTERVAL_SEC: int = 3600
+    MATVIEW_CHECK_INTERVAL_SEC: int = 60
+    PREVIEW_DEBOUNCE_MS: int = 300
+    PREVIEW_VALIDATE_TIMEOUT_MS: int = 2000
+    PREVIEW_COST_WARNING: float = 1_000_000.0
+    CROSS_JOIN_WARN_ROWS: int = 100_000
+    CROSS_JOIN_BLOCK_ROWS: int = 10_000_000
+    PREFLIGHT_CONFIRM_COST: float = 5_000_000.0
+    PREFLIGHT_CONFIRM_ROWS: int = 1_000_000
+    BROWSE_STATEMENT_TIMEOUT_MS: int = 30_000
+    BROWSE_LOCK_TIMEOUT_MS: int = 2_000
+    EXPORT_STATEMENT_TIMEOUT_MS: int = 600_000
+    EXPORT_LOCK_TIMEOUT_MS: int = 5_000
+    DDL_STATEMENT_TIMEOUT_MS: int = 300_000
+    DDL_LOCK_TIMEOUT_MS: int = 5_000
+    IMPORT_STATEMENT_TIMEOUT_MS: int = 1_800_000
+    IMPORT_LOCK_TIMEOUT_MS: int = 10_000
+    EDIT_STATEMENT_TIMEOUT_MS: int = 60_000
+    EDIT_LOCK_TIMEOUT_MS: int = 5_000
+    DELETE_BATCH_ROWS: int = 5000
+    DELETE_BATCH_PAUSE_MS: int = 50
+    FK_LOOKUP_LIMIT: int = 20
+    FK_LOOKUP_DEBOUNCE_MS: int = 250
+    FK_LOOKUP_CACHE_TTL_SEC: int = 60
+    IDLE_IN_TRANSACTION_TIMEOUT_MS: int = 300_000
+    HISTORY_MAX_ENTRIES: int = 5000
+    HISTORY_CACHE_ENTRIES: int = 50
+    HISTORY_CACHE_MAX_ROWS: int = 5000
+    HISTORY_CACHE_TTL_SEC: int = 600
+    HISTORY_CACHE_MIN_AGE_SEC: float = 1.0
+    GRID_FILTER_DEBOUNCE_MS: int = 500
+    PROFILE_SAMPLE_ROWS: int = 30_000
+    PROFILE_HISTOGRAM_BUCKETS: int = 20
+    PROFILE_MCV_LIMIT: int = 10
+    SAMPLE_DEFAULT_PERCENT: float = 1.0
+    REWRITE_MB_PER_SEC: float = 100.0
 
     model_config = SettingsConfigDict(
         env_file=Path(__file__).parent / ".env",
@@ -18,6 +57,10 @@ class Settings(BaseSettings):
         return (f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@"
                 f"{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}")
 
+    def data_dir(self) -> Path:
+        if self.APP_DATA_DIR:
+            return Path(self.APP_DATA_DIR)
+        return Path.home() / ".db_kr2"
 
-settings = Settings()
 
+settings = Settings()
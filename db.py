@@ -1,94 +1,304 @@
 import re
 import uuid
+import hashlib
+import json
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 from sqlalchemy import text
 from typing import Optional, Iterable, Dict, Any
 import os
-from sqlalchemy import create_engine, MetaData, Table, inspect, select
+import sqlalchemy
+from sqlalchemy import create_engine, MetaData, Table, inspect, select, Integer, String
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
 
 from config import settings
+from query_model import original_position, quote_ident, to_positional
+
+
+SCHEMA_SNAPSHOT_VERSION = 1
+
+PARTITION_INTERVALS = ('day', 'week', 'month', 'year')
+_PARTITION_NAME_FORMATS = {'day': '%Y%m%d', 'week': '%Y%m%d', 'month': '%Y%m', 'year': '%Y'}
+_matview_state_lock = threading.Lock()
+_saved_queries_lock = threading.Lock()
+_describe_lock = threading.Lock()
+_fk_lookup_lock = threading.Lock()
+_enum_registry_lock = threading.Lock()
+
+TIMEOUT_PROFILES = {
+    'browse': ('просмотр', 'BROWSE_STATEMENT_TIMEOUT_MS', 'BROWSE_LOCK_TIMEOUT_MS'),
+    'export': ('экспорт', 'EXPORT_STATEMENT_TIMEOUT_MS', 'EXPORT_LOCK_TIMEOUT_MS'),
+    'ddl': ('изменение схемы', 'DDL_STATEMENT_TIMEOUT_MS', 'DDL_LOCK_TIMEOUT_MS'),
+    'import': ('загрузка данных', 'IMPORT_STATEMENT_TIMEOUT_MS', 'IMPORT_LOCK_TIMEOUT_MS'),
+    'edit': ('редактирование', 'EDIT_STATEMENT_TIMEOUT_MS', 'EDIT_LOCK_TIMEOUT_MS'),
+}
+DESCRIBE_CACHE_SIZE = 256
+FK_LOOKUP_CACHE_SIZE = 256
+_PARTITION_BOUND_RE = re.compile(r"FOR VALUES FROM \((?P<lo>.+?)\) TO \((?P<hi>.+?)\)$")
 
 
 class Database:
 
+    _schema_fingerprint_sql = text("""
+        SELECT md5(coalesce(string_agg(x, ',' ORDER BY x), '')) FROM (
+            SELECT c.relname || ':' || c.relkind::text || ':' || a.attnum || ':' || a.attname || ':'
+                   || format_type(a.atttypid, a.atttypmod) || ':' || a.attnotnull || ':'
+                   || coalesce(pg_get_expr(d.adbin, d.adrelid), '') AS x
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+            WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm', 'f', 'i')
+            UNION ALL
+            SELECT con.conrelid::regclass::text || ':' || con.conname || ':' || pg_get_constraintdef(con.oid)
+            FROM pg_constraint con
+            JOIN pg_namespace n ON n.oid = con.connamespace
+            WHERE n.nspname = 'public'
+            UNION ALL
+            SELECT t.typname || ':' || string_agg(e.enumlabel, '|' ORDER BY e.enumsortorder)
+            FROM pg_type t
+            JOIN pg_enum e ON e.enumtypid = t.oid
+            JOIN pg_namespace n ON n.oid = t.typnamespace
+            WHERE n.nspname = 'public'
+            GROUP BY t.typname
+        ) s
+    """)
+
     def __init__(self, params= None):
         if params is None:
             self.database_url = settings.get_db_url()
         else:
             self.database_url = self._build_url(params)
-        self.engine: Engine = create_engine(self.database_url, future=True, echo=True)
+        self.engine: Engine = self._create_engine(echo=True)
         conn = self.engine.connect()
         conn.close()
         self._connected = True
         self.SessionLocal = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
         self.metadata = MetaData()
         self.insp = inspect(self.engine)
+        self._snapshot_tables = None
+        self._snapshot_fingerprint = None
+        self._describe_cache = OrderedDict()
+        self._fk_lookup_cache = OrderedDict()
+        self._enum_registry = None
+        self._enum_registry_stamp = None
+
+    _reset_schema_sql = text("""
+        DROP SCHEMA public CASCADE;
+        CREATE SCHEMA public;
+        CREATE TYPE attack_type_enum AS ENUM ('no_attack','blur','noise','adversarial','other');
+        CREATE TABLE experiments (
+            experiment_id SERIAL,
+            name VARCHAR(255) NOT NULL,
+            description TEXT,
+            created_date DATE DEFAULT current_date
+        );
+        CREATE TABLE runs (
+            run_id SERIAL,
+            experiment_id INTEGER NOT NULL,
+            run_date TIMESTAMP DEFAULT now(),
+            accuracy DOUBLE PRECISION,
+            flagged BOOLEAN
+        );
+        CREATE TABLE images (
+            image_id SERIAL,
+            run_id INTEGER NOT NULL,
+            file_path VARCHAR(500) NOT NULL,
+            original_name VARCHAR(255),
+            attack_type attack_type_enum NOT NULL,
+            added_date TIMESTAMP DEFAULT date_trunc('second', now()::timestamp),
+            coordinates INTEGER[]
+        );
+        CREATE TABLE test (id SERIAL PRIMARY KEY);
+    """)
+
+    _reset_experiments_sql = text("""
+        INSERT INTO experiments (experiment_id, name, description)
+        SELECT g,
+               CASE WHEN g <= 5 THEN (ARRAY['Baseline Classification', 'Adversarial Robustness',
+                                            'Noise Sensitivity', 'Blur Tolerance', 'Mixed Attacks'])[g]
+                    ELSE 'Experiment ' || g END,
+               CASE WHEN g <= 5 THEN (ARRAY['Standard image classification without attacks',
+                                            'Testing model resilience against adversarial attacks',
+                                            'Evaluating performance under different noise conditions',
+                                            'Testing model accuracy with various blur levels',
+                                            'Combination of different attack types'])[g]
+                    ELSE 'Synthetic experiment ' || g END
+        FROM generate_series(CAST(:lo AS bigint), CAST(:hi AS bigint)) AS g
+    """)
+
+    _reset_runs_sql = text("""
+        INSERT INTO runs (run_id, experiment_id, run_date, accuracy, flagged)
+        SELECT g,
+               (g % :experiments) + 1,
+               CAST(:date_from AS timestamp) + (CAST(:date_to AS timestamp) - CAST(:date_from AS timestamp)) * random(),
+               round(random()::numeric * 0.4 + 0.6, 4),
+               random() > 0.9
+        FROM generate_series(CAST(:lo AS bigint), CAST(:hi AS bigint)) AS g
+    """)
+
+    _reset_images_sql = text("""
+        INSERT INTO images (image_id, run_id, file_path, original_name, attack_type, added_date, coordinates)
+        SELECT g,
+               (g % :runs) + 1,
+               '/data/images/' || g || '.png',
+               'original_' || g || '.jpg',
+               (enum_range(NULL::attack_type_enum))[width_bucket(random(), CAST(:attack_bounds AS float8[]))],
+               date_trunc('second', CAST(:date_from AS timestamp)
+                   + (CAST(:date_to AS timestamp) - CAST(:date_from AS timestamp)) * random()),
+               CASE WHEN random() >= :null_ratio
+                    THEN ARRAY[floor(random()*1000), floor(random()*1000)]::integer[] END
+        FROM generate_series(CAST(:lo AS bigint), CAST(:hi AS bigint)) AS g
+    """)
+
+    _reset_constraints_sql = text("""
+        ALTER TABLE experiments ADD CONSTRAINT experiments_pkey PRIMARY KEY (experiment_id);
+        ALTER TABLE runs ADD CONSTRAINT runs_pkey PRIMARY KEY (run_id);
+        ALTER TABLE images ADD CONSTRAINT images_pkey PRIMARY KEY (image_id);
+        ALTER TABLE runs ADD CONSTRAINT fk_runs_experiment_id
+            FOREIGN KEY (experiment_id) REFERENCES experiments(experiment_id) ON DELETE CASCADE;
+        ALTER TABLE images ADD CONSTRAINT fk_images_run_id
+            FOREIGN KEY (run_id) REFERENCES runs(run_id) ON DELETE CASCADE;
+        CREATE INDEX idx_runs_experiment_id ON runs (experiment_id);
+        CREATE INDEX idx_images_run_id ON images (run_id);
+    """)
+
+    def reset(self, scale: float = 1.0, experiments: int = 5, runs: int = 20, images: int = 100,
+              attack_skew: float = 0.0, coordinates_null_ratio: float = 0.3,
+              date_from=None, date_to=None, seed=None, workers: int = None, chunk_size: int = 500_000):
+        counts = {
+            'experiments': max(1, int(round(experiments * scale))),
+            'runs': max(1, int(round(runs * scale))),
+            'images': max(0, int(round(images * scale))),
+        }
+        if not 0.0 <= coordinates_null_ratio <= 1.0:
+            raise ValueError("Доля NULL для coordinates должна быть в диапазоне [0, 1]")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size должен быть положительным")
+        if date_to is None:
+            date_to = datetime.now()
+        if date_from is None:
+            date_from = date_to - timedelta(days=30)
+        if date_from > date_to:
+            raise ValueError("Начало диапазона дат позже конца")
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        workers = max(1, min(int(workers), 8))
+
+        with self.guarded_begin('import') as conn:
+            conn.execute(self._reset_schema_sql)
+
+        params = {
+            'experiments': counts['experiments'],
+            'runs': counts['runs'],
+            'date_from': date_from,
+            'date_to': date_to,
+            'null_ratio': coordinates_null_ratio,
+            'attack_bounds': self._attack_bounds(attack_skew),
+        }
+        self._generate_chunks(self._reset_experiments_sql, counts['experiments'], params, chunk_size, 1, seed, 'experiments')
+        self._generate_chunks(self._reset_runs_sql, counts['runs'], params, chunk_size, workers, seed, 'runs')
+        self._generate_chunks(self._reset_images_sql, counts['images'], params, chunk_size, workers, seed, 'images')
+
+        with self.guarded_begin('import') as conn:
+            conn.execute(text("SET LOCAL maintenance_work_mem = '512MB'"))
+            conn.execute(self._reset_constraints_sql)
+            for table, column in (('experiments', 'experiment_id'), ('runs', 'run_id'), ('images', 'image_id')):
+                n = counts[table]
+                conn.execute(text("SELECT setval(pg_get_serial_sequence(:t, :c), :v, :called)"),
+                             {'t': table, 'c': column, 'v': max(n, 1), 'called': n > 0})
+            conn.execute(text("ANALYZE experiments, runs, images"))
+        self._invalidate_schema_snapshot()
+        self._invalidate_enum_registry()
+        return counts
+
+    @staticmethod
+    def _attack_bounds(skew: float, labels: int = 5):
+        weights = [1.0 / (i + 1) ** skew for i in range(labels)]
+        total = sum(weights)
+        bounds = [0.0]
+        for w in weights[:-1]:
+            bounds.append(bounds[-1] + w / total)
+        return bounds
+
+    def _generate_chunks(self, sql, total, params, chunk_size, workers, seed, salt):
+        if total <= 0:
+            return
+        chunks = [(lo, min(lo + chunk_size - 1, total)) for lo in range(1, total + 1, chunk_size)]
+
+        def load(idx, lo, hi):
+            with self.guarded_begin('import') as conn:
+                conn.execute(text("SET LOCAL synchronous_commit = off"))
+                if seed is not None:
+                    conn.execute(text("SELECT setseed(:s)"),
+                                 {'s': random.Random(f"{seed}:{salt}:{idx}").uniform(-1.0, 1.0)})
+                conn.execute(sql, dict(params, lo=lo, hi=hi))
+
+        if workers <= 1 or len(chunks) == 1:
+            for idx, (lo, hi) in enumerate(chunks):
+                load(idx, lo, hi)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(load, idx, lo, hi) for idx, (lo, hi) in enumerate(chunks)]
+            for f in futures:
+                f.result()
+
+    def _create_engine(self, echo=False):
+        idle_ms = int(settings.IDLE_IN_TRANSACTION_TIMEOUT_MS)
+        return create_engine(self.database_url, future=True, echo=echo,
+                             connect_args={'options': f"-c idle_in_transaction_session_timeout={idle_ms}"})
+
+    def timeout_settings(self, profile: str):
+        if profile not in TIMEOUT_PROFILES:
+            raise ValueError(f"Неизвестный профиль таймаутов: {profile!r}")
+        _, statement_attr, lock_attr = TIMEOUT_PROFILES[profile]
+        return int(getattr(settings, statement_attr)), int(getattr(settings, lock_attr))
+
+    def apply_timeouts(self, conn, profile: str):
+        statement_ms, lock_ms = self.timeout_settings(profile)
+        conn.execute(text(f"SET LOCAL statement_timeout = {statement_ms}"))
+        conn.execute(text(f"SET LOCAL lock_timeout = {lock_ms}"))
+
+    def timeout_error(self, exc, profile: str = None):
+        orig = getattr(exc, 'orig', exc)
+        code = getattr(orig, 'pgcode', None)
+        message = str(orig)
+        label = f" (профиль «{TIMEOUT_PROFILES[profile][0]}»)" if profile in TIMEOUT_PROFILES else ''
+        statement_ms, lock_ms = self.timeout_settings(profile) if profile in TIMEOUT_PROFILES else (None, None)
+        if code == '57014' and 'statement timeout' in message:
+            limit = f" {statement_ms} мс" if statement_ms else ''
+            return ValueError(f"Запрос прерван: превышен лимит времени выполнения{limit}{label}. "
+                              f"Сузьте выборку или повторите позже.")
+        if code == '55P03':
+            limit = f" за {lock_ms} мс" if lock_ms else ''
+            return ValueError(f"Не удалось получить блокировку{limit}{label}: "
+                              f"объект занят другим сеансом. Повторите операцию позже.")
+        if code == '25P03' or 'idle-in-transaction' in message:
+            return ValueError("Сервер закрыл сеанс: транзакция простаивала дольше "
+                              f"{int(settings.IDLE_IN_TRANSACTION_TIMEOUT_MS)} мс. Повторите операцию.")
+        return None
 
-    def reset(self):
-        with self.engine.begin() as conn:
-            conn.execute(text("""
-                DROP SCHEMA public CASCADE;
-                CREATE SCHEMA public;
-                CREATE TYPE attack_type_enum AS ENUM ('no_attack','blur','noise','adversarial','other');
-                CREATE TABLE experiments (
-                    experiment_id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    description TEXT,
-                    created_date DATE DEFAULT current_date
-                );
-                CREATE TABLE runs (
-                    run_id SERIAL PRIMARY KEY,
-                    experiment_id INTEGER NOT NULL,
-                    run_date TIMESTAMP DEFAULT now(),
-                    accuracy DOUBLE PRECISION,
-                    flagged BOOLEAN,
-                    CONSTRAINT fk_runs_experiment_id FOREIGN KEY (experiment_id) REFERENCES experiments(experiment_id) ON DELETE CASCADE
-                );
-                CREATE TABLE images (
-                    image_id SERIAL PRIMARY KEY,
-                    run_id INTEGER NOT NULL,
-                    file_path VARCHAR(500) NOT NULL,
-                    original_name VARCHAR(255),
-                    attack_type attack_type_enum NOT NULL,
-                    added_date TIMESTAMP DEFAULT date_trunc('second', now()::timestamp),
-                    coordinates INTEGER[],
-                    CONSTRAINT fk_images_run_id FOREIGN KEY (run_id) REFERENCES runs(run_id) ON DELETE CASCADE
-                );
-                CREATE TABLE test (id SERIAL PRIMARY KEY);
-                INSERT INTO experiments (name, description) VALUES
-                ('Baseline Classification', 'Standard image classification without attacks'),
-                ('Adversarial Robustness', 'Testing model resilience against adversarial attacks'),
-                ('Noise Sensitivity', 'Evaluating performance under different noise conditions'),
-                ('Blur Tolerance', 'Testing model accuracy with various blur levels'),
-                ('Mixed Attacks', 'Combination of different attack types');
-                INSERT INTO runs (experiment_id, run_date, accuracy, flagged)
-                SELECT
-                    (seq.run_id % 5) + 1 as experiment_id,
-                    now() - interval '1 day' * random() * 30 as run_date,
-                    round(random()::numeric * 0.4 + 0.6, 4) as accuracy,
-                    random() > 0.9 as flagged
-                FROM generate_series(1, 20) as seq(run_id);
-                INSERT INTO images (run_id, file_path, original_name, attack_type, added_date, coordinates)
-                SELECT
-                    (seq.image_id % 20) + 1 as run_id,
-                    '/data/images/' || seq.image_id || '.png' as file_path,
-                    'original_' || seq.image_id || '.jpg' as original_name,
-                    CASE floor(random() * 5)
-                        WHEN 0 THEN 'no_attack'::attack_type_enum
-                        WHEN 1 THEN 'blur'::attack_type_enum
-                        WHEN 2 THEN 'noise'::attack_type_enum
-                        WHEN 3 THEN 'adversarial'::attack_type_enum
-                        ELSE 'other'::attack_type_enum
-                    END as attack_type,
-                    now() - interval '1 hour' * random() * 24 * 30 as added_date,
-                    CASE
-                        WHEN random() > 0.3 THEN ARRAY[floor(random()*1000), floor(random()*1000)]
-                        ELSE NULL
-                    END as coordinates
-                FROM generate_series(1, 100) as seq(image_id);
-            """))
+    @contextmanager
+    def guarded_begin(self, profile: str):
+        try:
+            with self.engine.begin() as conn:
+                self.apply_timeouts(conn, profile)
+                yield conn
+        except Exception as e:
+            err = self.timeout_error(e, profile)
+            if err is None:
+                raise
+            raise err from e
 
     def _build_url(self, params):
         user = params.get("DB_USER") or params.get("user") or ""
@@ -108,13 +318,15 @@ class Database:
             except Exception:
                 pass
             self.database_url = url
-            self.engine = create_engine(self.database_url, future=True, echo=False)
+            self.engine = self._create_engine()
             conn = self.engine.connect()
             conn.close()
             self._connected = True
             self.SessionLocal = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
             self.metadata = MetaData()
             self.insp = inspect(self.engine)
+            self._invalidate_schema_snapshot()
+            self._invalidate_enum_registry()
             return True
         except Exception:
             self._connected = False
@@ -128,13 +340,15 @@ class Database:
             except Exception:
                 pass
             self.database_url = url
-            self.engine = create_engine(self.database_url, future=True, echo=False)
+            self.engine = self._create_engine()
             conn = self.engine.connect()
             conn.close()
             self._connected = True
             self.SessionLocal = sessionmaker(bind=self.engine, autoflush=False, autocommit=False, future=True)
             self.metadata = MetaData()
             self.insp = inspect(self.engine)
+            self._invalidate_schema_snapshot()
+            self._invalidate_enum_registry()
             return True
         except Exception:
             self._connected = False
@@ -158,8 +372,265 @@ class Database:
         else:
             self.metadata.reflect(bind=self.engine, only=list(table_names))
 
+    def describe(self, sql: str, refresh: bool = False):
+        body = (sql or '').strip().rstrip(';').strip()
+        if not body:
+            raise ValueError("Пустой запрос")
+        key = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        with _describe_lock:
+            if not refresh and key in self._describe_cache:
+                self._describe_cache.move_to_end(key)
+                return list(self._describe_cache[key])
+        with self.engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                self.apply_timeouts(conn, 'browse')
+                with conn.connection.cursor() as cur:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    cur.execute(f"SELECT * FROM ({body}) AS _d LIMIT 0")
+                    described = [(c.name, c.type_code) for c in cur.description or ()]
+                    cur.execute(
+                        "SELECT oid, format_type(oid, NULL) FROM pg_type WHERE oid = ANY(%s)",
+                        (sorted({oid for _, oid in described}),),
+                    )
+                    type_names = dict(cur.fetchall())
+                    columns = [(name, type_names.get(oid)) for name, oid in described]
+            except Exception as e:
+                raise ValueError(f"Не удалось определить колонки запроса: {e}")
+            finally:
+                trans.rollback()
+        with _describe_lock:
+            self._describe_cache[key] = columns
+            self._describe_cache.move_to_end(key)
+            while len(self._describe_cache) > DESCRIBE_CACHE_SIZE:
+                self._describe_cache.popitem(last=False)
+        return list(columns)
+
+    def fk_target(self, table_name: str, column_name: str):
+        column = self.get_table(table_name).c[column_name]
+        fks = list(column.foreign_keys)
+        if not fks:
+            return None
+        ref = fks[0].column
+        label = next((c for c in ref.table.columns
+                      if c.name != ref.name and isinstance(c.type, String) and not c.foreign_keys), None)
+        ident = quote_ident(ref.table.name) if not ref.table.schema else \
+            f"{quote_ident(ref.table.schema)}.{quote_ident(ref.table.name)}"
+        return {'table': ref.table.name, 'ident': ident, 'key': ref.name,
+                'label': label.name if label is not None else None, 'numeric': isinstance(ref.type, Integer)}
+
+    def _fk_key_max(self, target):
+        cache_key = ('__max', target['ident'], target['key'])
+        with _fk_lookup_lock:
+            hit = self._fk_lookup_cache.get(cache_key)
+            if hit is not None and time.monotonic() - hit[0] <= settings.FK_LOOKUP_CACHE_TTL_SEC:
+                self._fk_lookup_cache.move_to_end(cache_key)
+                return hit[1]
+        with self.engine.connect() as conn:
+            self.apply_timeouts(conn, 'browse')
+            top = conn.execute(text(f"SELECT max({quote_ident(target['key'])}) FROM {target['ident']}")).scalar() or 0
+        with _fk_lookup_lock:
+            self._fk_lookup_cache[cache_key] = (time.monotonic(), top)
+            self._fk_lookup_cache.move_to_end(cache_key)
+            while len(self._fk_lookup_cache) > FK_LOOKUP_CACHE_SIZE:
+                self._fk_lookup_cache.popitem(last=False)
+        return top
+
+    _fk_prefix_index_sql = text("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_am am ON am.oid = i.relam
+            JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = x.indkey[0]
+            JOIN pg_opclass oc ON oc.oid = x.indclass[0]
+            LEFT JOIN pg_collation coll ON coll.oid = x.indcollation[0]
+            WHERE x.indrelid = to_regclass(:ident) AND a.attname = :column
+              AND am.amname = 'btree' AND x.indisvalid AND x.indpred IS NULL
+              AND (oc.opcname IN ('text_pattern_ops', 'varchar_pattern_ops', 'bpchar_pattern_ops')
+                   OR coll.collname IN ('C', 'POSIX')
+                   OR (coll.collname = 'default' AND (
+                       SELECT datcollate IN ('C', 'POSIX') FROM pg_database
+                       WHERE datname = current_database())))
+        )
+    """)
+
+    @staticmethod
+    def _fk_search_column(target):
+        return target['label'] if target['numeric'] else target['key']
+
+    def fk_text_searchable(self, table_name: str, column_name: str):
+        target = self.fk_target(table_name, column_name)
+        if target is None or not self._fk_search_column(target):
+            return False
+        return self._fk_prefix_indexed(target)
+
+    def _fk_prefix_indexed(self, target):
+        column = self._fk_search_column(target)
+        cache_key = ('__index', target['ident'], column)
+        with _fk_lookup_lock:
+            hit = self._fk_lookup_cache.get(cache_key)
+            if hit is not None and time.monotonic() - hit[0] <= settings.FK_LOOKUP_CACHE_TTL_SEC:
+                self._fk_lookup_cache.move_to_end(cache_key)
+                return hit[1]
+        with self.engine.connect() as conn:
+            indexed = bool(conn.execute(self._fk_prefix_index_sql,
+                                        {'ident': target['ident'], 'column': column}).scalar())
+        with _fk_lookup_lock:
+            self._fk_lookup_cache[cache_key] = (time.monotonic(), indexed)
+            self._fk_lookup_cache.move_to_end(cache_key)
+            while len(self._fk_lookup_cache) > FK_LOOKUP_CACHE_SIZE:
+                self._fk_lookup_cache.popitem(last=False)
+        return indexed
+
+    def create_fk_search_index(self, table_name: str, column_name: str):
+        target = self.fk_target(table_name, column_name)
+        if target is None:
+            raise ValueError(f"{table_name}.{column_name} не является внешним ключом")
+        column = self._fk_search_column(target)
+        if not column:
+            raise ValueError(f"В таблице {target['table']} нет текстовой колонки для поиска")
+        index_name = f"{target['table']}_{column}_prefix_idx"[:63]
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote_ident(index_name)} '
+                f'ON {target["ident"]} ({quote_ident(column)} text_pattern_ops)'))
+        with _fk_lookup_lock:
+            self._fk_lookup_cache.pop(('__index', target['ident'], column), None)
+        return index_name
+
+    def fk_lookup(self, table_name: str, column_name: str, prefix: str = '', limit: int = None):
+        target = self.fk_target(table_name, column_name)
+        if target is None:
+            raise ValueError(f"{table_name}.{column_name} не является внешним ключом")
+        prefix = (prefix or '').strip()
+        limit = int(limit or settings.FK_LOOKUP_LIMIT)
+        cache_key = (target['ident'], target['key'], target['label'], prefix, limit)
+        with _fk_lookup_lock:
+            hit = self._fk_lookup_cache.get(cache_key)
+            if hit is not None and time.monotonic() - hit[0] <= settings.FK_LOOKUP_CACHE_TTL_SEC:
+                self._fk_lookup_cache.move_to_end(cache_key)
+                return list(hit[1])
+        key = quote_ident(target['key'])
+        label = quote_ident(target['label']) if target['label'] else 'NULL'
+        base = f"SELECT {key} AS key, CAST({label} AS text) AS label FROM {target['ident']}"
+        params = {'limit': limit}
+        if not prefix:
+            sql = f"{base} ORDER BY {key} LIMIT :limit"
+        elif target['numeric'] and prefix.isdigit() and prefix.startswith('0'):
+            params['exact'] = int(prefix)
+            sql = f"{base} WHERE {key} = :exact LIMIT :limit"
+        elif target['numeric'] and prefix.isdigit():
+            top = self._fk_key_max(target)
+            branches = []
+            lo = int(prefix)
+            for k in range(max(len(str(top)) - len(prefix), 0) + 1):
+                scale = 10 ** k
+                params[f"lo{k}"], params[f"hi{k}"] = lo * scale, (lo + 1) * scale
+                branches.append(f"({base} WHERE {key} >= :lo{k} AND {key} < :hi{k} ORDER BY {key} LIMIT :limit)")
+            sql = "SELECT * FROM (\n" + "\nUNION ALL\n".join(branches) + "\n) AS _fk LIMIT :limit"
+        elif self._fk_search_column(target) and self._fk_prefix_indexed(target):
+            column = label if target['numeric'] else key
+            params['pattern'] = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            sql = f"{base} WHERE {column} LIKE :pattern ORDER BY {column} LIMIT :limit"
+        elif not target['numeric']:
+            params['exact'] = prefix
+            sql = f"{base} WHERE {key} = :exact LIMIT :limit"
+        else:
+            return []
+        with self.engine.connect() as conn:
+            self.apply_timeouts(conn, 'browse')
+            rows = [(r.key, r.label) for r in conn.execute(text(sql), params)]
+        with _fk_lookup_lock:
+            self._fk_lookup_cache[cache_key] = (time.monotonic(), rows)
+            self._fk_lookup_cache.move_to_end(cache_key)
+            while len(self._fk_lookup_cache) > FK_LOOKUP_CACHE_SIZE:
+                self._fk_lookup_cache.popitem(last=False)
+        return list(rows)
+
     def list_tables(self):
-        return self.insp.get_table_names()
+        if self._snapshot_tables is not None:
+            return list(self._snapshot_tables)
+        return self._hide_partitions(self.insp.get_table_names())
+
+    def _hide_partitions(self, tables):
+        sql = text("""
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relispartition
+        """)
+        with self.engine.connect() as conn:
+            children = set(conn.execute(sql).scalars().all())
+        return [t for t in tables if t not in children]
+
+    def schema_fingerprint(self):
+        with self.engine.connect() as conn:
+            return conn.execute(self._schema_fingerprint_sql).scalar()
+
+    def _dsn_key(self):
+        dsn = make_url(self.database_url).render_as_string(hide_password=True)
+        return hashlib.sha1(dsn.encode('utf-8')).hexdigest()
+
+    def _schema_snapshot_path(self):
+        return settings.data_dir() / "schema" / f"{self._dsn_key()}.pickle"
+
+    def load_schema_snapshot(self):
+        try:
+            with open(self._schema_snapshot_path(), 'rb') as f:
+                snap = pickle.load(f)
+        except Exception:
+            return False
+        if not isinstance(snap, dict) or snap.get('version') != SCHEMA_SNAPSHOT_VERSION \
+                or snap.get('sqlalchemy') != sqlalchemy.__version__:
+            return False
+        self.metadata = snap['metadata']
+        self._snapshot_tables = list(snap['tables'])
+        self._snapshot_fingerprint = snap['fingerprint']
+        return True
+
+    def _write_schema_snapshot(self, fingerprint, tables, metadata):
+        path = self._schema_snapshot_path()
+        snap = {
+            'version': SCHEMA_SNAPSHOT_VERSION,
+            'sqlalchemy': sqlalchemy.__version__,
+            'fingerprint': fingerprint,
+            'tables': list(tables),
+            'metadata': metadata,
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump(snap, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def save_schema_snapshot(self):
+        if self._snapshot_tables is None or self._snapshot_fingerprint is None:
+            return False
+        self._write_schema_snapshot(self._snapshot_fingerprint, self._snapshot_tables, self.metadata)
+        return True
+
+    def verify_schema_snapshot(self):
+        fingerprint = self.schema_fingerprint()
+        if self._snapshot_tables is not None and fingerprint == self._snapshot_fingerprint:
+            return None
+        metadata = MetaData()
+        metadata.reflect(bind=self.engine)
+        insp = inspect(self.engine)
+        tables = self._hide_partitions(insp.get_table_names())
+        self._write_schema_snapshot(fingerprint, tables, metadata)
+        return {'fingerprint': fingerprint, 'tables': tables, 'metadata': metadata, 'insp': insp}
+
+    def apply_schema_snapshot(self, snapshot):
+        self._invalidate_enum_registry()
+        self.metadata = snapshot['metadata']
+        self.insp = snapshot['insp']
+        self._snapshot_tables = list(snapshot['tables'])
+        self._snapshot_fingerprint = snapshot['fingerprint']
+
+    def _invalidate_schema_snapshot(self):
+        self._snapshot_tables = None
+        self._snapshot_fingerprint = None
 
     def get_table(self, table_name):
         if table_name not in self.metadata.tables:
@@ -195,6 +666,188 @@ class Database:
         finally:
             session.close()
 
+    def column_types(self, table_name: str):
+        sql = text("""
+            SELECT a.attname, format_type(a.atttypid, a.atttypmod) AS type
+            FROM pg_attribute a
+            WHERE a.attrelid = CAST(:t AS regclass) AND a.attnum > 0 AND NOT a.attisdropped
+        """)
+        with self.engine.connect() as conn:
+            return {r.attname: r.type for r in conn.execute(sql, {'t': self._qual_ident(table_name)})}
+
+    def apply_grid_changes(self, table_name: str, pk_cols, updates, deletes):
+        self._validate_identifier(table_name)
+        if not pk_cols:
+            raise ValueError("Для сохранения изменений нужен первичный ключ")
+        ident = self._qual_ident(table_name)
+        types = self.column_types(table_name)
+        groups = OrderedDict()
+        for pk, values in updates:
+            if values:
+                groups.setdefault(tuple(sorted(values)), []).append((pk, values))
+        statements = []
+        for cols, rows in groups.items():
+            unknown = [c for c in list(pk_cols) + list(cols) if c not in types]
+            if unknown:
+                raise ValueError(f"Колонки не найдены в {table_name}: {', '.join(unknown)}")
+            names = list(pk_cols) + list(cols)
+            params = {}
+            tuples = []
+            for i, (pk, values) in enumerate(rows):
+                cells = []
+                for j, name in enumerate(names):
+                    params[f"v{i}_{j}"] = pk[j] if j < len(pk_cols) else values[name]
+                    cells.append(f"CAST(:v{i}_{j} AS {types[name]})")
+                tuples.append(f"({', '.join(cells)})")
+            aliases = ', '.join(f"c{j}" for j in range(len(names)))
+            assignments = ', '.join(f"{quote_ident(c)} = v.c{len(pk_cols) + j}" for j, c in enumerate(cols))
+            match = ' AND '.join(f"t.{quote_ident(c)} = v.c{j}" for j, c in enumerate(pk_cols))
+            sql = (f"UPDATE {ident} AS t SET {assignments}\n"
+                   f"FROM (VALUES {', '.join(tuples)}) AS v({aliases})\nWHERE {match}")
+            statements.append((sql, params, len(rows)))
+        if deletes:
+            if len(pk_cols) == 1:
+                sql = (f"DELETE FROM {ident} WHERE {quote_ident(pk_cols[0])}"
+                       f" = ANY(CAST(:ids AS {types[pk_cols[0]]}[]))")
+                params = {'ids': [pk[0] for pk in deletes]}
+            else:
+                arrays = ', '.join(f"CAST(:ids{j} AS {types[c]}[])" for j, c in enumerate(pk_cols))
+                sql = (f"DELETE FROM {ident} WHERE ({', '.join(quote_ident(c) for c in pk_cols)})"
+                       f" IN (SELECT * FROM unnest({arrays}))")
+                params = {f"ids{j}": [pk[j] for pk in deletes] for j in range(len(pk_cols))}
+            statements.append((sql, params, len(deletes)))
+        report = {'updated': 0, 'deleted': 0, 'statements': []}
+        with self.guarded_begin('edit') as conn:
+            for sql, params, expected in statements:
+                rowcount = conn.execute(text(sql), params).rowcount
+                if rowcount != expected:
+                    raise ValueError(
+                        f"Затронуто строк: {rowcount} из {expected}. "
+                        f"Часть строк изменена или удалена другим пользователем, изменения отменены"
+                    )
+                report['deleted' if sql.startswith('DELETE') else 'updated'] += rowcount
+                report['statements'].append((sql, params, rowcount))
+        return report
+
+    def delete_rows(self, table_name: str, pk_cols, pks):
+        return self.apply_grid_changes(table_name, pk_cols, [], pks)
+
+    def cascade_plan(self, table_name: str):
+        self._validate_identifier(table_name)
+        sql = text("""
+            SELECT con.conrelid::regclass::text AS child, con.confdeltype::text AS action,
+                   ARRAY(SELECT a.attname
+                         FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                         JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                         ORDER BY k.ord) AS columns,
+                   ARRAY(SELECT a.attname
+                         FROM unnest(con.confkey) WITH ORDINALITY k(attnum, ord)
+                         JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+                         ORDER BY k.ord) AS ref_columns,
+                   ARRAY(SELECT a.attname
+                         FROM pg_index i
+                         CROSS JOIN unnest(i.indkey) WITH ORDINALITY k(attnum, ord)
+                         JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                         WHERE i.indrelid = con.conrelid AND i.indisprimary
+                         ORDER BY k.ord) AS child_pk
+            FROM pg_constraint con
+            WHERE con.confrelid = CAST(:t AS regclass) AND con.contype = 'f' AND con.conparentid = 0
+            ORDER BY con.conname
+        """)
+        with self.engine.connect() as conn:
+            root = conn.execute(text("SELECT CAST(CAST(:t AS regclass) AS text)"),
+                                {'t': self._qual_ident(table_name)}).scalar()
+        nodes = [{'table': root, 'parent': None, 'columns': [], 'ref_columns': [], 'pk': [], 'depth': 0}]
+        blocking = []
+        seen = {root}
+        with self.engine.connect() as conn:
+            stack = [0]
+            while stack:
+                index = stack.pop()
+                for r in conn.execute(sql, {'t': nodes[index]['table']}).mappings().all():
+                    if r['action'] != 'c':
+                        if r['action'] in ('a', 'r'):
+                            blocking.append(r['child'])
+                        continue
+                    if r['child'] in seen:
+                        continue
+                    if not r['child_pk']:
+                        raise ValueError(f"У таблицы {r['child']} нет первичного ключа: пакетное удаление невозможно")
+                    seen.add(r['child'])
+                    nodes.append({'table': r['child'], 'parent': index, 'columns': list(r['columns']),
+                                  'ref_columns': list(r['ref_columns']), 'pk': list(r['child_pk']),
+                                  'depth': nodes[index]['depth'] + 1})
+                    stack.append(len(nodes) - 1)
+        return {'nodes': nodes, 'blocking': blocking}
+
+    def _cascade_predicate(self, nodes, index, root_pred):
+        node = nodes[index]
+        if node['parent'] is None:
+            return root_pred
+        parent = nodes[node['parent']]
+        alias = f"t{node['parent']}"
+        cols = ', '.join(f"t{index}.{quote_ident(c)}" for c in node['columns'])
+        refs = ', '.join(f"{alias}.{quote_ident(c)}" for c in node['ref_columns'])
+        inner = self._cascade_predicate(nodes, node['parent'], root_pred)
+        return f"({cols}) IN (SELECT {refs} FROM {parent['table']} AS {alias} WHERE {inner})"
+
+    def chunked_cascade_delete(self, table_name: str, pk_cols, pks, batch_size: int = None, progress=None):
+        if not pk_cols:
+            raise ValueError("Для удаления нужен первичный ключ")
+        batch_size = int(batch_size or settings.DELETE_BATCH_ROWS)
+        if batch_size <= 0:
+            raise ValueError("Размер пакета должен быть положительным")
+        pause = max(0, settings.DELETE_BATCH_PAUSE_MS) / 1000.0
+        types = self.column_types(table_name)
+        plan = self.cascade_plan(table_name)
+        nodes = plan['nodes']
+        nodes[0]['pk'] = list(pk_cols)
+        params = {f"ids{j}": [pk[j] for pk in pks] for j in range(len(pk_cols))}
+        if len(pk_cols) == 1:
+            root_pred = f"t0.{quote_ident(pk_cols[0])} = ANY(CAST(:ids0 AS {types[pk_cols[0]]}[]))"
+        else:
+            arrays = ', '.join(f"CAST(:ids{j} AS {types[c]}[])" for j, c in enumerate(pk_cols))
+            root_pred = f"({', '.join(f't0.{quote_ident(c)}' for c in pk_cols)}) IN (SELECT * FROM unnest({arrays}))"
+        order = sorted(range(len(nodes)), key=lambda i: -nodes[i]['depth'])
+        predicates = {i: self._cascade_predicate(nodes, i, root_pred) for i in order}
+        totals = {}
+        with self.engine.connect() as conn:
+            self.apply_timeouts(conn, 'export')
+            for i in order:
+                totals[i] = int(conn.execute(
+                    text(f"SELECT count(*) FROM {nodes[i]['table']} AS t{i} WHERE {predicates[i]}"), params
+                ).scalar())
+        report = {'deleted': {}, 'cancelled': False, 'statements': []}
+        for i in order:
+            node = nodes[i]
+            pk = ', '.join(quote_ident(c) for c in node['pk'])
+            inner_pk = ', '.join(f"t{i}.{quote_ident(c)}" for c in node['pk'])
+            sql = text(
+                f"DELETE FROM {node['table']} WHERE ({pk}) IN ("
+                f"SELECT {inner_pk} FROM {node['table']} AS t{i} WHERE {predicates[i]} "
+                f"ORDER BY {inner_pk} LIMIT :batch_size)"
+            )
+            done = 0
+            report['deleted'][node['table']] = 0
+            report['statements'].append((sql.text, params, 0))
+            if progress is not None and progress(node['table'], done, totals[i]) is False:
+                report['cancelled'] = True
+                return report
+            while True:
+                with self.guarded_begin('edit') as conn:
+                    deleted = conn.execute(sql, dict(params, batch_size=batch_size)).rowcount
+                if not deleted:
+                    break
+                done += deleted
+                report['deleted'][node['table']] = done
+                report['statements'][-1] = (sql.text, params, done)
+                if progress is not None and progress(node['table'], done, max(totals[i], done)) is False:
+                    report['cancelled'] = True
+                    return report
+                if pause:
+                    time.sleep(pause)
+        return report
+
     def recreate_tables(self):
         try:
             self.metadata.reflect(bind=self.engine)
@@ -223,39 +876,90 @@ class Database:
         schema, name = self._split_schema_ident(ident)
         return f'"{schema}"."{name}"'
 
-    def list_enums(self):
-
-        sql = text("""
-            SELECT n.nspname AS schema, t.typname AS name, e.enumlabel AS enum_value, e.enumsortorder
-            FROM pg_type t
-            JOIN pg_enum e ON t.oid = e.enumtypid
-            JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
-            WHERE t.typtype = 'e'
-            ORDER BY t.typname, e.enumsortorder
-        """)
+    _enum_registry_sql = text("""
+        SELECT t.oid, n.nspname AS schema, t.typname AS name,
+               ARRAY(SELECT e.enumlabel::text FROM pg_enum e
+                     WHERE e.enumtypid = t.oid ORDER BY e.enumsortorder) AS labels,
+               ARRAY(SELECT ARRAY[CAST(CAST(c.oid AS regclass) AS text), a.attname::text]
+                     FROM pg_depend d
+                     JOIN pg_class c ON c.oid = d.objid AND c.relkind IN ('r', 'p', 'f') AND NOT c.relispartition
+                     JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = d.objsubid AND NOT a.attisdropped
+                     WHERE d.classid = 'pg_class'::regclass AND d.refclassid = 'pg_type'::regclass
+                       AND d.refobjid = t.oid AND d.objsubid > 0
+                     ORDER BY 1) AS columns
+        FROM pg_type t
+        JOIN pg_namespace n ON n.oid = t.typnamespace
+        WHERE t.typtype = 'e'
+        ORDER BY t.typname
+    """)
+
+    _enum_stamp_sql = text("""
+        SELECT concat_ws('/',
+            (SELECT count(*) || ':' || coalesce(max(CAST(CAST(xmin AS text) AS bigint)), 0)
+             FROM pg_type WHERE typtype = 'e'),
+            (SELECT count(*) || ':' || coalesce(max(CAST(CAST(xmin AS text) AS bigint)), 0) FROM pg_enum),
+            (SELECT count(*) || ':' || coalesce(max(CAST(CAST(d.xmin AS text) AS bigint)), 0)
+             FROM pg_depend d JOIN pg_type t ON t.oid = d.refobjid AND t.typtype = 'e'
+             WHERE d.classid = 'pg_class'::regclass AND d.refclassid = 'pg_type'::regclass))
+    """)
+
+    def enum_registry(self, refresh: bool = False):
+        with _enum_registry_lock:
+            if refresh or self._enum_registry is None:
+                with self.engine.connect() as conn:
+                    self._enum_registry_stamp = conn.execute(self._enum_stamp_sql).scalar()
+                    rows = conn.execute(self._enum_registry_sql).mappings().all()
+                self._enum_registry = {
+                    (r['schema'], r['name']): {
+                        'oid': r['oid'], 'schema': r['schema'], 'name': r['name'],
+                        'labels': list(r['labels']), 'columns': [tuple(c) for c in r['columns'] or []],
+                    }
+                    for r in rows
+                }
+            return {k: dict(v, labels=list(v['labels']), columns=list(v['columns']))
+                    for k, v in self._enum_registry.items()}
+
+    def sync_enum_registry(self):
         with self.engine.connect() as conn:
-            res = conn.execute(sql).mappings().all()
+            stamp = conn.execute(self._enum_stamp_sql).scalar()
+        with _enum_registry_lock:
+            if self._enum_registry is not None and stamp == self._enum_registry_stamp:
+                return False
+            self._enum_registry = None
+        self.enum_registry()
+        return True
+
+    def _invalidate_enum_registry(self):
+        with _enum_registry_lock:
+            self._enum_registry = None
+
+    def enum_info(self, name: str):
+        self._validate_identifier(name)
+        return self.enum_registry().get(self._split_schema_ident(name))
+
+    def _move_enum_column(self, table_name: str, column_name: str, new_enum: str):
+        key = self._split_schema_ident(new_enum)
+        column = (table_name, column_name)
+        with _enum_registry_lock:
+            if self._enum_registry is None:
+                return
+            for entry in self._enum_registry.values():
+                if column in entry['columns']:
+                    entry['columns'].remove(column)
+            if key in self._enum_registry:
+                self._enum_registry[key]['columns'].append(column)
+                self._enum_registry[key]['columns'].sort()
+
+    def list_enums(self):
         out = {}
-        for row in res:
-            name = row["name"]
-            val = row["enum_value"]
-            out.setdefault(name, []).append(val)
+        for entry in sorted(self.enum_registry().values(), key=lambda e: e['name']):
+            out.setdefault(entry['name'], entry['labels'])
         return out
 
     def _get_enum_values(self, enum_name: str):
-        self._validate_identifier(enum_name)
-        schema, nm = self._split_schema_ident(enum_name)
-        sql = text("""
-            SELECT e.enumlabel
-            FROM pg_type t
-            JOIN pg_enum e ON t.oid = e.enumtypid
-            JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
-            WHERE t.typname = :typname AND n.nspname = :schema AND t.typtype = 'e'
-            ORDER BY e.enumsortorder
-        """)
-        with self.engine.connect() as conn:
-            rows = conn.execute(sql, {'typname': nm, 'schema': schema}).scalars().all()
-        return list(rows)
+        entry = self.enum_info(enum_name)
+        return list(entry['labels']) if entry else []
+
     def create_enum(self, name: str, values: list):
 
         if not values or not isinstance(values, (list, tuple)):
@@ -277,6 +981,11 @@ class Database:
 
         with self.engine.begin() as conn:
             conn.execute(text(sql), params)
+            oid = conn.execute(text("SELECT CAST(CAST(:t AS regtype) AS oid)"), {'t': ident}).scalar()
+        with _enum_registry_lock:
+            if self._enum_registry is not None:
+                self._enum_registry[(schema, nm)] = {'oid': oid, 'schema': schema, 'name': nm,
+                                                     'labels': list(values), 'columns': []}
 
     def drop_enum(self, name: str, cascade: bool = False):
         self._validate_identifier(name)
@@ -285,20 +994,101 @@ class Database:
         sql = f"DROP TYPE {ident} {'CASCADE' if cascade else 'RESTRICT'};"
         with self.engine.begin() as conn:
             conn.execute(text(sql))
+        with _enum_registry_lock:
+            if self._enum_registry is not None:
+                self._enum_registry.pop((schema, nm), None)
+        if cascade:
+            self.metadata.clear()
+            self.insp = inspect(self.engine)
+            self._invalidate_schema_snapshot()
 
     def _enum_exists(self, name: str) -> bool:
-        self._validate_identifier(name)
-        schema, nm = self._split_schema_ident(name)
-        sql = text("""
-            SELECT 1
+        return self.enum_info(name) is not None
+
+    _enum_impact_sql = text("""
+        WITH e AS (
+            SELECT t.oid, t.typarray
             FROM pg_type t
             JOIN pg_namespace n ON n.oid = t.typnamespace
-            WHERE t.typname = :typname AND n.nspname = :schema AND t.typtype = 'e'
-            LIMIT 1
-        """)
+            WHERE n.nspname = :schema AND t.typname = :name AND t.typtype = 'e'
+        ), cols AS (
+            SELECT c.oid AS relid, a.attnum, a.attname, a.atttypid = e.typarray AS is_array
+            FROM e
+            JOIN pg_depend d ON d.classid = 'pg_class'::regclass AND d.refclassid = 'pg_type'::regclass
+                            AND d.refobjid IN (e.oid, e.typarray) AND d.objsubid > 0
+            JOIN pg_class c ON c.oid = d.objid AND c.relkind IN ('r', 'p', 'f') AND NOT c.relispartition
+            JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = d.objsubid AND NOT a.attisdropped
+        ), views AS (
+            SELECT DISTINCT r.ev_class AS relid
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.classid = 'pg_rewrite'::regclass
+              AND ((d.refclassid = 'pg_type'::regclass AND d.refobjid IN (SELECT oid FROM e UNION ALL SELECT typarray FROM e))
+                   OR (d.refclassid = 'pg_class'::regclass
+                       AND (d.refobjid, d.refobjsubid) IN (SELECT relid, attnum FROM cols)))
+        ), sizes AS (
+            SELECT x.relid,
+                   sum(pg_total_relation_size(pc.oid)) AS bytes,
+                   sum(CASE WHEN pc.reltuples >= 0 THEN pc.reltuples END) AS rows
+            FROM (SELECT relid FROM cols UNION SELECT relid FROM views) x
+            LEFT JOIN LATERAL (SELECT relid FROM pg_partition_tree(x.relid) WHERE isleaf) p ON true
+            JOIN pg_class pc ON pc.oid = coalesce(p.relid, x.relid)
+            GROUP BY x.relid
+        )
+        SELECT 'column' AS kind, CAST(CAST(cols.relid AS regclass) AS text) AS object, cols.attname::text AS detail,
+               cols.is_array, s.rows, s.bytes, st.null_frac
+        FROM cols
+        LEFT JOIN sizes s ON s.relid = cols.relid
+        LEFT JOIN LATERAL (
+            SELECT ps.null_frac FROM pg_stats ps
+            JOIN pg_class pc ON pc.relname = ps.tablename
+            JOIN pg_namespace pn ON pn.oid = pc.relnamespace AND pn.nspname = ps.schemaname
+            WHERE pc.oid = cols.relid AND ps.attname = cols.attname
+            ORDER BY ps.inherited DESC LIMIT 1
+        ) st ON true
+        UNION ALL
+        SELECT CASE v.relkind WHEN 'm' THEN 'matview' ELSE 'view' END, CAST(CAST(v.oid AS regclass) AS text), NULL,
+               CAST(NULL AS boolean), s.rows, s.bytes, CAST(NULL AS real)
+        FROM views
+        JOIN pg_class v ON v.oid = views.relid AND v.relkind IN ('v', 'm')
+        LEFT JOIN sizes s ON s.relid = v.oid
+        UNION ALL
+        SELECT DISTINCT 'function', CAST(CAST(p.oid AS regprocedure) AS text), CAST(NULL AS text),
+               CAST(NULL AS boolean), CAST(NULL AS numeric), CAST(NULL AS numeric), CAST(NULL AS real)
+        FROM pg_depend d
+        JOIN pg_proc p ON p.oid = d.objid
+        WHERE d.classid = 'pg_proc'::regclass AND d.refclassid = 'pg_type'::regclass
+          AND d.refobjid IN (SELECT oid FROM e UNION ALL SELECT typarray FROM e)
+        ORDER BY 1, 2, 3
+    """)
+
+    def enum_impact(self, name: str):
+        self._validate_identifier(name)
+        schema, nm = self._split_schema_ident(name)
         with self.engine.connect() as conn:
-            row = conn.execute(sql, {'typname': nm, 'schema': schema}).first()
-        return bool(row)
+            self.apply_timeouts(conn, 'browse')
+            rows = conn.execute(self._enum_impact_sql, {'schema': schema, 'name': nm}).mappings().all()
+        rate = settings.REWRITE_MB_PER_SEC * 1024 * 1024
+        out = {'enum': name, 'columns': [], 'views': [], 'functions': []}
+        for r in rows:
+            total = int(r['rows']) if r['rows'] is not None else None
+            size = int(r['bytes']) if r['bytes'] is not None else None
+            if r['kind'] == 'column':
+                out['columns'].append({
+                    'table': r['object'], 'column': r['detail'], 'array': r['is_array'], 'rows': total,
+                    'values': None if total is None or r['null_frac'] is None
+                    else int(round(total * (1 - r['null_frac']))),
+                    'bytes': size, 'seconds': None if size is None else size / rate,
+                })
+            elif r['kind'] == 'function':
+                out['functions'].append(r['object'])
+            else:
+                out['views'].append({'name': r['object'], 'kind': r['kind'], 'rows': total, 'bytes': size})
+        tables = {c['table']: c for c in out['columns']}.values()
+        out['rows'] = sum(c['rows'] or 0 for c in tables)
+        out['bytes'] = sum(c['bytes'] or 0 for c in tables)
+        out['seconds'] = out['bytes'] / rate
+        return out
 
     def get_column_enum(self, table_name: str, column_name: str):
 
@@ -326,6 +1116,7 @@ class Database:
         if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', column_name):
             raise ValueError(f"Недопустимое имя колонки: {column_name!r}")
 
+        self.sync_enum_registry()
         if not self._enum_exists(new_enum):
             raise ValueError(f"Enum '{new_enum}' не найден в базе")
 
@@ -342,8 +1133,9 @@ class Database:
             TYPE {enum_ident}
             USING ({col_ident}::text)::{enum_ident};
         """)
-        with self.engine.begin() as conn:
+        with self.guarded_begin('ddl') as conn:
             conn.execute(sql)
+        self._move_enum_column(table_name, column_name, new_enum)
 
     def replace_column_enum_by_swap(self, table_name: str, column_name: str, new_enum: str,
                                     default: str = None):
@@ -354,6 +1146,7 @@ class Database:
         if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', column_name):
             raise ValueError(f"Недопустимое имя колонки: {column_name!r}")
 
+        self.sync_enum_registry()
         if not self._enum_exists(new_enum):
             raise ValueError(f"Enum '{new_enum}' не найден")
 
@@ -386,7 +1179,7 @@ class Database:
         tmp_text_ident = f'"{tmp_text_col}"'
         tmp_enum_ident = f'"{tmp_enum_col}"'
 
-        with self.engine.begin() as conn:
+        with self.guarded_begin('ddl') as conn:
             conn.execute(text(f'ALTER TABLE {tbl_ident} ADD COLUMN {tmp_text_ident} text;'))
 
             conn.execute(
@@ -437,8 +1230,10 @@ class Database:
 
             if not is_nullable:
                 conn.execute(text(f'ALTER TABLE {tbl_ident} ALTER COLUMN {col_ident} SET NOT NULL;'))
+        self._move_enum_column(table_name, column_name, new_enum)
         self.metadata.clear()
         self.insp = inspect(self.engine)
+        self._invalidate_schema_snapshot()
         self.reflect_tables([table_name], refresh=True)
 
     def find_incompatible_enum_values(self, table_name: str, column_name: str, new_enum: str):
@@ -449,6 +1244,7 @@ class Database:
         if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', column_name):
             raise ValueError(f"Недопустимое имя колонки: {column_name!r}")
 
+        self.sync_enum_registry()
         enum_values = self._get_enum_values(new_enum)
         enum_set = set(enum_values)
 
@@ -594,6 +1390,7 @@ class Database:
         session = self.SessionLocal()
 
         try:
+            self.apply_timeouts(session, 'ddl')
             current_table_name = old_table_name
             if old_table_name != new_table_name:
                 session.execute(text(_change_name(old_table_name, new_table_name)))
@@ -779,9 +1576,12 @@ class Database:
             try:
                 apply_changes()
                 session.commit()
-            except Exception:
+            except Exception as e:
                 session.rollback()
+                if self.timeout_error(e) is not None:
+                    raise
                 try:
+                    self.apply_timeouts(session, 'ddl')
                     session.execute(text(f'TRUNCATE TABLE "{current_table_name}" CASCADE'))
                     try:
                         apply_changes()
@@ -794,12 +1594,999 @@ class Database:
             try:
                 self.metadata.clear()
                 self.insp = inspect(self.engine)
+                self._invalidate_schema_snapshot()
+                self._invalidate_enum_registry()
                 self.reflect_tables([current_table_name], refresh=True)
             except:
                 pass
 
-        except Exception:
+        except Exception as e:
             session.rollback()
-            raise
+            err = self.timeout_error(e, 'ddl')
+            if err is None:
+                raise
+            raise err from e
         finally:
             session.close()
+
+    @staticmethod
+    def _partition_floor(value, interval):
+        d = datetime(value.year, value.month, value.day)
+        if interval == 'day':
+            return d
+        if interval == 'week':
+            return d - timedelta(days=d.weekday())
+        if interval == 'month':
+            return d.replace(day=1)
+        if interval == 'year':
+            return d.replace(month=1, day=1)
+        raise ValueError(f"Неизвестный интервал секционирования: {interval!r}")
+
+    @staticmethod
+    def _partition_next(start, interval, steps=1):
+        for _ in range(steps):
+            if interval == 'day':
+                start = start + timedelta(days=1)
+            elif interval == 'week':
+                start = start + timedelta(days=7)
+            elif interval == 'month':
+                start = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+            elif interval == 'year':
+                start = start.replace(year=start.year + 1)
+            else:
+                raise ValueError(f"Неизвестный интервал секционирования: {interval!r}")
+        return start
+
+    @staticmethod
+    def _partition_prev(start, interval):
+        if interval == 'day':
+            return start - timedelta(days=1)
+        if interval == 'week':
+            return start - timedelta(days=7)
+        if interval == 'month':
+            return start.replace(year=start.year - (1 if start.month == 1 else 0),
+                                 month=12 if start.month == 1 else start.month - 1)
+        if interval == 'year':
+            return start.replace(year=start.year - 1)
+        raise ValueError(f"Неизвестный интервал секционирования: {interval!r}")
+
+    @staticmethod
+    def _partition_name(table, start, interval):
+        return f"{table}_p{start.strftime(_PARTITION_NAME_FORMATS[interval])}"
+
+    @staticmethod
+    def _bound_literal(value):
+        return "'" + value.strftime('%Y-%m-%d %H:%M:%S') + "'"
+
+    @staticmethod
+    def _parse_bound(raw):
+        raw = raw.strip()
+        if raw.upper() in ('MINVALUE', 'MAXVALUE'):
+            return None
+        raw = raw.strip("'")
+        try:
+            return datetime.fromisoformat(raw[:19])
+        except ValueError:
+            return datetime.fromisoformat(raw[:10])
+
+    @staticmethod
+    def _infer_partition_interval(start, end):
+        days = (end - start).days
+        if days == 1:
+            return 'day'
+        if days == 7:
+            return 'week'
+        if 28 <= days <= 31:
+            return 'month'
+        if days in (365, 366):
+            return 'year'
+        return None
+
+    def partition_info(self, table_name: str):
+        self._validate_identifier(table_name)
+        schema, name = self._split_schema_ident(table_name)
+        key_sql = text("""
+            SELECT pt.partstrat, pg_get_partkeydef(p.oid) AS keydef, a.attname AS key_column,
+                   format_type(a.atttypid, a.atttypmod) AS key_type
+            FROM pg_partitioned_table pt
+            JOIN pg_class p ON p.oid = pt.partrelid
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            LEFT JOIN pg_attribute a ON a.attrelid = p.oid AND a.attnum = pt.partattrs[0]
+            WHERE n.nspname = :schema AND p.relname = :name
+        """)
+        parts_sql = text("""
+            SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound,
+                   greatest(c.reltuples, 0)::bigint AS rows_estimate,
+                   pg_total_relation_size(c.oid) AS bytes
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = :schema AND p.relname = :name
+            ORDER BY c.relname
+        """)
+        with self.engine.connect() as conn:
+            key = conn.execute(key_sql, {'schema': schema, 'name': name}).mappings().first()
+            if not key:
+                return None
+            rows = conn.execute(parts_sql, {'schema': schema, 'name': name}).mappings().all()
+        partitions = []
+        default = None
+        for r in rows:
+            bound = r['bound'] or ''
+            item = {'name': r['name'], 'from': None, 'to': None,
+                    'rows_estimate': r['rows_estimate'], 'bytes': r['bytes'], 'default': False}
+            if bound == 'DEFAULT':
+                item['default'] = True
+                default = r['name']
+            else:
+                m = _PARTITION_BOUND_RE.search(bound)
+                if m:
+                    item['from'] = self._parse_bound(m.group('lo'))
+                    item['to'] = self._parse_bound(m.group('hi'))
+            partitions.append(item)
+        partitions.sort(key=lambda x: (x['default'], x['from'] or datetime.min))
+        interval = None
+        for item in partitions:
+            if item['from'] and item['to']:
+                interval = self._infer_partition_interval(item['from'], item['to'])
+                if interval:
+                    break
+        return {
+            'strategy': {'r': 'range', 'l': 'list', 'h': 'hash'}.get(key['partstrat'], key['partstrat']),
+            'key': key['keydef'],
+            'key_column': key['key_column'],
+            'key_type': key['key_type'],
+            'interval': interval,
+            'default': default,
+            'partitions': partitions,
+        }
+
+    def list_partitioned_tables(self):
+        sql = text("""
+            SELECT p.relname
+            FROM pg_partitioned_table pt
+            JOIN pg_class p ON p.oid = pt.partrelid
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = 'public' AND pt.partstrat = 'r' AND NOT p.relispartition
+            ORDER BY p.relname
+        """)
+        with self.engine.connect() as conn:
+            return list(conn.execute(sql).scalars().all())
+
+    def _time_column_type(self, conn, schema, table, column):
+        sql = text("""
+            SELECT data_type, is_nullable
+            FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = :table AND column_name = :column
+        """)
+        row = conn.execute(sql, {'schema': schema, 'table': table, 'column': column}).mappings().first()
+        if not row:
+            raise ValueError(f"Колонка {table}.{column} не найдена")
+        if row['data_type'] not in ('timestamp without time zone', 'timestamp with time zone', 'date'):
+            raise ValueError(f"Колонка {column} должна иметь тип date или timestamp, а не {row['data_type']}")
+        return row['data_type']
+
+    def convert_to_range_partitioned(self, table_name: str, column_name: str, interval: str = 'month',
+                                     periods_ahead: int = None, drop_inbound_fks: bool = False):
+        self._validate_identifier(table_name)
+        if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', column_name or ''):
+            raise ValueError(f"Недопустимое имя колонки: {column_name!r}")
+        if interval not in PARTITION_INTERVALS:
+            raise ValueError(f"Интервал должен быть одним из: {', '.join(PARTITION_INTERVALS)}")
+        if periods_ahead is None:
+            periods_ahead = settings.PARTITION_PERIODS_AHEAD
+        schema, name = self._split_schema_ident(table_name)
+        ident = f'"{schema}"."{name}"'
+        old_name = f'{name}__unpartitioned'
+        old_ident = f'"{schema}"."{old_name}"'
+        col_ident = f'"{column_name}"'
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f'LOCK TABLE {ident} IN ACCESS EXCLUSIVE MODE'))
+            relkind = conn.execute(text("SELECT relkind::text FROM pg_class WHERE oid = CAST(:t AS regclass)"),
+                                   {'t': ident}).scalar()
+            if relkind == 'p':
+                raise ValueError(f"Таблица {name} уже секционирована")
+            if relkind != 'r':
+                raise ValueError(f"{name} не является обычной таблицей")
+            self._time_column_type(conn, schema, name, column_name)
+            if conn.execute(text(f'SELECT 1 FROM {ident} WHERE {col_ident} IS NULL LIMIT 1')).first():
+                raise ValueError(f"В колонке {column_name} есть NULL: ключ секционирования должен быть заполнен")
+
+            constraints = conn.execute(text("""
+                SELECT con.conname, con.contype::text AS contype, pg_get_constraintdef(con.oid) AS def,
+                       ARRAY(SELECT a.attname
+                             FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                             JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                             ORDER BY k.ord) AS columns
+                FROM pg_constraint con
+                WHERE con.conrelid = CAST(:t AS regclass) AND con.contype IN ('p', 'u', 'f')
+                ORDER BY con.contype DESC, con.conname
+            """), {'t': ident}).mappings().all()
+            inbound = conn.execute(text("""
+                SELECT con.conrelid::regclass::text AS tbl, con.conname
+                FROM pg_constraint con
+                WHERE con.confrelid = CAST(:t AS regclass) AND con.contype = 'f' AND con.conparentid = 0
+            """), {'t': ident}).mappings().all()
+            indexes = conn.execute(text("""
+                SELECT i.relname, pg_get_indexdef(i.oid) AS def
+                FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = CAST(:t AS regclass)
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+            """), {'t': ident}).mappings().all()
+            columns = conn.execute(text("""
+                SELECT a.attname, a.attidentity::text AS identity,
+                       pg_get_serial_sequence(CAST(:t AS text), a.attname) AS seq
+                FROM pg_attribute a
+                WHERE a.attrelid = CAST(:t AS regclass) AND a.attnum > 0 AND NOT a.attisdropped
+            """), {'t': ident}).mappings().all()
+            bounds = conn.execute(text(f'SELECT min({col_ident}), max({col_ident}) FROM {ident}')).first()
+
+            if inbound and not drop_inbound_fks:
+                refs = ', '.join(f"{r['tbl']}.{r['conname']}" for r in inbound)
+                raise ValueError(f"На таблицу ссылаются внешние ключи ({refs}); секционированная таблица "
+                                 f"не может их сохранить. Разрешите их удаление.")
+            for r in inbound:
+                conn.execute(text(f'ALTER TABLE {r["tbl"]} DROP CONSTRAINT "{r["conname"]}"'))
+
+            conn.execute(text(f'ALTER TABLE {ident} RENAME TO "{old_name}"'))
+            for r in indexes:
+                conn.execute(text(f'DROP INDEX "{schema}"."{r["relname"]}"'))
+            for c in constraints:
+                if c['contype'] in ('p', 'u'):
+                    conn.execute(text(f'ALTER TABLE {old_ident} DROP CONSTRAINT "{c["conname"]}"'))
+
+            conn.execute(text(f"""
+                CREATE TABLE {ident} (LIKE {old_ident} INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+                    INCLUDING IDENTITY INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS)
+                PARTITION BY RANGE ({col_ident})
+            """))
+            for c in columns:
+                if c['seq'] and not c['identity']:
+                    conn.execute(text(f'ALTER SEQUENCE {c["seq"]} OWNED BY {ident}."{c["attname"]}"'))
+
+            now = datetime.now()
+            lo = self._partition_floor(bounds[0] or now, interval)
+            hi = self._partition_next(self._partition_floor(max(bounds[1] or now, now), interval), interval, periods_ahead + 1)
+            created = []
+            start = lo
+            while start < hi:
+                end = self._partition_next(start, interval)
+                part = self._partition_name(name, start, interval)
+                conn.execute(text(f'CREATE TABLE "{schema}"."{part}" PARTITION OF {ident} '
+                                  f'FOR VALUES FROM ({self._bound_literal(start)}) TO ({self._bound_literal(end)})'))
+                created.append(part)
+                start = end
+            conn.execute(text(f'CREATE TABLE "{schema}"."{name}_default" PARTITION OF {ident} DEFAULT'))
+
+            conn.execute(text(f'INSERT INTO {ident} OVERRIDING SYSTEM VALUE SELECT * FROM {old_ident}'))
+
+            for c in constraints:
+                if c['contype'] not in ('p', 'u'):
+                    continue
+                cols = list(c['columns'])
+                if column_name not in cols:
+                    cols.append(column_name)
+                kind = 'PRIMARY KEY' if c['contype'] == 'p' else 'UNIQUE'
+                col_list = ', '.join(f'"{x}"' for x in cols)
+                conn.execute(text(f'ALTER TABLE {ident} ADD CONSTRAINT "{c["conname"]}" {kind} ({col_list})'))
+            for r in indexes:
+                conn.execute(text(r['def']))
+            for c in constraints:
+                if c['contype'] == 'f':
+                    conn.execute(text(f'ALTER TABLE {ident} ADD CONSTRAINT "{c["conname"]}" {c["def"]}'))
+
+            conn.execute(text(f'DROP TABLE {old_ident}'))
+            for c in columns:
+                if c['identity']:
+                    conn.execute(text(f"""
+                        SELECT setval(pg_get_serial_sequence(:t, :c), coalesce(max("{c['attname']}"), 1),
+                                      max("{c['attname']}") IS NOT NULL)
+                        FROM {ident}
+                    """), {'t': ident, 'c': c['attname']})
+            conn.execute(text(f'ANALYZE {ident}'))
+
+        self.metadata.clear()
+        self.insp = inspect(self.engine)
+        self._invalidate_schema_snapshot()
+        self.reflect_tables([name], refresh=True)
+        return {
+            'partitions': created + [f'{name}_default'],
+            'dropped_foreign_keys': [f"{r['tbl']}.{r['conname']}" for r in inbound],
+        }
+
+    def _require_range_partitioned(self, table_name):
+        info = self.partition_info(table_name)
+        if info is None or info['strategy'] != 'range':
+            raise ValueError(f"Таблица {table_name} не секционирована по диапазону")
+        return info
+
+    def _require_partition_of(self, info, partition):
+        self._validate_identifier(partition)
+        if partition not in [p['name'] for p in info['partitions']]:
+            raise ValueError(f"{partition} не является секцией этой таблицы")
+
+    def create_partition(self, table_name: str, start, end=None, interval: str = None, name: str = None):
+        info = self._require_range_partitioned(table_name)
+        interval = interval or info['interval']
+        if end is None:
+            if interval is None:
+                raise ValueError("Не удалось определить интервал секций: укажите конец диапазона")
+            start = self._partition_floor(start, interval)
+            end = self._partition_next(start, interval)
+        if start >= end:
+            raise ValueError("Начало диапазона должно быть раньше конца")
+        schema, parent = self._split_schema_ident(table_name)
+        if name is None:
+            name = self._partition_name(parent, start, interval) if interval else f"{parent}_p{start.strftime('%Y%m%d')}"
+        self._validate_identifier(name)
+        parent_ident = f'"{schema}"."{parent}"'
+        part_ident = f'"{schema}"."{name}"'
+        key_ident = f'"{info["key_column"]}"'
+        lo, hi = self._bound_literal(start), self._bound_literal(end)
+        bound = f'FOR VALUES FROM ({lo}) TO ({hi})'
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f'LOCK TABLE {parent_ident} IN SHARE UPDATE EXCLUSIVE MODE'))
+            existing = conn.execute(text("""
+                SELECT EXISTS (SELECT 1 FROM pg_inherits i
+                               WHERE i.inhrelid = c.oid AND i.inhparent = to_regclass(:parent))
+                FROM pg_class c WHERE c.oid = to_regclass(:ident)
+            """), {'ident': part_ident, 'parent': parent_ident}).first()
+            if existing is not None:
+                if existing[0]:
+                    return name
+                raise ValueError(f"Таблица {name} уже существует и не является секцией {parent}")
+            default = info['default']
+            moved = False
+            if default:
+                default_ident = f'"{schema}"."{default}"'
+                moved = conn.execute(text(
+                    f'SELECT 1 FROM {default_ident} WHERE {key_ident} >= {lo} AND {key_ident} < {hi} LIMIT 1')).first()
+            if moved:
+                conn.execute(text(f'ALTER TABLE {parent_ident} DETACH PARTITION {default_ident}'))
+                conn.execute(text(f'CREATE TABLE IF NOT EXISTS {part_ident} PARTITION OF {parent_ident} {bound}'))
+                conn.execute(text(f"""
+                    WITH m AS (
+                        DELETE FROM {default_ident}
+                        WHERE {key_ident} >= {lo} AND {key_ident} < {hi}
+                        RETURNING *
+                    )
+                    INSERT INTO {part_ident} SELECT * FROM m
+                """))
+                conn.execute(text(f'ALTER TABLE {parent_ident} ATTACH PARTITION {default_ident} DEFAULT'))
+            else:
+                conn.execute(text(f'CREATE TABLE IF NOT EXISTS {part_ident} PARTITION OF {parent_ident} {bound}'))
+        return name
+
+    def ensure_partitions(self, table_name: str, periods_ahead: int = None):
+        if periods_ahead is None:
+            periods_ahead = settings.PARTITION_PERIODS_AHEAD
+        info = self._require_range_partitioned(table_name)
+        interval = info['interval']
+        if interval is None:
+            raise ValueError(f"Не удалось определить интервал секций таблицы {table_name}")
+        ranged = [p for p in info['partitions'] if p['from'] and p['to']]
+        current = self._partition_floor(datetime.now(), interval)
+        target = self._partition_next(current, interval, periods_ahead + 1)
+        created = []
+        start = current
+        while start < target:
+            end = self._partition_next(start, interval)
+            if not any(p['from'] < end and start < p['to'] for p in ranged):
+                created.append(self.create_partition(table_name, start, end, interval=interval))
+            start = end
+        return created
+
+    def detach_partition(self, table_name: str, partition: str, concurrently: bool = False):
+        info = self._require_range_partitioned(table_name)
+        self._require_partition_of(info, partition)
+        schema, parent = self._split_schema_ident(table_name)
+        sql = f'ALTER TABLE "{schema}"."{parent}" DETACH PARTITION "{schema}"."{partition}"'
+        if concurrently:
+            if info['default']:
+                raise ValueError("DETACH CONCURRENTLY недоступен, пока у таблицы есть секция DEFAULT")
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(sql + ' CONCURRENTLY'))
+        else:
+            with self.engine.begin() as conn:
+                conn.execute(text(sql))
+
+    def attach_partition(self, table_name: str, partition: str, start, end):
+        self._require_range_partitioned(table_name)
+        self._validate_identifier(partition)
+        if start >= end:
+            raise ValueError("Начало диапазона должно быть раньше конца")
+        schema, parent = self._split_schema_ident(table_name)
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                f'ALTER TABLE "{schema}"."{parent}" ATTACH PARTITION "{schema}"."{partition}" '
+                f'FOR VALUES FROM ({self._bound_literal(start)}) TO ({self._bound_literal(end)})'))
+
+    def drop_partition(self, table_name: str, partition: str):
+        info = self._require_range_partitioned(table_name)
+        self._require_partition_of(info, partition)
+        schema, _ = self._split_schema_ident(table_name)
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE "{schema}"."{partition}"'))
+
+    def maintain_partitions(self, table_name: str, periods_ahead: int = None, retention: int = None,
+                            drop_detached: bool = False):
+        created = self.ensure_partitions(table_name, periods_ahead)
+        detached = []
+        dropped = []
+        if retention:
+            info = self._require_range_partitioned(table_name)
+            cutoff = self._partition_floor(datetime.now(), info['interval'])
+            for _ in range(int(retention)):
+                cutoff = self._partition_prev(cutoff, info['interval'])
+            schema, _ = self._split_schema_ident(table_name)
+            for p in info['partitions']:
+                if p['default'] or p['to'] is None or p['to'] > cutoff:
+                    continue
+                self.detach_partition(table_name, p['name'])
+                detached.append(p['name'])
+                if drop_detached:
+                    with self.engine.begin() as conn:
+                        conn.execute(text(f'DROP TABLE "{schema}"."{p["name"]}"'))
+                    dropped.append(p['name'])
+        return {'created': created, 'detached': detached, 'dropped': dropped}
+
+    def _partition_policies_path(self):
+        return settings.data_dir() / "partitions" / f"{self._dsn_key()}.json"
+
+    def partition_policies(self):
+        try:
+            with open(self._partition_policies_path(), encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def set_partition_policy(self, table_name: str, periods_ahead: int = None, retention: int = None,
+                             drop_detached: bool = False):
+        self._validate_identifier(table_name)
+        policies = self.partition_policies()
+        policies[table_name] = {
+            'periods_ahead': periods_ahead,
+            'retention': retention,
+            'drop_detached': bool(drop_detached),
+        }
+        path = self._partition_policies_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(policies, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def maintain_all_partitions(self):
+        policies = self.partition_policies()
+        partitioned = set(self.list_partitioned_tables())
+        report = {}
+        for table, policy in policies.items():
+            if table not in partitioned:
+                continue
+            policy = policy or {}
+            try:
+                report[table] = self.maintain_partitions(
+                    table,
+                    periods_ahead=policy.get('periods_ahead'),
+                    retention=policy.get('retention'),
+                    drop_detached=policy.get('drop_detached', False),
+                )
+            except (ValueError, SQLAlchemyError) as e:
+                report[table] = {'error': str(getattr(e, 'orig', None) or e).strip()}
+        return report
+
+    def list_matviews(self):
+        sql = text("""
+            SELECT n.nspname AS schema, c.relname AS name, c.relispopulated AS populated,
+                   pg_total_relation_size(c.oid) AS bytes,
+                   EXISTS (
+                       SELECT 1 FROM pg_index x
+                       WHERE x.indrelid = c.oid AND x.indisunique AND x.indpred IS NULL
+                         AND x.indexprs IS NULL AND x.indisvalid
+                   ) AS has_unique_index
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'm' AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+            ORDER BY n.nspname, c.relname
+        """)
+        with self.engine.connect() as conn:
+            return [dict(r) for r in conn.execute(sql).mappings().all()]
+
+    def view_definition(self, name: str) -> str:
+        self._validate_identifier(name)
+        schema, nm = self._split_schema_ident(name)
+        sql = text("SELECT pg_get_viewdef(CAST(:v AS regclass), true)")
+        with self.engine.connect() as conn:
+            definition = conn.execute(sql, {'v': f'"{schema}"."{nm}"'}).scalar()
+        if not definition:
+            raise ValueError(f"Представление {name} не найдено")
+        return definition.strip().rstrip(';').strip()
+
+    def _matview_key(self, name: str):
+        self._validate_identifier(name)
+        schema, nm = self._split_schema_ident(name)
+        return f"{schema}.{nm}", f'"{schema}"."{nm}"'
+
+    def matview_columns(self, name: str):
+        _, ident = self._matview_key(name)
+        sql = text("""
+            SELECT a.attname FROM pg_attribute a
+            WHERE a.attrelid = CAST(:v AS regclass) AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum
+        """)
+        with self.engine.connect() as conn:
+            return list(conn.execute(sql, {'v': ident}).scalars().all())
+
+    def matview_base_tables(self, name: str):
+        _, ident = self._matview_key(name)
+        sql = text("""
+            WITH RECURSIVE deps(oid, relkind) AS (
+                SELECT CAST(CAST(:v AS regclass) AS oid), 'm'::text
+                UNION
+                SELECT dc.oid, dc.relkind::text
+                FROM deps
+                JOIN pg_rewrite r ON r.ev_class = deps.oid
+                JOIN pg_depend d ON d.objid = r.oid
+                    AND d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass
+                JOIN pg_class dc ON dc.oid = d.refobjid AND dc.oid <> deps.oid
+                WHERE deps.relkind IN ('m', 'v')
+            )
+            SELECT DISTINCT n.nspname || '.' || c.relname
+            FROM deps
+            JOIN pg_class c ON c.oid = deps.oid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE deps.relkind IN ('r', 'p', 'm') AND deps.oid <> CAST(CAST(:v AS regclass) AS oid)
+        """)
+        with self.engine.connect() as conn:
+            return sorted(conn.execute(sql, {'v': ident}).scalars().all())
+
+    def table_write_counters(self, tables):
+        if not tables:
+            return {}
+        sql = text("""
+            SELECT t.name, coalesce(sum(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0)::bigint AS writes
+            FROM unnest(CAST(:tables AS text[])) AS t(name)
+            LEFT JOIN LATERAL (
+                SELECT CAST(t.name AS regclass) AS relid
+                UNION
+                SELECT relid FROM pg_partition_tree(CAST(t.name AS regclass))
+            ) p ON true
+            LEFT JOIN pg_stat_user_tables s ON s.relid = p.relid
+            GROUP BY t.name
+        """)
+        with self.engine.connect() as conn:
+            return {r.name: int(r.writes) for r in conn.execute(sql, {'tables': list(tables)})}
+
+    def table_row_estimates(self, tables):
+        if not tables:
+            return {}
+        sql = text("""
+            SELECT t.name,
+                   sum(c.reltuples) FILTER (WHERE c.reltuples >= 0 AND c.relkind <> 'p')::bigint AS reltuples
+            FROM unnest(CAST(:tables AS text[])) AS t(name)
+            JOIN LATERAL (
+                SELECT to_regclass(t.name) AS relid
+                UNION
+                SELECT relid FROM pg_partition_tree(to_regclass(t.name))
+            ) p ON true
+            JOIN pg_class c ON c.oid = p.relid
+            GROUP BY t.name
+        """)
+        with self.engine.connect() as conn:
+            rows = conn.execute(sql, {'tables': list(tables)}).all()
+        return {r.name: (int(r.reltuples) if r.reltuples is not None else None) for r in rows}
+
+    def table_row_counts(self, tables):
+        try:
+            counts = self.table_row_estimates(tables)
+        except Exception:
+            counts = {}
+        for t in tables:
+            if counts.get(t) is None:
+                try:
+                    counts[t] = self.estimate_rows(f"SELECT * FROM {quote_ident(t)}")
+                except Exception:
+                    counts[t] = None
+        return counts
+
+    def estimate_rows(self, sql: str, params: Dict[str, Any] = None):
+        report = self.validate_query(sql, params)
+        if not report.get('ok') or report.get('rows') is None:
+            return None
+        return int(report['rows'])
+
+    def exact_row_count(self, sql: str, params: Dict[str, Any] = None) -> int:
+        with self.engine.connect() as conn:
+            self.apply_timeouts(conn, 'export')
+            return int(conn.execute(text(f"SELECT count(*) FROM (\n{sql}\n) AS _count"), params or {}).scalar())
+
+    def index_leading_columns(self, table_name: str):
+        sql = text("""
+            SELECT DISTINCT a.attname, a.attnotnull
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indrelid = to_regclass(:t) AND i.indisvalid AND i.indpred IS NULL
+        """)
+        with self.engine.connect() as conn:
+            return {r.attname: bool(r.attnotnull) for r in conn.execute(sql, {'t': table_name})}
+
+    def _profile_target(self, table_name: str, column_name: str):
+        self._validate_identifier(table_name)
+        if not isinstance(column_name, str) or not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', column_name):
+            raise ValueError(f"Недопустимое имя колонки: {column_name!r}")
+        schema, name = self._split_schema_ident(table_name)
+        return schema, name, f'"{schema}"."{name}"', f'"{column_name}"'
+
+    def column_stats(self, table_name: str, column_name: str):
+        schema, name, tbl_ident, _ = self._profile_target(table_name, column_name)
+        sql = text("""
+            SELECT s.null_frac, s.n_distinct, s.correlation,
+                   CAST(CAST(s.most_common_vals AS text) AS text[]) AS mcv, s.most_common_freqs AS mcf,
+                   CAST(CAST(s.histogram_bounds AS text) AS text[]) AS hist,
+                   greatest(t.last_analyze, t.last_autoanalyze) AS analyzed_at
+            FROM pg_stats s
+            LEFT JOIN pg_stat_user_tables t ON t.schemaname = s.schemaname AND t.relname = s.tablename
+            WHERE s.schemaname = :schema AND s.tablename = :table AND s.attname = :column
+            ORDER BY s.inherited DESC
+            LIMIT 1
+        """)
+        with self.engine.connect() as conn:
+            row = conn.execute(sql, {'schema': schema, 'table': name, 'column': column_name}).mappings().first()
+        if row is None:
+            return None
+        rows = self.table_row_estimates([tbl_ident]).get(tbl_ident)
+        n_distinct = row['n_distinct']
+        if n_distinct is not None and n_distinct < 0:
+            n_distinct = -n_distinct * rows if rows else None
+        return {
+            'source': 'pg_stats',
+            'rows': rows,
+            'null_frac': row['null_frac'],
+            'distinct': n_distinct,
+            'correlation': row['correlation'],
+            'mcv': list(zip(row['mcv'] or [], row['mcf'] or [])),
+            'histogram': list(row['hist'] or []),
+            'analyzed_at': row['analyzed_at'],
+        }
+
+    def sample_column_profile(self, table_name: str, column_name: str, percent: float = None, seed: int = 0):
+        _, _, tbl_ident, col_ident = self._profile_target(table_name, column_name)
+        rows = self.table_row_estimates([tbl_ident]).get(tbl_ident)
+        if percent is None and not rows:
+            with self.engine.connect() as conn:
+                size = conn.execute(text("""
+                    SELECT coalesce(sum(pg_relation_size(p.relid)), 0) FROM (
+                        SELECT to_regclass(:t) AS relid
+                        UNION
+                        SELECT relid FROM pg_partition_tree(to_regclass(:t))
+                    ) p
+                """), {'t': tbl_ident}).scalar()
+            guess = int(size) // 100
+        else:
+            guess = rows
+        if percent is None:
+            percent = 100.0 if not guess else min(100.0, max(0.01, 100.0 * settings.PROFILE_SAMPLE_ROWS / guess))
+        buckets = max(1, int(settings.PROFILE_HISTOGRAM_BUCKETS))
+        sample = f"WITH s AS (SELECT {col_ident} AS v FROM {tbl_ident} TABLESAMPLE SYSTEM (:pct) REPEATABLE (:seed))"
+        params = {'pct': float(percent), 'seed': int(seed)}
+        histogram = []
+        with self.engine.connect() as conn:
+            self.apply_timeouts(conn, 'browse')
+            totals = conn.execute(text(sample + """
+                SELECT count(*) AS n, count(*) - count(v) AS nulls, count(DISTINCT v) AS distinct_vals FROM s
+            """), params).mappings().first()
+            top = conn.execute(text(sample + """
+                SELECT CAST(v AS text) AS v, count(*) AS c FROM s WHERE v IS NOT NULL
+                GROUP BY v ORDER BY c DESC LIMIT :lim
+            """), dict(params, lim=int(settings.PROFILE_MCV_LIMIT))).all()
+            try:
+                with conn.begin_nested():
+                    histogram = conn.execute(text(sample + """
+                        SELECT CAST(percentile_disc(CAST(:fracs AS float8[])) WITHIN GROUP (ORDER BY v) AS text[]) FROM s
+                    """), dict(params, fracs=[i / buckets for i in range(buckets + 1)])).scalar() or []
+            except Exception:
+                histogram = []
+        n = totals['n'] or 0
+        return {
+            'source': 'sample',
+            'percent': float(percent),
+            'sample_rows': n,
+            'rows': rows,
+            'null_frac': totals['nulls'] / n if n else None,
+            'distinct': totals['distinct_vals'],
+            'correlation': None,
+            'mcv': [(r.v, r.c / n) for r in top] if n else [],
+            'histogram': list(histogram),
+            'analyzed_at': None,
+        }
+
+    def column_profile(self, table_name: str, column_name: str):
+        stats = self.column_stats(table_name, column_name)
+        if stats is not None:
+            return stats
+        return self.sample_column_profile(table_name, column_name)
+
+    def analyze_table(self, table_name: str, columns=None):
+        self._validate_identifier(table_name)
+        cols = list(columns or [])
+        for c in cols:
+            self._profile_target(table_name, c)
+        target = self._qual_ident(table_name)
+        if cols:
+            target += " (" + ", ".join(f'"{c}"' for c in cols) + ")"
+        with self.guarded_begin('ddl') as conn:
+            conn.execute(text(f"ANALYZE {target}"))
+
+    def _matview_state_path(self):
+        return settings.data_dir() / "matviews" / f"{self._dsn_key()}.json"
+
+    def matview_state(self):
+        try:
+            with open(self._matview_state_path(), encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _update_matview_state(self, key, **fields):
+        with _matview_state_lock:
+            state = self.matview_state()
+            entry = state.get(key) or {}
+            entry.update(fields)
+            state[key] = entry
+            path = self._matview_state_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+
+    def mark_matview_refreshed(self, name: str, counters=None):
+        key, _ = self._matview_key(name)
+        if counters is None:
+            counters = self.table_write_counters(self.matview_base_tables(name))
+        self._update_matview_state(key, refreshed_at=datetime.now().isoformat(timespec='seconds'),
+                                   counters=counters)
+
+    def set_matview_schedule(self, name: str, interval_sec: int = None):
+        key, _ = self._matview_key(name)
+        self._update_matview_state(key, interval_sec=int(interval_sec) if interval_sec else None)
+
+    def matview_staleness(self, name: str):
+        key, _ = self._matview_key(name)
+        entry = self.matview_state().get(key) or {}
+        current = self.table_write_counters(self.matview_base_tables(name))
+        saved = entry.get('counters')
+        changes = None
+        if isinstance(saved, dict) and set(saved) == set(current):
+            diffs = [current[t] - saved[t] for t in current]
+            if all(d >= 0 for d in diffs):
+                changes = sum(diffs)
+        return {
+            'refreshed_at': entry.get('refreshed_at'),
+            'interval_sec': entry.get('interval_sec'),
+            'base_tables': sorted(current),
+            'changes': changes,
+            'stale': True if changes is None else changes > 0,
+        }
+
+    def refresh_matview(self, name: str, concurrently: bool = True):
+        key, ident = self._matview_key(name)
+        info = next((m for m in self.list_matviews() if f"{m['schema']}.{m['name']}" == key), None)
+        if info is None:
+            raise ValueError(f"Материализованное представление {name} не найдено")
+        use_concurrently = concurrently and info['populated'] and info['has_unique_index']
+        counters = self.table_write_counters(self.matview_base_tables(name))
+        started = time.perf_counter()
+        with self.guarded_begin('ddl') as conn:
+            conn.execute(text(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if use_concurrently else ''}{ident}"))
+        elapsed = (time.perf_counter() - started) * 1000.0
+        self.mark_matview_refreshed(name, counters)
+        return {'concurrently': bool(use_concurrently), 'ms': round(elapsed, 1)}
+
+    def create_matview_unique_index(self, name: str, columns):
+        key, ident = self._matview_key(name)
+        if not columns:
+            raise ValueError("Нужно выбрать хотя бы одну колонку")
+        existing = set(self.matview_columns(name))
+        for c in columns:
+            if c not in existing:
+                raise ValueError(f"Колонка {c!r} отсутствует в представлении")
+        col_list = ', '.join(f'"{c}"' for c in columns)
+        not_null = ' AND '.join(f'"{c}" IS NOT NULL' for c in columns)
+        with self.guarded_begin('ddl') as conn:
+            dup = conn.execute(text(
+                f'SELECT 1 FROM {ident} WHERE {not_null} GROUP BY {col_list} HAVING count(*) > 1 LIMIT 1')).first()
+        if dup:
+            raise ValueError("Выбранные колонки не уникальны в представлении")
+        schema, nm = self._split_schema_ident(name)
+        index_name = f"{nm}_uidx"[:63]
+        with self.engine.connect() as conn:
+            found = conn.execute(text("""
+                SELECT x.indrelid = CAST(:v AS regclass) AND x.indisunique
+                       AND x.indpred IS NULL AND x.indexprs IS NULL
+                       AND array(
+                           SELECT a.attname::text
+                           FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+                           JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+                           ORDER BY k.ord
+                       ) = CAST(:columns AS text[]) AS same,
+                       x.indisvalid AS valid
+                FROM pg_indexes ix
+                JOIN pg_namespace n ON n.nspname = ix.schemaname
+                JOIN pg_class i ON i.relname = ix.indexname AND i.relnamespace = n.oid
+                JOIN pg_index x ON x.indexrelid = i.oid
+                WHERE ix.schemaname = :schema AND ix.indexname = :index
+            """), {'v': ident, 'columns': list(columns), 'schema': schema, 'index': index_name}).first()
+        if found is not None and not found.same:
+            raise ValueError(f"Индекс {index_name} уже существует с другим определением")
+        if found is not None and found.valid:
+            return index_name
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            statement_ms, lock_ms = self.timeout_settings('ddl')
+            conn.execute(text(f"SET statement_timeout = {statement_ms}"))
+            conn.execute(text(f"SET lock_timeout = {lock_ms}"))
+            try:
+                if found is not None:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY "{schema}"."{index_name}"'))
+                conn.execute(text(f'CREATE UNIQUE INDEX CONCURRENTLY "{index_name}" ON {ident} ({col_list})'))
+            except Exception as e:
+                err = self.timeout_error(e, 'ddl')
+                if err is None:
+                    raise
+                raise err from e
+            finally:
+                conn.execute(text("RESET statement_timeout"))
+                conn.execute(text("RESET lock_timeout"))
+        return index_name
+
+    def refresh_due_matviews(self):
+        state = self.matview_state()
+        existing = {f"{m['schema']}.{m['name']}" for m in self.list_matviews()}
+        now = datetime.now()
+        report = {}
+        for key, entry in state.items():
+            interval = entry.get('interval_sec')
+            if not interval or key not in existing:
+                continue
+            seen = [datetime.fromisoformat(v) for v in (entry.get('refreshed_at'), entry.get('checked_at')) if v]
+            if seen and (now - max(seen)).total_seconds() < interval:
+                continue
+            try:
+                if not self.matview_staleness(key)['stale']:
+                    self._update_matview_state(key, checked_at=now.isoformat(timespec='seconds'))
+                    continue
+                report[key] = self.refresh_matview(key)
+            except Exception as e:
+                report[key] = {'error': str(e)}
+        return report
+
+    def execute_prepared(self, conn, sql: str, params: Dict[str, Any] = None):
+        params = params or {}
+        stmt_sql, names = to_positional(sql)
+        missing = [n for n in names if n not in params]
+        if missing:
+            raise ValueError(f"Не заданы параметры запроса: {', '.join(missing)}")
+        prepared = conn.connection.info.setdefault('prepared_statements', set())
+        stmt_name = "q_" + hashlib.sha1(stmt_sql.encode('utf-8')).hexdigest()[:16]
+        if stmt_name not in prepared:
+            try:
+                with conn.begin_nested():
+                    with conn.connection.cursor() as cur:
+                        cur.execute(f"PREPARE {stmt_name} AS {stmt_sql}")
+                prepared.add(stmt_name)
+            except Exception:
+                return conn.execute(text(sql), params)
+        args = ', '.join(f"%({n})s" for n in names)
+        execute_sql = f"EXECUTE {stmt_name}({args})" if names else f"EXECUTE {stmt_name}"
+        try:
+            with conn.begin_nested():
+                return conn.exec_driver_sql(execute_sql, {n: params[n] for n in names})
+        except Exception as e:
+            if self.timeout_error(e) is not None:
+                raise
+            prepared.discard(stmt_name)
+            with conn.begin_nested():
+                with conn.connection.cursor() as cur:
+                    cur.execute(f"DEALLOCATE {stmt_name}")
+            return conn.execute(text(sql), params)
+
+    def validate_query(self, sql: str, params: Dict[str, Any] = None, timeout_ms: int = None):
+        params = params or {}
+        stmt_sql, names = to_positional(sql)
+        if timeout_ms is None:
+            timeout_ms = settings.PREVIEW_VALIDATE_TIMEOUT_MS
+        stmt_name = f"_validate_{uuid.uuid4().hex[:12]}"
+        report = {'ok': False, 'error': None, 'position': None, 'cost': None, 'rows': None, 'tables': []}
+        prepared = False
+        with self.engine.connect() as conn:
+            with conn.connection.cursor() as cur:
+                try:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    cur.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+                    cur.execute(f"SET LOCAL lock_timeout = {self.timeout_settings('browse')[1]}")
+                    cur.execute(f"PREPARE {stmt_name} AS {stmt_sql}")
+                    prepared = True
+                    args = ', '.join(['%s'] * len(names))
+                    cur.execute(
+                        f"EXPLAIN (FORMAT JSON) EXECUTE {stmt_name}({args})" if names
+                        else f"EXPLAIN (FORMAT JSON) EXECUTE {stmt_name}",
+                        [params.get(n) for n in names] or None,
+                    )
+                    raw = cur.fetchone()[0]
+                    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+                    report.update(ok=True, cost=plan.get('Total Cost'), rows=plan.get('Plan Rows'),
+                                  tables=self._plan_relations(plan))
+                except Exception as e:
+                    diag = getattr(e, 'diag', None)
+                    report['error'] = (getattr(diag, 'message_primary', None) or str(e)).strip()
+                    pos = getattr(diag, 'statement_position', None)
+                    if pos and not prepared:
+                        offset = int(pos) - len(f"PREPARE {stmt_name} AS ")
+                        if offset > 0:
+                            report['position'] = original_position(sql, offset)
+                finally:
+                    conn.connection.rollback()
+                    if prepared:
+                        cur.execute(f"DEALLOCATE {stmt_name}")
+        return report
+
+    @staticmethod
+    def _plan_relations(plan):
+        found = []
+        stack = [plan]
+        while stack:
+            node = stack.pop()
+            name = node.get('Relation Name')
+            if name and name not in found:
+                found.append(name)
+            stack.extend(node.get('Plans') or [])
+        return found
+
+    def _saved_queries_path(self):
+        return settings.data_dir() / "queries" / f"{self._dsn_key()}.json"
+
+    def saved_queries(self):
+        try:
+            with open(self._saved_queries_path(), encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write_saved_queries(self, queries):
+        path = self._saved_queries_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(queries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def save_query(self, name: str, sql: str, params: Dict[str, Any] = None):
+        name = (name or '').strip()
+        if not name:
+            raise ValueError("Имя запроса не может быть пустым")
+        _, names = to_positional(sql)
+        params = params or {}
+        missing = [n for n in names if n not in params]
+        if missing:
+            raise ValueError(f"Не заданы параметры запроса: {', '.join(missing)}")
+        with _saved_queries_lock:
+            queries = self.saved_queries()
+            queries[name] = {
+                'sql': sql,
+                'params': {n: params[n] for n in names},
+                'saved_at': datetime.now().isoformat(timespec='seconds'),
+            }
+            self._write_saved_queries(queries)
+
+    def delete_saved_query(self, name: str):
+        with _saved_queries_lock:
+            queries = self.saved_queries()
+            if queries.pop(name, None) is not None:
+                self._write_saved_queries(queries)
@@ -0,0 +1,165 @@
+import threading
+import time
+
+from PySide6.QtCore import Signal
+from PySide6.QtWidgets import (
+    QDialog, QHBoxLayout, QLabel, QListWidget, QMessageBox, QProgressBar, QPushButton, QRadioButton,
+    QSpinBox, QVBoxLayout
+)
+
+from config import settings
+from query_history import log_execution
+
+
+def _relname(table):
+    return table.split('.')[-1].strip('"')
+
+
+class BulkDeleteDialog(QDialog):
+    progressChanged = Signal(str, int, int)
+    deleteFinished = Signal(object)
+
+    def __init__(self, db, table_name: str, pk_cols, pks, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table_name = table_name
+        self.pk_cols = list(pk_cols)
+        self.pks = list(pks)
+        self.plan = None
+        self._cancel = False
+        self._running = False
+        self.setWindowTitle(f"Удаление строк: {table_name}")
+        self.resize(520, 420)
+        self.progressChanged.connect(self._on_progress)
+        self.deleteFinished.connect(self._on_finished)
+        self.setup_ui()
+        self._load_plan()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"Выбрано строк: {len(self.pks)}"))
+        layout.addWidget(QLabel("Каскадно будут удалены строки из таблиц:"))
+        self.plan_list = QListWidget()
+        layout.addWidget(self.plan_list)
+        self.single_rb = QRadioButton("Одной транзакцией (DELETE ... = ANY, каскад внутри транзакции)")
+        self.chunked_rb = QRadioButton("Пакетами: сначала дочерние таблицы, короткие транзакции")
+        self.single_rb.setChecked(True)
+        layout.addWidget(self.single_rb)
+        layout.addWidget(self.chunked_rb)
+        batch_row = QHBoxLayout()
+        batch_row.addWidget(QLabel("Строк в пакете:"))
+        self.batch_spin = QSpinBox()
+        self.batch_spin.setRange(1, 1_000_000)
+        self.batch_spin.setValue(settings.DELETE_BATCH_ROWS)
+        batch_row.addWidget(self.batch_spin)
+        batch_row.addStretch(1)
+        layout.addLayout(batch_row)
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+        self.progress = QProgressBar()
+        self.progress.setVisible(False)
+        layout.addWidget(self.progress)
+        btn_row = QHBoxLayout()
+        self.btn_delete = QPushButton("Удалить")
+        self.btn_cancel = QPushButton("Отмена")
+        btn_row.addStretch(1)
+        btn_row.addWidget(self.btn_cancel)
+        btn_row.addWidget(self.btn_delete)
+        layout.addLayout(btn_row)
+        self.btn_delete.clicked.connect(self.handle_delete)
+        self.btn_cancel.clicked.connect(self.handle_cancel)
+        self.chunked_rb.toggled.connect(self.batch_spin.setEnabled)
+        self.batch_spin.setEnabled(False)
+
+    def _load_plan(self):
+        try:
+            self.plan = self.db.cascade_plan(self.table_name)
+        except Exception as e:
+            self.plan = None
+            self.chunked_rb.setEnabled(False)
+            self.plan_list.addItem(f"Не удалось построить план каскада: {e}")
+            return
+        for node in self.plan['nodes'][1:]:
+            self.plan_list.addItem(f"{'  ' * (node['depth'] - 1)}{node['table']} "
+                                   f"({', '.join(node['columns'])} → {', '.join(node['ref_columns'])})")
+        if len(self.plan['nodes']) == 1:
+            self.plan_list.addItem("нет таблиц с ON DELETE CASCADE")
+        if self.plan['blocking']:
+            self.status_label.setText("Удалению могут помешать ссылки из: " + ", ".join(self.plan['blocking']))
+
+    def handle_delete(self):
+        ans = QMessageBox.question(self, "Удаление", f"Удалить строк: {len(self.pks)} и все зависимые?",
+                                   QMessageBox.Yes | QMessageBox.No)
+        if ans != QMessageBox.Yes:
+            return
+        self._running = True
+        self._cancel = False
+        for w in (self.btn_delete, self.single_rb, self.chunked_rb, self.batch_spin):
+            w.setEnabled(False)
+        self.progress.setVisible(True)
+        self.progress.setRange(0, 0)
+        chunked = self.chunked_rb.isChecked()
+        batch_size = self.batch_spin.value()
+        started = time.perf_counter()
+
+        def progress(table, done, total):
+            self.progressChanged.emit(table, done, total)
+            return not self._cancel
+
+        def run():
+            try:
+                if chunked:
+                    result = self.db.chunked_cascade_delete(self.table_name, self.pk_cols, self.pks,
+                                                            batch_size, progress)
+                else:
+                    self.progressChanged.emit(self.table_name, 0, 0)
+                    result = self.db.delete_rows(self.table_name, self.pk_cols, self.pks)
+            except Exception as e:
+                result = e
+            result = (result, started)
+            try:
+                self.deleteFinished.emit(result)
+            except RuntimeError:
+                pass
+
+        threading.Thread(target=run, name="bulk-delete", daemon=True).start()
+
+    def handle_cancel(self):
+        if not self._running:
+            self.reject()
+            return
+        self._cancel = True
+        self.btn_cancel.setEnabled(False)
+        self.status_label.setText("Остановка после текущего пакета…")
+
+    def _on_progress(self, table, done, total):
+        if total:
+            self.progress.setRange(0, total)
+            self.progress.setValue(done)
+        else:
+            self.progress.setRange(0, 0)
+        self.status_label.setText(f"{table}: удалено {done:,} из {total:,}".replace(',', ' '))
+
+    def _on_finished(self, payload):
+        result, started = payload
+        self._running = False
+        self.progress.setVisible(False)
+        if isinstance(result, Exception):
+            err = self.db.timeout_error(result, 'edit')
+            QMessageBox.critical(self, "Ошибка удаления", str(err if err is not None else result))
+            self.btn_cancel.setEnabled(True)
+            self.btn_cancel.setText("Закрыть")
+            return
+        tables = [_relname(n['table']) for n in (self.plan or {}).get('nodes', [])] or [self.table_name]
+        for sql, params, rows in result['statements']:
+            log_execution(self.db, sql, params, 'edit', started, rows=rows, tables=tables)
+        if not isinstance(result['deleted'], dict):
+            QMessageBox.information(self, "Готово", f"Удалено строк: {result['deleted']}")
+            self.accept()
+            return
+        summary = "\n".join(f"{t}: {n}" for t, n in result['deleted'].items())
+        if result['cancelled']:
+            QMessageBox.warning(self, "Остановлено", f"Удаление остановлено. Уже удалено:\n{summary}")
+        else:
+            QMessageBox.information(self, "Готово", f"Удалено:\n{summary}")
+        self.accept()
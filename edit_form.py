@@ -1,20 +1,23 @@
 from typing import Dict, Any, Optional
 import re
+import time
 from datetime import date, datetime
 
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableView, QMessageBox,
     QDialog, QTextEdit, QLineEdit, QComboBox, QCheckBox, QDateEdit, QDateTimeEdit, QTextEdit,
-    QFormLayout
+    QFormLayout, QTableWidget, QTableWidgetItem, QHeaderView
 )
-from PySide6.QtGui import QStandardItemModel, QStandardItem, QIntValidator, QDoubleValidator
+from PySide6.QtGui import QStandardItemModel, QStandardItem, QIntValidator, QDoubleValidator, QColor
 from PySide6.QtCore import Qt, Signal
 
-from sqlalchemy import text, select, update, and_, delete
+from sqlalchemy import text, select, update, and_, delete, literal_column
 from sqlalchemy import Table as SATable
 from sqlalchemy.types import Enum as SAEnum, Boolean, Integer, Float, Date, DateTime, ARRAY, JSON
 
 from validators import validate_table_data
+from fk_picker import ForeignKeyPicker, picker_errors
+from query_history import log_execution
 
 
 class EditFieldLine:
@@ -48,7 +51,7 @@ class EditFieldLine:
             pass
 
 class EditInputBuilder:
-    def build_field(self, col):
+    def build_field(self, col, db=None):
         placeholder_parts = [str(col.type)]
         if col.primary_key:
             placeholder_parts.append("primary key")
@@ -68,6 +71,15 @@ class EditInputBuilder:
         error_label.setStyleSheet("color: red;")
         error_label.setVisible(False)
 
+        if db is not None and col.foreign_keys and not col.primary_key:
+            editor = ForeignKeyPicker(db, col.table.name, col.name)
+            container = QWidget()
+            vbox = QVBoxLayout(container)
+            vbox.setContentsMargins(0, 0, 0, 0)
+            vbox.addWidget(editor)
+            vbox.addWidget(error_label)
+            return EditFieldLine(container, editor, editor.value, error_label, editor.set_value)
+
         if isinstance(col.type, SAEnum):
             editor = QComboBox()
             enums = getattr(col.type, "enums", []) or []
@@ -311,7 +323,7 @@ class EditConfirmDialog(QDialog):
         for col in self.table.columns:
             if col.autoincrement and col.primary_key:
                 continue
-            fl = builder.build_field(col)
+            fl = builder.build_field(col, db=self.db)
             label_text = col.name
             if not col.nullable:
                 label_text += " *"
@@ -349,6 +361,7 @@ class EditConfirmDialog(QDialog):
         self.clear_errors()
         raw = self.gather_raw()
         validated, errors = validate_table_data(self.table, raw, db=self.db)
+        errors.update({k: v for k, v in picker_errors(self.field_map).items() if k not in errors})
         if errors:
             self.set_errors(errors)
             return
@@ -363,6 +376,72 @@ class EditConfirmDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка вставки", str(e))
 
+def _same_value(a, b):
+    if a == b:
+        return True
+    if a is None or b is None:
+        return False
+    return str(a) == str(b)
+
+
+class ConflictDialog(QDialog):
+    OVERWRITE = 'overwrite'
+    RELOAD = 'reload'
+
+    def __init__(self, columns, original, mine, current, deleting=False, parent=None):
+        super().__init__(parent)
+        self.choice = None
+        self.setWindowTitle("Запись изменена другим пользователем")
+        self.resize(720, 420)
+        layout = QVBoxLayout(self)
+        if deleting:
+            info = "После открытия формы запись изменили. Проверьте изменения перед удалением."
+        else:
+            info = ("После открытия формы запись изменили. Жёлтым отмечены ваши правки, "
+                    "синим — чужие, красным — поля, изменённые обеими сторонами.")
+        label = QLabel(info)
+        label.setWordWrap(True)
+        layout.addWidget(label)
+        table = QTableWidget(len(columns), 4)
+        table.setHorizontalHeaderLabels(["Поле", "При открытии", "Ваше значение", "Сейчас в базе"])
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for r, name in enumerate(columns):
+            base, own, theirs = original.get(name), mine.get(name, original.get(name)), current.get(name)
+            values = [name] + ["" if v is None else str(v) for v in (base, own, theirs)]
+            mine_changed = not _same_value(own, base)
+            theirs_changed = not _same_value(theirs, base)
+            color = None
+            if mine_changed and theirs_changed and not _same_value(own, theirs):
+                color = QColor('#f5b7b1')
+            elif mine_changed:
+                color = QColor('#fff3b0')
+            elif theirs_changed:
+                color = QColor('#cfe2ff')
+            for c, v in enumerate(values):
+                item = QTableWidgetItem(v)
+                if color is not None:
+                    item.setBackground(color)
+                table.setItem(r, c, item)
+        layout.addWidget(table)
+        btn_row = QHBoxLayout()
+        self.btn_overwrite = QPushButton("Удалить всё равно" if deleting else "Записать мои изменения поверх")
+        self.btn_reload = QPushButton("Загрузить актуальные")
+        self.btn_cancel = QPushButton("Отмена")
+        btn_row.addStretch(1)
+        btn_row.addWidget(self.btn_cancel)
+        btn_row.addWidget(self.btn_reload)
+        btn_row.addWidget(self.btn_overwrite)
+        layout.addLayout(btn_row)
+        self.btn_overwrite.clicked.connect(lambda: self._choose(self.OVERWRITE))
+        self.btn_reload.clicked.connect(lambda: self._choose(self.RELOAD))
+        self.btn_cancel.clicked.connect(self.reject)
+
+    def _choose(self, choice):
+        self.choice = choice
+        self.accept()
+
+
 class EditDialog(QDialog):
     tablesChanged = Signal(str)
     def __init__(self, table_name: str, db, pk_dict: Dict[str, Any], table_manager=None, parent=None):
@@ -370,6 +449,8 @@ class EditDialog(QDialog):
         self.db = db
         self.table: SATable = db.get_table(table_name)
         self.pk_dict = pk_dict or {}
+        self._xmin = None
+        self._original = {}
         self.setWindowTitle(f"{table_name}")
         self.table_manager = table_manager
         self.layout = QVBoxLayout(self)
@@ -380,7 +461,7 @@ class EditDialog(QDialog):
             setattr(c, "_inspector_unique", c.name in constrs)
         builder = EditInputBuilder()
         for col in self.table.columns:
-            fl = builder.build_field(col)
+            fl = builder.build_field(col, db=self.db)
             label_text = col.name
             if not col.nullable:
                 label_text += " *"
@@ -410,6 +491,20 @@ class EditDialog(QDialog):
         self.btn_delete.clicked.connect(self.on_delete)
         self._load_row_and_prefill()
 
+    def _xmin_column(self):
+        return literal_column("CAST(xmin AS text)")
+
+    def _fetch_current(self, conds):
+        session = self.db.SessionLocal()
+        try:
+            stmt = select(self.table, self._xmin_column().label("_xmin")).where(and_(*conds)).limit(1)
+            r = session.execute(stmt).mappings().first()
+        finally:
+            session.close()
+        if not r:
+            return None, None
+        return {c.name: r.get(c.name) for c in self.table.columns}, r.get("_xmin")
+
     def _load_row_and_prefill(self):
         conds = []
         for pk_col in self.table.primary_key.columns:
@@ -419,21 +514,42 @@ class EditDialog(QDialog):
                 return
             val = self.pk_dict[name]
             conds.append(self.table.c[name] == val)
-        session = self.db.SessionLocal()
-        try:
-            stmt = select(self.table).where(and_(*conds)).limit(1)
-            r = session.execute(stmt).mappings().first()
-            if not r:
-                QMessageBox.warning(self, "Not found", "Row not found in database.")
-                return
-            for col in self.table.columns:
-                fl = self.field_map.get(col.name)
-                if not fl:
-                    continue
-                val = r.get(col.name)
-                fl.set_value(val)
-        finally:
-            session.close()
+        row, xmin = self._fetch_current(conds)
+        if row is None:
+            QMessageBox.warning(self, "Not found", "Row not found in database.")
+            return
+        self._prefill(row, xmin)
+
+    def _prefill(self, row, xmin):
+        self._original = dict(row)
+        self._xmin = xmin
+        for col in self.table.columns:
+            fl = self.field_map.get(col.name)
+            if not fl:
+                continue
+            fl.set_value(row.get(col.name))
+
+    def _resolve_conflict(self, conds, mine, deleting=False):
+        current, xmin = self._fetch_current(conds)
+        if current is None:
+            QMessageBox.warning(self, "Запись удалена", "Запись уже удалена другим пользователем.")
+            if deleting:
+                self.accept()
+            return False
+        dlg = ConflictDialog([c.name for c in self.table.columns], self._original, mine, current,
+                             deleting=deleting, parent=self)
+        if dlg.exec() != QDialog.Accepted:
+            return False
+        if dlg.choice == ConflictDialog.RELOAD:
+            self._prefill(current, xmin)
+            return False
+        for name, value in current.items():
+            fl = self.field_map.get(name)
+            if fl and name not in mine:
+                fl.set_value(value)
+        self._original = current
+        self._xmin = xmin
+        return True
 
     def clear_errors(self):
         for fl in self.field_map.values():
@@ -456,6 +572,7 @@ class EditDialog(QDialog):
         self.clear_errors()
         raw = self.gather_raw()
         validated, errors = validate_table_data(self.table, raw, db=self.db)
+        errors.update({k: v for k, v in picker_errors(self.field_map).items() if k not in errors})
         if errors:
             self.set_errors(errors)
             return
@@ -470,11 +587,25 @@ class EditDialog(QDialog):
                 QMessageBox.critical(self, "pk отсутствует", f"Pk для '{name}' отсутствует.")
                 return
             conds.append(self.table.c[name] == self.pk_dict[name])
+        changed = {k: v for k, v in update_data.items() if not _same_value(v, self._original.get(k))}
+        if self._xmin is not None and not changed:
+            QMessageBox.information(self, "нету изменений", "ни одного поля не изменено.")
+            return
+        if self._xmin is not None:
+            update_data = changed
+        stmt = self._guarded_update(conds, update_data)
         session = self.db.SessionLocal()
+        started = time.perf_counter()
         try:
-            stmt = update(self.table).where(and_(*conds)).values(**update_data)
-            session.execute(stmt)
+            result = session.execute(stmt)
+            returned = result.mappings().first()
             session.commit()
+            self._log_statement(stmt, started, rows=result.rowcount)
+            if returned is None and self._xmin is not None:
+                session.close()
+                if self._resolve_conflict(conds, update_data):
+                    self.on_submit()
+                return
             QMessageBox.information(self, "Ok", "обновлено")
             try:
                 self.tablesChanged.emit(self.table.name)
@@ -483,10 +614,16 @@ class EditDialog(QDialog):
             self.accept()
         except Exception as e:
             session.rollback()
+            self._log_statement(stmt, started, error=str(e))
             QMessageBox.critical(self, "ошибка", str(e))
         finally:
             session.close()
 
+    def _log_statement(self, stmt, started, rows=None, error=None):
+        compiled = stmt.compile(dialect=self.db.engine.dialect)
+        log_execution(self.db, str(compiled), dict(compiled.params), 'edit', started,
+                      rows=rows, error=error, tables=[self.table.name])
+
     def on_delete(self):
         conds = []
         for pk_col in self.table.primary_key.columns:
@@ -498,11 +635,29 @@ class EditDialog(QDialog):
         reply = QMessageBox.question(self, "Удаление", "Вы уверены, что хотите удалить запись?", QMessageBox.Yes | QMessageBox.No)
         if reply != QMessageBox.Yes:
             return
+        self._delete(conds)
+
+    def _guarded_update(self, conds, values):
+        if self._xmin is not None:
+            conds = list(conds) + [self._xmin_column() == self._xmin]
+        return update(self.table).where(and_(*conds)).values(**values).returning(self._xmin_column().label("_xmin"))
+
+    def _delete(self, conds):
+        guarded = list(conds)
+        if self._xmin is not None:
+            guarded.append(self._xmin_column() == self._xmin)
+        stmt = delete(self.table).where(and_(*guarded))
         session = self.db.SessionLocal()
+        started = time.perf_counter()
         try:
-            stmt = delete(self.table).where(and_(*conds))
-            session.execute(stmt)
+            result = session.execute(stmt)
             session.commit()
+            self._log_statement(stmt, started, rows=result.rowcount)
+            if result.rowcount == 0 and self._xmin is not None:
+                session.close()
+                if self._resolve_conflict(conds, {}, deleting=True):
+                    self._delete(conds)
+                return
             QMessageBox.information(self, "Ok", "Удалено")
             try:
                 self.tablesChanged.emit(self.table.name)
@@ -511,6 +666,7 @@ class EditDialog(QDialog):
             self.accept()
         except Exception as e:
             session.rollback()
+            self._log_statement(stmt, started, error=str(e))
             QMessageBox.critical(self, "ошибка удаления", str(e))
         finally:
             session.close()
\ No newline at end of file
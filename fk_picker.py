@@ -0,0 +1,143 @@
+import logging
+
+from PySide6.QtCore import Qt, QTimer, Signal
+from PySide6.QtWidgets import QComboBox, QMessageBox
+
+from config import settings
+
+logger = logging.getLogger("fk_picker")
+
+SEPARATOR = " — "
+
+
+class ForeignKeyPicker(QComboBox):
+    lookupFailed = Signal(str)
+
+    def __init__(self, db, table_name: str, column_name: str, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table_name = table_name
+        self.column_name = column_name
+        self.target = db.fk_target(table_name, column_name)
+        self._keys = set()
+        self.setEditable(True)
+        self.setInsertPolicy(QComboBox.NoInsert)
+        self.setMaxVisibleItems(settings.FK_LOOKUP_LIMIT)
+        self._search_column = self.target['label'] if self.target['numeric'] else self.target['key']
+        self._update_placeholder()
+        self.lineEdit().setContextMenuPolicy(Qt.CustomContextMenu)
+        self.lineEdit().customContextMenuRequested.connect(self._show_context_menu)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(settings.FK_LOOKUP_DEBOUNCE_MS)
+        self._timer.timeout.connect(self.refresh)
+        self.lineEdit().textEdited.connect(self._timer.start)
+
+    def _text_searchable(self):
+        try:
+            return self.db.fk_text_searchable(self.table_name, self.column_name)
+        except Exception as e:
+            logger.warning("Не удалось проверить индекс для %s.%s: %s", self.table_name, self.column_name, e)
+            return False
+
+    def _update_placeholder(self):
+        searchable = self.target['key']
+        if self.target['label'] and self._text_searchable():
+            searchable += f" или {self.target['label']}"
+        self.lineEdit().setPlaceholderText(f"{self.target['table']}: начните вводить {searchable}")
+
+    def _show_context_menu(self, pos):
+        menu = self.lineEdit().createStandardContextMenu()
+        if self._search_column and not self._text_searchable():
+            menu.addSeparator()
+            action = menu.addAction(f"Создать индекс для поиска по {self._search_column}")
+            action.triggered.connect(self._create_search_index)
+        menu.exec(self.lineEdit().mapToGlobal(pos))
+        menu.deleteLater()
+
+    def _create_search_index(self):
+        ans = QMessageBox.question(
+            self, "Индекс для поиска",
+            f"Поиск по началу {self.target['table']}.{self._search_column} без индекса читает всю таблицу.\n"
+            f"Создать индекс (text_pattern_ops) в режиме CONCURRENTLY?",
+            QMessageBox.Yes | QMessageBox.No,
+        )
+        if ans != QMessageBox.Yes:
+            return
+        try:
+            name = self.db.create_fk_search_index(self.table_name, self.column_name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось создать индекс:\n{e}")
+            return
+        self._update_placeholder()
+        QMessageBox.information(self, "Готово", f"Индекс {name} создан")
+
+    @staticmethod
+    def _item_text(key, label):
+        return f"{key}{SEPARATOR}{label}" if label else str(key)
+
+    def _typed_key(self):
+        return self.currentText().split(SEPARATOR, 1)[0].strip()
+
+    def refresh(self):
+        self._timer.stop()
+        typed = self.currentText()
+        prefix = self._typed_key()
+        try:
+            rows = self.db.fk_lookup(self.table_name, self.column_name, prefix)
+        except Exception as e:
+            logger.warning("Не удалось найти значения для %s.%s: %s", self.table_name, self.column_name, e)
+            self.lookupFailed.emit(str(e))
+            return
+        self.blockSignals(True)
+        try:
+            self.clear()
+            for key, label in rows:
+                self.addItem(self._item_text(key, label), key)
+            self._keys = {str(key) for key, _ in rows}
+            self.setEditText(typed)
+        finally:
+            self.blockSignals(False)
+        if rows and self.hasFocus():
+            self.showPopup()
+
+    def is_known(self):
+        key = self._typed_key()
+        return not key or key in self._keys
+
+    def check(self):
+        self.refresh()
+        if self.is_known():
+            return None
+        return f"Нет записи {self._typed_key()} в {self.target['table']}"
+
+    def value(self):
+        index = self.findText(self.currentText(), Qt.MatchExactly)
+        if index >= 0:
+            return self.itemData(index)
+        key = self._typed_key()
+        if not key:
+            return None
+        if self.target['numeric']:
+            return int(key) if key.lstrip('-').isdigit() else key
+        return key
+
+    def set_value(self, value):
+        if value is None:
+            self.setEditText("")
+            return
+        self.setEditText(str(value))
+        self.refresh()
+        index = self.findData(value)
+        if index >= 0:
+            self.setCurrentIndex(index)
+
+
+def picker_errors(field_map):
+    errors = {}
+    for name, field in field_map.items():
+        if isinstance(field.editor, ForeignKeyPicker):
+            message = field.editor.check()
+            if message:
+                errors[name] = message
+    return errors
@@ -0,0 +1,353 @@
+import re
+import time
+
+from sqlalchemy import text
+
+SUPPORTED_AGGS = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+SUPPORTED_JOINS = ('INNER', 'LEFT')
+
+_ident_re = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+_col_re = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*$')
+
+
+class IncrementalSummary:
+    def __init__(self, name, base_table, joins=None, where=None, group_by=None, aggregates=None):
+        if not isinstance(name, str) or not _ident_re.match(name):
+            raise ValueError(f"Недопустимое имя сводки: {name!r}")
+        if len(name) > 48:
+            raise ValueError("Имя сводки должно быть не длиннее 48 символов")
+        if not isinstance(base_table, str) or not _ident_re.match(base_table):
+            raise ValueError(f"Недопустимая базовая таблица: {base_table!r}")
+        self.name = name
+        self.base_table = base_table
+        self.joins = list(joins or [])
+        self.where = [str(w) for w in (where or []) if w and str(w).strip()]
+        self.group_by = list(group_by or [])
+        self.aggregates = list(aggregates or [])
+        self._validate()
+        self.group_columns = self._group_column_names()
+
+    @classmethod
+    def from_builder(cls, name, builder):
+        if getattr(builder, 'ctes', None):
+            raise ValueError("Инкрементальная сводка не поддерживает CTE")
+        if getattr(builder, 'group_mode', None):
+            raise ValueError("Инкрементальная сводка не поддерживает ROLLUP/CUBE/GROUPING SETS")
+        if getattr(builder, 'having_conditions', None):
+            raise ValueError("Инкрементальная сводка не поддерживает HAVING")
+        if getattr(builder, 'window_functions', None) or getattr(builder, 'custom_expressions', None):
+            raise ValueError("Инкрементальная сводка поддерживает только GROUP BY и агрегаты")
+        if getattr(builder, 'current_sample', None) and builder.current_sample():
+            raise ValueError("Инкрементальная сводка строится по всем строкам: отключите выборку")
+        if not builder.aggregates:
+            raise ValueError("Добавьте хотя бы один агрегат")
+        if builder.joins:
+            base = builder.joins[0].get('left') or ''
+        else:
+            tables = {g.split('.', 1)[0] for g in builder.group_by}
+            tables |= {col.split('.', 1)[0] for _, col, _ in builder.aggregates if col != '*'}
+            tables |= {t for t, _ in builder.selected_columns}
+            if len(tables) != 1:
+                raise ValueError("Без JOIN сводка строится только по одной таблице")
+            base = next(iter(tables))
+        return cls(name, base, builder.joins, builder.where_conditions, builder.group_by, builder.aggregates)
+
+    def _validate(self):
+        tables = {self.base_table}
+        for j in self.joins:
+            jtype = (j.get('type') or 'INNER').upper()
+            if jtype not in SUPPORTED_JOINS:
+                raise ValueError(f"JOIN {jtype} не поддерживается: фактом должна быть левая таблица")
+            for key in ('left', 'right'):
+                if not _ident_re.match(j.get(key) or ''):
+                    raise ValueError(f"Недопустимая таблица в JOIN: {j.get(key)!r}")
+            for key in ('lf', 'rf'):
+                if not _ident_re.match(j.get(key) or ''):
+                    raise ValueError(f"Недопустимая колонка в JOIN: {j.get(key)!r}")
+            if j['right'] == self.base_table:
+                raise ValueError("Повторное использование базовой таблицы в JOIN не поддерживается")
+            tables.add(j['right'])
+        for g in self.group_by:
+            if not _col_re.match(g):
+                raise ValueError(f"GROUP BY поддерживает только колонки вида table.column: {g!r}")
+            if g.split('.', 1)[0] not in tables:
+                raise ValueError(f"Таблица колонки {g} не участвует в запросе")
+        for fn, col, alias in self.aggregates:
+            if fn.upper() not in SUPPORTED_AGGS:
+                raise ValueError(f"Агрегат {fn} не поддерживается")
+            if col == '*':
+                if fn.upper() != 'COUNT':
+                    raise ValueError(f"{fn}(*) не поддерживается")
+            elif not _col_re.match(col) or col.split('.', 1)[0] not in tables:
+                raise ValueError(f"Недопустимый аргумент агрегата: {col!r}")
+            if not _ident_re.match(alias or ''):
+                raise ValueError(f"Недопустимый псевдоним агрегата: {alias!r}")
+        self.dimension_tables = sorted(tables - {self.base_table})
+
+    def _group_column_names(self):
+        short = [g.split('.', 1)[1] for g in self.group_by]
+        out = []
+        for g, s in zip(self.group_by, short):
+            out.append(s if short.count(s) == 1 else g.replace('.', '_'))
+        aliases = {a for _, _, a in self.aggregates}
+        for c in out:
+            if c in aliases or c.startswith('__'):
+                raise ValueError(f"Имя колонки {c} конфликтует с псевдонимом агрегата")
+        return out
+
+    @property
+    def state_table(self):
+        return f"{self.name}__state"
+
+    @property
+    def meta_table(self):
+        return f"{self.name}__meta"
+
+    def _from(self, source):
+        parts = [f'{source} AS "{self.base_table}"']
+        for j in self.joins:
+            jtype = (j.get('type') or 'INNER').upper()
+            parts.append(f"{jtype} JOIN {j['right']} ON {j['left']}.{j['lf']} = {j['right']}.{j['rf']}")
+        sql = "\n".join(parts)
+        if self.where:
+            sql += "\nWHERE " + " AND ".join(f"({w})" for w in self.where)
+        return sql
+
+    def _key_expr(self):
+        if not self.group_by:
+            return "'__all'::text"
+        return f"md5(ROW({', '.join(self.group_by)})::text)"
+
+    def _group_clause(self):
+        return f"\nGROUP BY {', '.join(self.group_by)}" if self.group_by else ""
+
+    def _state_columns(self):
+        cols = []
+        for i, (fn, col, _) in enumerate(self.aggregates):
+            fn = fn.upper()
+            if fn == 'COUNT' and col == '*':
+                continue
+            if fn in ('COUNT', 'SUM', 'AVG'):
+                cols.append((f"a{i}_n", f"count({col})", 'count'))
+            if fn in ('SUM', 'AVG'):
+                cols.append((f"a{i}_s", f"sum({col})", 'sum'))
+            if fn in ('MIN', 'MAX'):
+                cols.append((f"a{i}_v", f"{fn.lower()}({col})", fn.lower()))
+        return cols
+
+    def _delta_select(self, source):
+        items = [f"{self._key_expr()} AS __key"]
+        items += [f'{g} AS "{c}"' for g, c in zip(self.group_by, self.group_columns)]
+        items.append("count(*) AS __rows")
+        items += [f"{expr} AS {name}" for name, expr, _ in self._state_columns()]
+        return "SELECT " + ",\n       ".join(items) + "\nFROM " + self._from(source) + self._group_clause()
+
+    def _all_columns(self):
+        return ["__key"] + [f'"{c}"' for c in self.group_columns] + ["__rows"] + [n for n, _, _ in self._state_columns()]
+
+    def _add_sql(self, source):
+        merge = ["__rows = st.__rows + EXCLUDED.__rows"]
+        for name, _, kind in self._state_columns():
+            if kind == 'count':
+                merge.append(f"{name} = st.{name} + EXCLUDED.{name}")
+            elif kind == 'sum':
+                merge.append(f"{name} = coalesce(st.{name}, 0) + coalesce(EXCLUDED.{name}, 0)")
+            elif kind == 'min':
+                merge.append(f"{name} = LEAST(st.{name}, EXCLUDED.{name})")
+            else:
+                merge.append(f"{name} = GREATEST(st.{name}, EXCLUDED.{name})")
+        return (f"INSERT INTO {self.state_table} AS st ({', '.join(self._all_columns())})\n"
+                f"{self._delta_select(source)}\n"
+                f"ON CONFLICT (__key) DO UPDATE SET {', '.join(merge)}")
+
+    def _extremes(self):
+        return [(n, kind) for n, _, kind in self._state_columns() if kind in ('min', 'max')]
+
+    def _subtract_sql(self, source):
+        sets = ["__rows = st.__rows - d.__rows"]
+        for name, _, kind in self._state_columns():
+            if kind == 'count':
+                sets.append(f"{name} = st.{name} - d.{name}")
+            elif kind == 'sum':
+                sets.append(f"{name} = coalesce(st.{name}, 0) - coalesce(d.{name}, 0)")
+        checks = [f"d.{n} <= st.{n}" if kind == 'min' else f"d.{n} >= st.{n}" for n, kind in self._extremes()]
+        recheck = " OR ".join(checks) if checks else "false"
+        return (f"WITH d AS (\n{self._delta_select(source)}\n),\n"
+                f"upd AS (\n    UPDATE {self.state_table} st SET {', '.join(sets)}\n"
+                f"    FROM d WHERE st.__key = d.__key\n"
+                f"    RETURNING st.__key, st.__rows, ({recheck}) AS recheck\n)\n"
+                f"SELECT array_agg(__key) FILTER (WHERE __rows <= 0),\n"
+                f"       array_agg(__key) FILTER (WHERE __rows > 0 AND recheck)\n"
+                f"FROM upd")
+
+    def _recompute_sql(self, null_groups):
+        names = [n for n, _ in self._extremes()]
+        exprs = {n: e for n, e, _ in self._state_columns()}
+        inner = [f"{self._key_expr()} AS __key"] + [f"{exprs[n]} AS {n}" for n in names]
+        if null_groups or not self.group_by:
+            flt = f"{self._key_expr()} = ANY(affected)"
+        else:
+            cols = ', '.join(f's."{c}"' for c in self.group_columns)
+            flt = (f"({', '.join(self.group_by)}) IN (SELECT {cols} FROM {self.state_table} s "
+                   f"WHERE s.__key = ANY(affected))")
+        src = self._from(f'"{self.base_table}"')
+        src += ("\n  AND " if self.where else "\nWHERE ") + flt
+        return (f"UPDATE {self.state_table} st SET {', '.join(f'{n} = q.{n}' for n in names)}\n"
+                f"FROM (\nSELECT {', '.join(inner)}\nFROM {src}{self._group_clause()}\n) q\n"
+                f"WHERE st.__key = q.__key")
+
+    def _view_sql(self):
+        items = [f'"{c}"' for c in self.group_columns]
+        for i, (fn, col, alias) in enumerate(self.aggregates):
+            fn = fn.upper()
+            if fn == 'COUNT':
+                items.append(f'{"__rows" if col == "*" else f"a{i}_n"} AS "{alias}"')
+            elif fn == 'SUM':
+                items.append(f'CASE WHEN a{i}_n > 0 THEN a{i}_s END AS "{alias}"')
+            elif fn == 'AVG':
+                items.append(f'a{i}_s / NULLIF(a{i}_n, 0)::numeric AS "{alias}"')
+            else:
+                items.append(f'a{i}_v AS "{alias}"')
+        return f'CREATE VIEW "{self.name}" AS\nSELECT {", ".join(items)}\nFROM {self.state_table}'
+
+    def ddl(self):
+        state = self.state_table
+        null_check = " OR ".join(f's."{c}" IS NULL' for c in self.group_columns) or "false"
+        recompute = ""
+        if self._extremes():
+            recompute = f"""
+        IF affected IS NOT NULL THEN
+            IF EXISTS (SELECT 1 FROM {state} s WHERE s.__key = ANY(affected) AND ({null_check})) THEN
+                {self._recompute_sql(True)};
+            ELSE
+                {self._recompute_sql(False)};
+            END IF;
+        END IF;"""
+        stmts = [
+            f"CREATE TABLE {state} AS\n{self._delta_select(f'{chr(34)}{self.base_table}{chr(34)}')}\nWITH NO DATA",
+            f"ALTER TABLE {state} ADD PRIMARY KEY (__key)",
+            f"CREATE TABLE {self.meta_table} (stale_since timestamptz, refreshed_at timestamptz)",
+            f"INSERT INTO {self.meta_table} VALUES (NULL, NULL)",
+            self._view_sql(),
+            f"""CREATE FUNCTION {self.name}__refresh() RETURNS void LANGUAGE plpgsql AS $fn$
+BEGIN
+    TRUNCATE {state};
+    INSERT INTO {state} ({', '.join(self._all_columns())})
+    {self._delta_select(f'{chr(34)}{self.base_table}{chr(34)}')};
+    UPDATE {self.meta_table} SET stale_since = NULL, refreshed_at = now();
+END
+$fn$""",
+            f"""CREATE FUNCTION {self.name}__apply() RETURNS trigger LANGUAGE plpgsql AS $fn$
+DECLARE
+    emptied text[];
+    affected text[];
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        {self._subtract_sql('old_rows')}
+        INTO emptied, affected;
+        IF emptied IS NOT NULL THEN
+            DELETE FROM {state} WHERE __key = ANY(emptied);
+        END IF;{recompute}
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        {self._add_sql('new_rows')};
+    END IF;
+    RETURN NULL;
+END
+$fn$""",
+            f"""CREATE FUNCTION {self.name}__rebuild() RETURNS trigger LANGUAGE plpgsql AS $fn$
+BEGIN
+    PERFORM {self.name}__refresh();
+    RETURN NULL;
+END
+$fn$""",
+            f"""CREATE FUNCTION {self.name}__invalidate() RETURNS trigger LANGUAGE plpgsql AS $fn$
+BEGIN
+    UPDATE {self.meta_table} SET stale_since = now() WHERE stale_since IS NULL;
+    RETURN NULL;
+END
+$fn$""",
+            f'CREATE TRIGGER {self.name}__ins AFTER INSERT ON "{self.base_table}" '
+            f'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {self.name}__apply()',
+            f'CREATE TRIGGER {self.name}__upd AFTER UPDATE ON "{self.base_table}" '
+            f'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {self.name}__apply()',
+            f'CREATE TRIGGER {self.name}__del AFTER DELETE ON "{self.base_table}" '
+            f'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {self.name}__apply()',
+            f'CREATE TRIGGER {self.name}__trunc AFTER TRUNCATE ON "{self.base_table}" '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION {self.name}__rebuild()',
+        ]
+        for t in self.dimension_tables:
+            stmts.append(f'CREATE TRIGGER {self.name}__dim AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{t}" '
+                         f'FOR EACH STATEMENT EXECUTE FUNCTION {self.name}__invalidate()')
+        stmts.append(f"SELECT {self.name}__refresh()")
+        stmts.append(f"ANALYZE {state}")
+        return stmts
+
+    def create(self, db, replace=False):
+        with db.engine.begin() as conn:
+            if replace:
+                for stmt in _drop_statements(self.name):
+                    conn.execute(text(stmt))
+            for stmt in self.ddl():
+                conn.execute(text(stmt))
+        return self.name
+
+
+def _drop_statements(name):
+    return [
+        f'DROP VIEW IF EXISTS "{name}"',
+        f"DROP FUNCTION IF EXISTS {name}__apply() CASCADE",
+        f"DROP FUNCTION IF EXISTS {name}__rebuild() CASCADE",
+        f"DROP FUNCTION IF EXISTS {name}__invalidate() CASCADE",
+        f"DROP FUNCTION IF EXISTS {name}__refresh()",
+        f"DROP TABLE IF EXISTS {name}__state",
+        f"DROP TABLE IF EXISTS {name}__meta",
+    ]
+
+
+def drop_incremental_summary(db, name):
+    if not isinstance(name, str) or not _ident_re.match(name):
+        raise ValueError(f"Недопустимое имя сводки: {name!r}")
+    with db.engine.begin() as conn:
+        for stmt in _drop_statements(name):
+            conn.execute(text(stmt))
+
+
+def list_incremental_summaries(db):
+    sql = text("""
+        SELECT left(p.proname, length(p.proname) - length('__apply')) AS name
+        FROM pg_proc p
+        JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE n.nspname = 'public' AND p.proname LIKE '%\\_\\_apply'
+        ORDER BY 1
+    """)
+    with db.engine.connect() as conn:
+        return list(conn.execute(sql).scalars().all())
+
+
+def refresh_incremental_summary(db, name):
+    if not isinstance(name, str) or not _ident_re.match(name):
+        raise ValueError(f"Недопустимое имя сводки: {name!r}")
+    started = time.perf_counter()
+    with db.guarded_begin('export') as conn:
+        conn.execute(text(f"SELECT {name}__refresh()"))
+    return (time.perf_counter() - started) * 1000.0
+
+
+def incremental_summary_status(db, name):
+    if not isinstance(name, str) or not _ident_re.match(name):
+        raise ValueError(f"Недопустимое имя сводки: {name!r}")
+    with db.engine.connect() as conn:
+        if conn.execute(text("SELECT to_regclass(:t)"), {'t': f"{name}__meta"}).scalar() is None:
+            return None
+        row = conn.execute(text(f"SELECT stale_since, refreshed_at FROM {name}__meta")).mappings().first()
+    return dict(row) if row else None
+
+
+def refresh_stale_summaries(db):
+    done = {}
+    for name in list_incremental_summaries(db):
+        status = incremental_summary_status(db, name)
+        if status is not None and status['stale_since'] is not None:
+            done[name] = refresh_incremental_summary(db, name)
+    return done
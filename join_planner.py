@@ -0,0 +1,128 @@
+from collections import deque
+
+
+class JoinPlanner:
+    def __init__(self, db, tables=None):
+        self.db = db
+        self.graph = {}
+        self._build(tables)
+
+    def _build(self, tables):
+        if tables is None:
+            tables = self.db.list_tables()
+        missing = [t for t in tables if t not in self.db.metadata.tables]
+        if missing:
+            try:
+                self.db.reflect_tables(missing)
+            except Exception:
+                for t in missing:
+                    try:
+                        self.db.reflect_tables([t])
+                    except Exception:
+                        pass
+        for name in tables:
+            table = self.db.metadata.tables.get(name)
+            if table is None:
+                continue
+            self.graph.setdefault(name, [])
+            for fk in table.foreign_key_constraints:
+                if len(fk.elements) != 1:
+                    continue
+                el = fk.elements[0]
+                target = el.column.table.name
+                local_col = el.parent.name
+                target_col = el.column.name
+                self.graph[name].append((target, local_col, target_col))
+                self.graph.setdefault(target, []).append((name, target_col, local_col))
+
+    def neighbours(self, table):
+        return list(self.graph.get(table, []))
+
+    def direct_edge(self, left, right):
+        for other, lf, rf in self.graph.get(left, []):
+            if other == right:
+                return lf, rf
+        return None
+
+    def shortest_path(self, sources, target):
+        sources = set(sources)
+        if target in sources:
+            return []
+        prev = {s: None for s in sources}
+        queue = deque(sorted(sources))
+        while queue:
+            table = queue.popleft()
+            for other, lf, rf in self.graph.get(table, []):
+                if other in prev:
+                    continue
+                prev[other] = (table, lf, rf)
+                if other == target:
+                    path = []
+                    node = target
+                    while prev[node] is not None:
+                        left, l_col, r_col = prev[node]
+                        path.append({'left': left, 'right': node, 'lf': l_col, 'rf': r_col})
+                        node = left
+                    return list(reversed(path))
+                queue.append(other)
+        return None
+
+    def plan(self, tables, joins=None, join_type='INNER'):
+        joins = [dict(j) for j in (joins or [])]
+        tables = [t for t in dict.fromkeys(tables) if t]
+        if joins:
+            connected = {joins[0].get('left')} | {j.get('right') for j in joins}
+        elif tables:
+            connected = {tables[0]}
+        else:
+            return [], []
+        added = []
+        unreachable = []
+        pending = [t for t in tables if t not in connected]
+        while pending:
+            best = None
+            for t in pending:
+                path = self.shortest_path(connected, t)
+                if path is not None and (best is None or len(path) < len(best[1])):
+                    best = (t, path)
+            if best is None:
+                unreachable.extend(pending)
+                break
+            target, path = best
+            for step in path:
+                step['type'] = join_type
+                step['desc'] = f"{join_type} JOIN {step['right']} ON {step['left']}.{step['lf']} = {step['right']}.{step['rf']}"
+                added.append(step)
+                connected.add(step['right'])
+            pending = [t for t in pending if t not in connected]
+        return added, unreachable
+
+    @staticmethod
+    def components(tables, joins=None):
+        parent = {t: t for t in tables}
+
+        def find(t):
+            while parent[t] != t:
+                parent[t] = parent[parent[t]]
+                t = parent[t]
+            return t
+
+        for j in joins or []:
+            left, right = j.get('left'), j.get('right')
+            for t in (left, right):
+                parent.setdefault(t, t)
+            parent[find(left)] = find(right)
+        groups = {}
+        for t in tables:
+            groups.setdefault(find(t), []).append(t)
+        return list(groups.values())
+
+    def cross_join_estimate(self, tables, joins=None):
+        estimates = self.db.table_row_estimates(tables)
+        total = 1
+        for component in self.components(tables, joins):
+            sizes = [estimates.get(t) for t in component]
+            if any(n is None for n in sizes):
+                return None, estimates
+            total *= max(max(sizes), 1)
+        return total, estimates
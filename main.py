@@ -1,3 +1,7 @@
+import time
+
+_STARTUP_T0 = time.perf_counter()
+
 import logging
 from typing import Optional, Dict, Callable
 import sys
@@ -10,12 +14,30 @@ from PySide6.QtCore import Qt, QSize, Signal, QObject
 
 from connect_form import ConnectionDialog
 from db import Database
-from add_form import AddDialog
-from alter_form import AlterTableDialog
 from logger import LogsWindow
-from refresh_manager import TableManager
-from view_form import SQLStubWindow
-from view_results_form import TableResultWidget
+from config import settings
+from refresh_manager import TableManager, MaintenanceScheduler
+from incremental_agg import refresh_stale_summaries
+
+logger = logging.getLogger("startup")
+
+
+class StartupTimer:
+    def __init__(self, t0: float = None):
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.last = self.t0
+        self.phases = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000.0))
+        self.last = now
+
+    def report(self) -> str:
+        total = (self.last - self.t0) * 1000.0
+        parts = ", ".join(f"{name} {ms:.0f} мс" for name, ms in self.phases)
+        return f"Запуск: {parts}; всего {total:.0f} мс"
+
 
 class AppMainWindow(QMainWindow):
     BUTTONS = [
@@ -24,8 +46,14 @@ class AppMainWindow(QMainWindow):
         ("add", "Добавить данные"),
         ("view", "Посмотреть данные"),
     ]
-
-    def __init__(self, db: Database, button_callbacks = None):
+    PAGE_INDEXES = {
+        "logs": (0, 1),
+        "migrate": (1, 2),
+        "add": (2, 3),
+        "view": (3, 4),
+    }
+
+    def __init__(self, db: Database, button_callbacks = None, startup_timer: StartupTimer = None):
         super().__init__()
         self.db = db
         self.button_callbacks = button_callbacks or {}
@@ -35,12 +63,32 @@ class AppMainWindow(QMainWindow):
         self.view_container_page = None
         self.view_container_layout = None
         self.active_view_result_widget = None
+        self._built_pages = set()
+        self._page_builders = {
+            "migrate": self._build_migrate_page,
+            "add": self._build_add_page,
+            "view": self._build_view_page,
+        }
         self.setWindowTitle("ыыыыыыыыыыыыыыыыыыыы")
 
         self.table_manager = TableManager(self.db, parent=self)
+        if startup_timer is not None:
+            startup_timer.mark("схема")
+
+        self.maintenance = MaintenanceScheduler(self.db, parent=self)
+        self.maintenance.jobFinished.connect(self._on_maintenance_finished)
+        self.maintenance.schedule("partitions", settings.MAINTENANCE_INTERVAL_SEC,
+                                  self.db.maintain_all_partitions, run_now=True)
+        self.maintenance.schedule("matviews", settings.MATVIEW_CHECK_INTERVAL_SEC,
+                                  self.db.refresh_due_matviews)
+        self.maintenance.schedule("summaries", settings.MATVIEW_CHECK_INTERVAL_SEC,
+                                  lambda: refresh_stale_summaries(self.db))
+        self.maintenance.start()
 
         self._init_ui()
         self.apply_styles()
+        if startup_timer is not None:
+            startup_timer.mark("интерфейс")
 
     def _init_ui(self):
         root = QWidget()
@@ -87,9 +135,8 @@ class AppMainWindow(QMainWindow):
 
         self.left_stack = QStackedWidget()
         self.left_stack.addWidget(self._empty_panel(" "))
-        self.left_stack.addWidget(self._build_left_migrate_panel())
-        self.left_stack.addWidget(self._build_left_add_panel())
-        self.left_stack.addWidget(self._build_left_view_panel())
+        for _ in range(3):
+            self.left_stack.addWidget(self._empty_panel(" "))
         left_layout.addWidget(self.left_stack)
         left_layout.addStretch(1)
 
@@ -105,24 +152,8 @@ class AppMainWindow(QMainWindow):
         self.right_stack.addWidget(self._welcome_page())
         self.logs_page = LogsWindow(parent=self)
         self.right_stack.addWidget(self.logs_page)
-
-        self.migrate_container_page = QWidget()
-        self.migrate_container_layout = QVBoxLayout(self.migrate_container_page)
-        self.migrate_container_layout.setContentsMargins(0, 0, 0, 0)
-        self.migrate_container_layout.setSpacing(6)
-        self.right_stack.addWidget(self.migrate_container_page)
-
-        self.add_container_page = QWidget()
-        self.add_container_layout = QVBoxLayout(self.add_container_page)
-        self.add_container_layout.setContentsMargins(0, 0, 0, 0)
-        self.add_container_layout.setSpacing(6)
-        self.right_stack.addWidget(self.add_container_page)
-
-        self.view_container_page = QWidget()
-        self.view_container_layout = QVBoxLayout(self.view_container_page)
-        self.view_container_layout.setContentsMargins(0, 0, 0, 0)
-        self.view_container_layout.setSpacing(6)
-        self.right_stack.addWidget(self.view_container_page)
+        for _ in range(3):
+            self.right_stack.addWidget(QWidget())
 
         scroll = QScrollArea()
         scroll.setWidgetResizable(True)
@@ -140,6 +171,52 @@ class AppMainWindow(QMainWindow):
 
         self.show_context("logs")
 
+    def _on_maintenance_finished(self, key: str, result):
+        if key != "partitions" or not isinstance(result, dict):
+            return
+        if any(r.get('detached') for r in result.values() if isinstance(r, dict)):
+            self.table_manager.handle_external_change()
+
+    def _container_page(self):
+        page = QWidget()
+        layout = QVBoxLayout(page)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(6)
+        return page, layout
+
+    def _replace_stack_page(self, stack: QStackedWidget, index: int, widget: QWidget):
+        old = stack.widget(index)
+        stack.insertWidget(index, widget)
+        if old is not None:
+            stack.removeWidget(old)
+            old.deleteLater()
+
+    def _ensure_page(self, key: str):
+        if key in self._built_pages:
+            return
+        builder = self._page_builders.get(key)
+        if builder is None:
+            return
+        started = time.perf_counter()
+        left, right = builder()
+        left_idx, right_idx = self.PAGE_INDEXES[key]
+        self._replace_stack_page(self.left_stack, left_idx, left)
+        self._replace_stack_page(self.right_stack, right_idx, right)
+        self._built_pages.add(key)
+        logger.info("Страница %s построена за %.0f мс", key, (time.perf_counter() - started) * 1000.0)
+
+    def _build_migrate_page(self):
+        self.migrate_container_page, self.migrate_container_layout = self._container_page()
+        return self._build_left_migrate_panel(), self.migrate_container_page
+
+    def _build_add_page(self):
+        self.add_container_page, self.add_container_layout = self._container_page()
+        return self._build_left_add_panel(), self.add_container_page
+
+    def _build_view_page(self):
+        self.view_container_page, self.view_container_layout = self._container_page()
+        return self._build_left_view_panel(), self.view_container_page
+
     def _build_left_migrate_panel(self):
         w = QWidget()
         layout = QVBoxLayout(w)
@@ -148,7 +225,7 @@ class AppMainWindow(QMainWindow):
 
         self.migrate_buttons_layout = QVBoxLayout()
         for i in self.table_manager.tables():
-            btn = QPushButton(i)
+            btn = QPushButton(self.table_manager.label(i))
             btn.clicked.connect(lambda _, t=i: self.on_migrate_table_selected(t))
             self.migrate_buttons_layout.addWidget(btn)
 
@@ -165,13 +242,14 @@ class AppMainWindow(QMainWindow):
             if item.widget():
                 item.widget().deleteLater()
         for i in tables:
-            btn = QPushButton(i)
+            btn = QPushButton(self.table_manager.label(i))
             btn.clicked.connect(lambda _, t=i: self.on_migrate_table_selected(t))
             self.migrate_buttons_layout.addWidget(btn)
 
     def on_migrate_table_selected(self, table_name: str):
         if not table_name:
             return
+        from alter_form import AlterTableDialog
 
         if self.active_migrate_widget is not None:
             try:
@@ -233,7 +311,7 @@ class AppMainWindow(QMainWindow):
 
         self.add_buttons_layout = QVBoxLayout()
         for i in self.table_manager.tables():
-            btn = QPushButton(i)
+            btn = QPushButton(self.table_manager.label(i))
             btn.clicked.connect(lambda _, t=i: self.on_add_table_selected(t))
             self.add_buttons_layout.addWidget(btn)
 
@@ -250,13 +328,14 @@ class AppMainWindow(QMainWindow):
             if item.widget():
                 item.widget().deleteLater()
         for i in tables:
-            btn = QPushButton(i)
+            btn = QPushButton(self.table_manager.label(i))
             btn.clicked.connect(lambda _, t=i: self.on_add_table_selected(t))
             self.add_buttons_layout.addWidget(btn)
 
     def on_add_table_selected(self, table_name: str):
         if not table_name:
             return
+        from add_form import AddDialog
 
         if self.active_insert_widget is not None:
             try:
@@ -326,10 +405,13 @@ class AppMainWindow(QMainWindow):
     def _attach_view_left_widget(self):
         if self.active_view_widget is not None:
             return
+        from view_form import SQLStubWindow
 
         try:
             stub = SQLStubWindow(db = self.db)
             stub.apply_sql.connect(self._on_view_apply_sql)
+            stub.history_rerun.connect(
+                lambda sql, params, source: self._on_view_apply_sql(sql, params, source=source, use_cache=True))
         except Exception as e:
             print("Не удалось создать SQLStubWindow:", e)
             return
@@ -362,19 +444,14 @@ class AppMainWindow(QMainWindow):
             self._clear_layout(self.view_left_container_layout)
     def _make_top_button_handler(self, key: str):
         def handler():
-            idx_map = {
-                "logs": (0, 1),
-                "migrate": (1, 2),
-                "add": (2, 3),
-                "view": (3, 4),
-            }
             if key != "view":
                 try:
                     self._detach_view_left_widget()
                 except Exception:
                     pass
 
-            left_idx, right_idx = idx_map.get(key, (0, 0))
+            self._ensure_page(key)
+            left_idx, right_idx = self.PAGE_INDEXES.get(key, (0, 0))
             self.left_stack.setCurrentIndex(left_idx)
             self.right_stack.setCurrentIndex(right_idx)
             self.right_heading.setText(self.top_buttons[key].text())
@@ -394,7 +471,8 @@ class AppMainWindow(QMainWindow):
 
         return handler
 
-    def _on_view_apply_sql(self, sql: str):
+    def _on_view_apply_sql(self, sql: str, params=None, source='builder', use_cache=False):
+        from view_results_form import TableResultWidget
         try:
             if self.active_view_result_widget is not None:
                 self.active_view_result_widget.setParent(None)
@@ -407,7 +485,8 @@ class AppMainWindow(QMainWindow):
             self._clear_layout(self.view_container_layout)
 
         try:
-            tv = TableResultWidget(self.db, sql, parent=self.view_container_page)
+            tv = TableResultWidget(self.db, sql, parent=self.view_container_page, params=params,
+                                   source=source, use_cache=use_cache)
             self.view_container_layout.addWidget(tv)
             tv.show()
             self.active_view_result_widget = tv
@@ -676,13 +755,17 @@ class AppMainWindow(QMainWindow):
 
 
 def main():
+    timer = StartupTimer(_STARTUP_T0)
     app = QApplication(sys.argv)
+    timer.mark("импорт")
 
     try:
         db = Database()
-        w = AppMainWindow(db=db)
+        timer.mark("подключение")
+        w = AppMainWindow(db=db, startup_timer=timer)
         w.resize(1200, 550)
         w.show()
+        logger.info(timer.report())
         sys.exit(app.exec())
     except Exception:
         print('вв')
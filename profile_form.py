@@ -0,0 +1,194 @@
+from datetime import date, datetime
+
+from PySide6.QtCore import Qt, QRectF
+from PySide6.QtGui import QColor, QPainter
+from PySide6.QtWidgets import (
+    QDialog, QFormLayout, QHBoxLayout, QLabel, QMessageBox, QPushButton, QToolTip, QVBoxLayout, QWidget
+)
+
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def histogram_bars(bounds):
+    if len(bounds) < 2:
+        return []
+    share = 1.0 / (len(bounds) - 1)
+    numbers = [_as_number(b) for b in bounds]
+    if any(n is None for n in numbers) or numbers[-1] <= numbers[0]:
+        return [(f"{bounds[i]} … {bounds[i + 1]}", share, 1.0) for i in range(len(bounds) - 1)]
+    min_width = (numbers[-1] - numbers[0]) / (len(bounds) - 1) / 20.0
+    bars = []
+    for i in range(len(bounds) - 1):
+        width = max(numbers[i + 1] - numbers[i], min_width)
+        bars.append((f"{bounds[i]} … {bounds[i + 1]}: {share:.1%}", share / width, width))
+    return bars
+
+
+class BarChart(QWidget):
+    def __init__(self, title: str = '', parent=None):
+        super().__init__(parent)
+        self.title = title
+        self.bars = []
+        self.edge_labels = None
+        self.setMinimumHeight(170)
+        self.setMouseTracking(True)
+
+    def set_bars(self, bars, edge_labels=None):
+        self.bars = list(bars)
+        self.edge_labels = edge_labels
+        self.update()
+
+    def _plot_rect(self):
+        return QRectF(self.rect()).adjusted(10, 24, -10, -24)
+
+    def _bar_rects(self):
+        rect = self._plot_rect()
+        total = sum(w for _, _, w in self.bars) or 1.0
+        top = max((h for _, h, _ in self.bars), default=0) or 1.0
+        x = rect.left()
+        rects = []
+        for _, height, weight in self.bars:
+            width = rect.width() * weight / total
+            bar_height = rect.height() * height / top
+            rects.append(QRectF(x, rect.bottom() - bar_height, width, bar_height))
+            x += width
+        return rects
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QColor('#344e63'))
+        painter.drawText(10, 16, self.title)
+        rect = self._plot_rect()
+        if not self.bars:
+            painter.drawText(rect, Qt.AlignCenter, "нет данных")
+            return
+        painter.setPen(QColor('#cbd5e0'))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+        metrics = painter.fontMetrics()
+        rects = self._bar_rects()
+        for (label, _, _), bar in zip(self.bars, rects):
+            painter.fillRect(bar.adjusted(1, 0, -1, 0), QColor('#4a90e2'))
+            if self.edge_labels is None:
+                painter.setPen(QColor('#344e63'))
+                text = metrics.elidedText(label, Qt.ElideRight, max(int(bar.width()) - 2, 0))
+                painter.drawText(QRectF(bar.left(), rect.bottom() + 2, bar.width(), 20), Qt.AlignHCenter, text)
+        if self.edge_labels:
+            painter.setPen(QColor('#344e63'))
+            left, right = self.edge_labels
+            painter.drawText(QRectF(rect.left(), rect.bottom() + 2, rect.width() / 2, 20), Qt.AlignLeft, left)
+            painter.drawText(QRectF(rect.center().x(), rect.bottom() + 2, rect.width() / 2, 20), Qt.AlignRight, right)
+
+    def mouseMoveEvent(self, event):
+        pos = event.position()
+        for (label, _, _), bar in zip(self.bars, self._bar_rects()):
+            if bar.left() <= pos.x() < bar.right():
+                QToolTip.showText(event.globalPosition().toPoint(), label, self)
+                return
+        QToolTip.hideText()
+
+
+class ColumnProfileDialog(QDialog):
+    def __init__(self, db, table_name: str, column_name: str, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.table_name = table_name
+        self.column_name = column_name
+        self.profile = None
+        self.setWindowTitle(f"Профиль колонки: {table_name}.{column_name}")
+        self.resize(720, 560)
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        self.source_label = QLabel()
+        self.source_label.setWordWrap(True)
+        layout.addWidget(self.source_label)
+        form = QFormLayout()
+        self.rows_label = QLabel()
+        self.null_label = QLabel()
+        self.distinct_label = QLabel()
+        self.correlation_label = QLabel()
+        form.addRow("Строк:", self.rows_label)
+        form.addRow("Доля NULL:", self.null_label)
+        form.addRow("Различных значений:", self.distinct_label)
+        form.addRow("Корреляция с порядком строк:", self.correlation_label)
+        layout.addLayout(form)
+        self.mcv_chart = BarChart("Частые значения")
+        layout.addWidget(self.mcv_chart)
+        self.hist_chart = BarChart("Гистограмма")
+        layout.addWidget(self.hist_chart)
+        btn_row = QHBoxLayout()
+        self.btn_analyze = QPushButton("ANALYZE сейчас")
+        self.btn_sample = QPushButton("По выборке")
+        self.btn_close = QPushButton("Закрыть")
+        btn_row.addWidget(self.btn_analyze)
+        btn_row.addWidget(self.btn_sample)
+        btn_row.addStretch(1)
+        btn_row.addWidget(self.btn_close)
+        layout.addLayout(btn_row)
+        self.btn_analyze.clicked.connect(self.handle_analyze)
+        self.btn_sample.clicked.connect(self.handle_sample)
+        self.btn_close.clicked.connect(self.accept)
+
+    def refresh(self):
+        try:
+            self.profile = self.db.column_profile(self.table_name, self.column_name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось получить профиль колонки:\n{e}")
+            return
+        self._show_profile(" Статистики нет — выполните ANALYZE.")
+
+    def handle_analyze(self):
+        try:
+            self.db.analyze_table(self.table_name, [self.column_name])
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"ANALYZE не выполнен:\n{e}")
+            return
+        self.refresh()
+
+    def handle_sample(self):
+        try:
+            self.profile = self.db.sample_column_profile(self.table_name, self.column_name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось построить профиль по выборке:\n{e}")
+            return
+        self._show_profile()
+
+    def _show_profile(self, hint=''):
+        p = self.profile or {}
+        if p.get('source') == 'pg_stats':
+            analyzed = p.get('analyzed_at')
+            when = analyzed.strftime('%Y-%m-%d %H:%M') if isinstance(analyzed, (date, datetime)) else "неизвестно"
+            self.source_label.setText(f"Источник: статистика планировщика (pg_stats), ANALYZE: {when}")
+            self.hist_chart.title = "Гистограмма (без частых значений, равные доли строк)"
+        else:
+            self.source_label.setText(
+                f"Источник: выборка TABLESAMPLE SYSTEM ({p.get('percent', 0):g}%), "
+                f"строк в выборке: {p.get('sample_rows', 0)}." + hint
+            )
+            self.hist_chart.title = "Гистограмма по выборке (равные доли строк)"
+        rows = p.get('rows')
+        if rows is None and p.get('sample_rows') is not None and p.get('percent'):
+            rows = p['sample_rows'] * 100.0 / p['percent']
+        self.rows_label.setText("—" if rows is None else f"~{int(rows):,}".replace(',', ' '))
+        null_frac = p.get('null_frac')
+        self.null_label.setText("—" if null_frac is None else f"{null_frac:.2%}")
+        distinct = p.get('distinct')
+        suffix = " (в выборке)" if p.get('source') == 'sample' else ""
+        self.distinct_label.setText("—" if distinct is None else f"~{int(distinct):,}".replace(',', ' ') + suffix)
+        correlation = p.get('correlation')
+        self.correlation_label.setText("—" if correlation is None else f"{correlation:.3f}")
+        self.mcv_chart.set_bars([(f"{v}: {f:.1%}", f, 1.0) for v, f in p.get('mcv') or []])
+        bounds = p.get('histogram') or []
+        self.hist_chart.set_bars(histogram_bars(bounds), (str(bounds[0]), str(bounds[-1])) if bounds else None)
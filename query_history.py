@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+
+from config import settings
+
+logger = logging.getLogger("query_history")
+
+SOURCES = ('builder', 'view', 'edit')
+
+ORDERINGS = {
+    'frequency': 'runs DESC, total_ms DESC',
+    'total': 'total_ms DESC',
+    'avg': 'avg_ms DESC',
+    'recent': 'last_id DESC',
+}
+
+TABLES_CACHE_SIZE = 256
+
+_stores = {}
+_stores_lock = threading.Lock()
+_tables_cache = OrderedDict()
+_tables_lock = threading.Lock()
+
+_token_re = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|::"
+    r"|%\([A-Za-z_][A-Za-z0-9_]*\)s|[:$][A-Za-z0-9_]+|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b",
+    re.S,
+)
+_in_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS executions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fingerprint TEXT NOT NULL,
+        sql TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        source TEXT NOT NULL,
+        executed_at REAL NOT NULL,
+        duration_ms REAL,
+        rows INTEGER,
+        cached INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS executions_fingerprint ON executions (fingerprint);
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        columns TEXT NOT NULL,
+        rows BLOB NOT NULL,
+        tables TEXT NOT NULL,
+        counters TEXT NOT NULL,
+        stored_at REAL NOT NULL
+    );
+"""
+
+
+def normalize_sql(sql: str) -> str:
+    def repl(m):
+        token = m.group(0)
+        if token.startswith('"') or token == '::':
+            return token
+        if token.startswith('--') or token.startswith('/*'):
+            return ' '
+        return '?'
+
+    normalized = re.sub(r'\s+', ' ', _token_re.sub(repl, sql or '')).strip().rstrip(';').strip()
+    return _in_list_re.sub('(?)', normalized).lower()
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode('utf-8')).hexdigest()[:16]
+
+
+def result_key(sql: str, params=None) -> str:
+    payload = json.dumps([sql, params or {}], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def remember_tables(sql: str, params, tables):
+    key = result_key(sql, params)
+    with _tables_lock:
+        _tables_cache[key] = list(tables or ())
+        _tables_cache.move_to_end(key)
+        while len(_tables_cache) > TABLES_CACHE_SIZE:
+            _tables_cache.popitem(last=False)
+
+
+def known_tables(sql: str, params=None):
+    key = result_key(sql, params)
+    with _tables_lock:
+        tables = _tables_cache.get(key)
+        if tables is not None:
+            _tables_cache.move_to_end(key)
+            return list(tables)
+    return None
+
+
+class QueryHistory:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=5)
+        conn.row_factory = sqlite3.Row
+        return closing(conn)
+
+    def record(self, sql: str, params=None, source: str = 'builder', duration_ms: float = None,
+               rows: int = None, error: str = None, cached: bool = False):
+        if source not in SOURCES:
+            raise ValueError(f"Неизвестный источник запроса: {source!r}")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO executions (fingerprint, sql, params, source, executed_at, duration_ms, rows, cached, error)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint(sql), sql, json.dumps(params or {}, ensure_ascii=False, default=str), source,
+                 time.time(), duration_ms, rows, int(bool(cached)), error),
+            )
+            conn.execute(
+                "DELETE FROM executions WHERE id <= (SELECT max(id) FROM executions) - ?",
+                (int(settings.HISTORY_MAX_ENTRIES),),
+            )
+            conn.commit()
+
+    def search(self, text: str = '', source: str = None, order: str = 'frequency', limit: int = 200):
+        if order not in ORDERINGS:
+            raise ValueError(f"Неизвестный порядок сортировки: {order!r}")
+        pattern = '%' + (text or '').strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        sql = f"""
+            SELECT fingerprint, sql, params, source, executed_at AS last_at, max(id) AS last_id,
+                   count(*) AS runs, coalesce(sum(duration_ms), 0) AS total_ms, avg(duration_ms) AS avg_ms,
+                   avg(rows) AS avg_rows, sum(error IS NOT NULL) AS errors, sum(cached) AS cache_hits
+            FROM executions
+            WHERE sql LIKE ? ESCAPE '\\' AND (? IS NULL OR source = ?)
+            GROUP BY fingerprint
+            ORDER BY {ORDERINGS[order]}
+            LIMIT ?
+        """
+        with self._connect() as conn:
+            rows = conn.execute(sql, (pattern, source, source, int(limit))).fetchall()
+        entries = []
+        for r in rows:
+            entry = dict(r)
+            entry['params'] = json.loads(entry['params'] or '{}')
+            entries.append(entry)
+        return entries
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM executions")
+            conn.execute("DELETE FROM results")
+            conn.commit()
+
+    def snapshot(self, db, sql: str, params=None):
+        if settings.HISTORY_CACHE_ENTRIES <= 0:
+            return [], {}
+        tables = known_tables(sql, params)
+        if tables is None:
+            report = db.validate_query(sql, params)
+            tables = report.get('tables') or []
+            if report.get('ok'):
+                remember_tables(sql, params, tables)
+        if not tables:
+            return [], {}
+        return tables, db.table_write_counters(tables)
+
+    def store_result(self, sql: str, params, columns, rows, tables, counters):
+        if not tables or len(rows) > settings.HISTORY_CACHE_MAX_ROWS or settings.HISTORY_CACHE_ENTRIES <= 0:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, fingerprint, columns, rows, tables, counters, stored_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (result_key(sql, params), fingerprint(sql), json.dumps([str(c) for c in columns]),
+                 pickle.dumps([tuple(r) for r in rows]), json.dumps(list(tables)), json.dumps(counters),
+                 time.time()),
+            )
+            conn.execute(
+                "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY stored_at DESC LIMIT ?)",
+                (int(settings.HISTORY_CACHE_ENTRIES),),
+            )
+            conn.commit()
+
+    def cached_result(self, db, sql: str, params=None):
+        key = result_key(sql, params)
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row['stored_at'] < settings.HISTORY_CACHE_MIN_AGE_SEC:
+            return None
+        valid = time.time() - row['stored_at'] <= settings.HISTORY_CACHE_TTL_SEC
+        if valid:
+            tables = json.loads(row['tables'])
+            valid = db.table_write_counters(tables) == json.loads(row['counters'])
+        if not valid:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                conn.commit()
+            return None
+        return json.loads(row['columns']), pickle.loads(row['rows'])
+
+    def invalidate(self, tables):
+        tables = set(tables or ())
+        if not tables:
+            return
+        with self._connect() as conn:
+            stale = [r['key'] for r in conn.execute("SELECT key, tables FROM results")
+                     if tables & set(json.loads(r['tables']))]
+            conn.executemany("DELETE FROM results WHERE key = ?", [(k,) for k in stale])
+            conn.commit()
+
+
+def history_for(db) -> QueryHistory:
+    path = settings.data_dir() / "history" / f"{db._dsn_key()}.sqlite3"
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = QueryHistory(path)
+        return store
+
+
+def log_execution(db, sql: str, params=None, source: str = 'builder', started: float = None,
+                  rows: int = None, error: str = None, cached: bool = False, tables=None):
+    duration_ms = (time.perf_counter() - started) * 1000.0 if started is not None else None
+    try:
+        history = history_for(db)
+        history.record(sql, params, source, duration_ms, rows, error, cached)
+        if tables and source == 'edit' and error is None:
+            history.invalidate(tables)
+    except Exception as e:
+        logger.warning("Не удалось записать запрос в историю: %s", e)
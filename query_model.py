@@ -0,0 +1,486 @@
+import re
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+_plain_ident_re = re.compile(r'^[a-z_][a-z0-9_$]*$')
+_func_name_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_column_ref_re = re.compile(r'^([^\s.()]+)\.([^\s()]+)$')
+
+RESERVED_WORDS = frozenset("""
+    all analyse analyze and any array as asc asymmetric authorization binary both case cast check collate
+    column concurrently constraint create cross current_catalog current_date current_role current_schema
+    current_time current_timestamp current_user default deferrable desc distinct do else end except false
+    fetch for foreign freeze from full grant group having ilike in initially inner intersect into is isnull
+    join lateral leading left like limit localtime localtimestamp natural not notnull null offset on only or
+    order outer overlaps placing primary references returning right select session_user similar some
+    symmetric table tablesample then to trailing true union unique user using variadic verbose when where
+    window with
+""".split())
+
+
+def quote_ident(name: str) -> str:
+    if _plain_ident_re.match(name) and name not in RESERVED_WORDS:
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def literal(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _typed_key(value):
+    if isinstance(value, (tuple, list)):
+        return type(value).__name__, tuple(_typed_key(v) for v in value)
+    return type(value).__name__, value
+
+
+class Value(NamedTuple):
+    value: object
+
+    def __eq__(self, other):
+        return isinstance(other, Value) and _typed_key(self.value) == _typed_key(other.value)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(('Value', _typed_key(self.value)))
+
+
+class Param(NamedTuple):
+    name: str
+    value: object
+
+    def __eq__(self, other):
+        return (isinstance(other, Param) and self.name == other.name
+                and _typed_key(self.value) == _typed_key(other.value))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(('Param', self.name, _typed_key(self.value)))
+
+
+class Fragment(NamedTuple):
+    parts: Tuple
+
+    def __str__(self):
+        return ''.join(literal(p.value) if isinstance(p, (Value, Param)) else p for p in self.parts)
+
+    def bind(self, prefix: str) -> 'Fragment':
+        out = []
+        n = 0
+        for p in self.parts:
+            if isinstance(p, Value):
+                n += 1
+                p = Param(f"{prefix}_{n}", p.value)
+            out.append(p)
+        return Fragment(tuple(out))
+
+
+def fragment(*parts) -> Fragment:
+    return Fragment(tuple(p if isinstance(p, (str, Value, Param)) else Value(p) for p in parts))
+
+
+class Column(NamedTuple):
+    table: str
+    name: str
+
+
+class Raw(NamedTuple):
+    sql: str
+
+
+class Func(NamedTuple):
+    name: str
+    args: Tuple
+
+
+class Aliased(NamedTuple):
+    expr: object
+    alias: str
+
+
+class OrderItem(NamedTuple):
+    expr: object
+    direction: str = ''
+
+
+class Join(NamedTuple):
+    kind: str
+    left: Column
+    right: Column
+
+
+class Cte(NamedTuple):
+    name: str
+    sql: str
+
+
+class GroupBy(NamedTuple):
+    items: Tuple
+    mode: Optional[str] = None
+    sets: Tuple = ()
+
+
+class CoalesceRule(NamedTuple):
+    op: str
+    column: Column
+    arg: object
+
+
+class Sample(NamedTuple):
+    method: str = 'SYSTEM'
+    percent: float = 1.0
+    seed: int = 0
+
+
+class Query(NamedTuple):
+    select: Tuple = ()
+    from_: Tuple = ()
+    joins: Tuple = ()
+    where: Tuple = ()
+    group_by: Optional[GroupBy] = None
+    having: Tuple = ()
+    order_by: Tuple = ()
+    ctes: Tuple = ()
+    coalesce: Tuple = ()
+    sample: Optional[Sample] = None
+
+
+SAMPLE_METHODS = ('SYSTEM', 'BERNOULLI')
+
+
+STAR = Raw('*')
+
+
+def column_ref(value: str):
+    if value == '*':
+        return STAR
+    m = _column_ref_re.match(value.strip())
+    if m:
+        return Column(m.group(1), m.group(2))
+    return Raw(value)
+
+
+def order_item(entry: str) -> OrderItem:
+    head, _, tail = entry.strip().rpartition(' ')
+    if head and tail.upper() in ('ASC', 'DESC'):
+        return OrderItem(column_ref(head), tail.upper())
+    return OrderItem(column_ref(entry))
+
+
+@lru_cache(maxsize=4096)
+def render_expr(expr, coalesce: Tuple = (), inline: bool = False) -> str:
+    if isinstance(expr, Column):
+        sql = f"{quote_ident(expr.table)}.{quote_ident(expr.name)}"
+        for rule in coalesce:
+            if rule.column == expr:
+                return f"{rule.op}({sql}, {render_expr(rule.arg, (), inline)})"
+        return sql
+    if isinstance(expr, Raw):
+        return _apply_coalesce_to_raw(expr.sql, coalesce, inline)
+    if isinstance(expr, Param):
+        return literal(expr.value) if inline else f":{expr.name}"
+    if isinstance(expr, Value):
+        return literal(expr.value)
+    if isinstance(expr, Fragment):
+        return ''.join(
+            _apply_coalesce_to_raw(p, coalesce, inline) if isinstance(p, str) else render_expr(p, (), inline)
+            for p in expr.parts
+        )
+    if isinstance(expr, Func):
+        if not _func_name_re.match(expr.name):
+            raise ValueError(f"Недопустимое имя функции: {expr.name!r}")
+        return f"{expr.name.upper()}({', '.join(render_expr(a, coalesce, inline) for a in expr.args)})"
+    if isinstance(expr, Aliased):
+        return f"{render_expr(expr.expr, coalesce, inline)} AS {quote_ident(expr.alias)}"
+    if isinstance(expr, OrderItem):
+        sql = render_expr(expr.expr, coalesce, inline)
+        return f"{sql} {expr.direction}" if expr.direction else sql
+    raise TypeError(f"Неизвестный узел запроса: {expr!r}")
+
+
+def _apply_coalesce_to_raw(sql: str, coalesce: Tuple, inline: bool = False) -> str:
+    for rule in coalesce:
+        col = f"{rule.column.table}.{rule.column.name}"
+        pat = r'(?<![\w."])' + re.escape(col) + r'(?![\w"])'
+        repl = f"{rule.op}({col}, {render_expr(rule.arg, (), inline)})"
+        sql = re.sub(pat, lambda _m, r=repl: r, sql)
+    return sql
+
+
+def _select_item(expr, coalesce, inline):
+    if isinstance(expr, Column) and any(rule.column == expr for rule in coalesce):
+        return render_expr(Aliased(expr, expr.name), coalesce, inline)
+    return render_expr(expr, coalesce, inline)
+
+
+@lru_cache(maxsize=512)
+def render_with(ctes: Tuple) -> str:
+    if not ctes:
+        return ''
+    parts = []
+    for cte in ctes:
+        sql = cte.sql.strip()
+        if sql.endswith(';'):
+            sql = sql[:-1].rstrip()
+        if not sql:
+            sql = "/* empty cte */"
+        parts.append(f"{quote_ident(cte.name)} AS (\n{sql}\n)")
+    return "WITH " + ",\n".join(parts)
+
+
+def render_tablesample(sample: Sample) -> str:
+    if sample.method not in SAMPLE_METHODS:
+        raise ValueError(f"Неизвестный метод выборки: {sample.method!r}")
+    percent = float(sample.percent)
+    if not 0 < percent <= 100:
+        raise ValueError("Процент выборки должен быть в диапазоне (0, 100]")
+    return f"TABLESAMPLE {sample.method} ({percent!r}) REPEATABLE ({int(sample.seed)})"
+
+
+def _sampled_aggregate(expr: Aliased, sample: Sample, coalesce: Tuple, inline: bool):
+    func = expr.expr
+    fraction = float(sample.percent) / 100.0
+    scale = repr(100.0 / float(sample.percent))
+    rest = repr(1.0 - fraction)
+    sql = render_expr(func, coalesce, inline)
+    error_alias = quote_ident(f"{expr.alias}_ci95")
+    if func.name.upper() == 'COUNT':
+        return (f"{sql} * {scale} AS {quote_ident(expr.alias)}, "
+                f"1.96 * sqrt({sql} * {rest}) * {scale} AS {error_alias}")
+    arg = render_expr(func.args[0], coalesce, inline)
+    if func.name.upper() == 'SUM':
+        return (f"{sql} * {scale} AS {quote_ident(expr.alias)}, "
+                f"1.96 * sqrt({rest} * SUM(CAST({arg} AS float8) * CAST({arg} AS float8))) * {scale} AS {error_alias}")
+    return (f"{sql} AS {quote_ident(expr.alias)}, "
+            f"1.96 * STDDEV_SAMP({arg}) / sqrt(NULLIF(COUNT({arg}), 0)) AS {error_alias}")
+
+
+def _is_estimable(expr) -> bool:
+    return (isinstance(expr, Aliased) and isinstance(expr.expr, Func)
+            and expr.expr.name.upper() in ('COUNT', 'SUM', 'AVG')
+            and (expr.expr.name.upper() == 'COUNT' or (expr.expr.args and expr.expr.args[0] != STAR)))
+
+
+@lru_cache(maxsize=512)
+def render_select(items: Tuple, coalesce: Tuple = (), inline: bool = False, sample: Optional[Sample] = None) -> str:
+    if not items:
+        return "SELECT *"
+    return "SELECT " + ', '.join(
+        _sampled_aggregate(e, sample, coalesce, inline) if sample is not None and _is_estimable(e)
+        else _select_item(e, coalesce, inline)
+        for e in items
+    )
+
+
+@lru_cache(maxsize=512)
+def render_from(tables: Tuple, joins: Tuple, sample: Optional[Sample] = None) -> str:
+    if not tables:
+        lines = ["FROM /* no table selected */"]
+    else:
+        refs = [quote_ident(t) for t in tables]
+        if sample is not None:
+            refs[0] += " " + render_tablesample(sample)
+        lines = ["FROM " + ', '.join(refs)]
+    for j in joins:
+        if j.kind == 'CROSS':
+            lines.append(f"CROSS JOIN {quote_ident(j.right.table)}")
+            continue
+        lines.append(f"{j.kind} JOIN {quote_ident(j.right.table)} ON {render_expr(j.left)} = {render_expr(j.right)}")
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=512)
+def render_where(conditions: Tuple, coalesce: Tuple = (), keyword: str = 'WHERE', inline: bool = False) -> str:
+    if not conditions:
+        return ''
+    return f"{keyword} " + " AND ".join(render_expr(c, coalesce, inline) for c in conditions)
+
+
+@lru_cache(maxsize=512)
+def render_group_by(group_by: Optional[GroupBy], coalesce: Tuple = (), inline: bool = False) -> str:
+    if group_by is None or not group_by.items:
+        return ''
+    items = ", ".join(render_expr(e, coalesce, inline) for e in group_by.items)
+    if group_by.mode in ('ROLLUP', 'CUBE'):
+        return f"GROUP BY {group_by.mode}({items})"
+    if group_by.mode == 'GROUPING SETS' and group_by.sets:
+        sets = ", ".join("(" + ", ".join(render_expr(e, coalesce, inline) for e in s) + ")" for s in group_by.sets)
+        return f"GROUP BY GROUPING SETS ({sets})"
+    return f"GROUP BY {items}"
+
+
+@lru_cache(maxsize=512)
+def render_order_by(items: Tuple, coalesce: Tuple = (), inline: bool = False) -> str:
+    if not items:
+        return ''
+    return "ORDER BY " + ", ".join(render_expr(e, coalesce, inline) for e in items)
+
+
+@lru_cache(maxsize=256)
+def compile_query(query: Query, inline: bool = False) -> str:
+    co = query.coalesce
+    clauses = [
+        render_with(query.ctes),
+        render_select(query.select, co, inline, query.sample),
+        render_from(query.from_, query.joins, query.sample),
+        render_where(query.where, co, 'WHERE', inline),
+        render_group_by(query.group_by, co, inline),
+        render_where(query.having, co, 'HAVING', inline),
+        render_order_by(query.order_by, co, inline),
+    ]
+    return "\n".join(c for c in clauses if c)
+
+
+_sql_token_re = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|[A-Za-z_][A-Za-z0-9_$]*|\S", re.S
+)
+
+
+def _sql_tokens(sql: str):
+    return [m for m in _sql_token_re.finditer(sql) if not m.group(0).startswith(('--', '/*'))]
+
+
+def _is_name_token(token: str) -> bool:
+    return token.startswith('"') or (_func_name_re.match(token) is not None and token.lower() not in RESERVED_WORDS)
+
+
+def _skip_parens(tokens, i: int) -> int:
+    depth = 0
+    while i < len(tokens):
+        token = tokens[i].group(0)
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise ValueError("Несбалансированные скобки в тексте запроса")
+
+
+def _first_relation_end(sql: str) -> int:
+    tokens = _sql_tokens(sql)
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        token = tokens[i].group(0)
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token.upper() == 'FROM':
+            break
+        i += 1
+    else:
+        raise ValueError("Не удалось найти FROM верхнего уровня в тексте запроса")
+    i += 1
+    while i < len(tokens) and tokens[i].group(0) == '(':
+        if i + 1 < len(tokens) and tokens[i + 1].group(0).upper() in ('SELECT', 'VALUES', 'WITH', 'TABLE'):
+            raise ValueError("Первый источник — подзапрос, выборку к нему применить нельзя")
+        i += 1
+    if i < len(tokens) and tokens[i].group(0).upper() == 'ONLY':
+        i += 1
+    if i >= len(tokens) or not _is_name_token(tokens[i].group(0)):
+        raise ValueError("Не удалось найти таблицу для выборки в тексте запроса")
+    i += 1
+    if i + 1 < len(tokens) and tokens[i].group(0) == '.' and _is_name_token(tokens[i + 1].group(0)):
+        i += 2
+    if i < len(tokens) and tokens[i].group(0) == '(':
+        raise ValueError("Первый источник — функция, выборку к нему применить нельзя")
+    if i < len(tokens) and tokens[i].group(0).upper() == 'AS':
+        i += 1
+    if i < len(tokens) and _is_name_token(tokens[i].group(0)):
+        i += 1
+        if i < len(tokens) and tokens[i].group(0) == '(':
+            i = _skip_parens(tokens, i)
+    return tokens[i - 1].end()
+
+
+def sample_first_relation(sql: str, sample: Sample) -> str:
+    clause = render_tablesample(sample)
+    end = _first_relation_end(sql)
+    return sql[:end] + " " + clause + sql[end:]
+
+
+def query_params(node) -> Dict[str, object]:
+    params = {}
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, Param):
+            params[n.name] = n.value
+        elif isinstance(n, tuple):
+            stack.extend(n)
+    return params
+
+
+_bind_scan_re = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|::|\[|\]|(?<![\w:]):([A-Za-z_][A-Za-z0-9_]*)", re.S
+)
+
+
+def _bind_matches(sql: str):
+    depth = 0
+    for m in _bind_scan_re.finditer(sql):
+        token = m.group(0)
+        if token == '[':
+            depth += 1
+        elif token == ']':
+            depth = max(depth - 1, 0)
+        elif m.group(1) and not depth:
+            yield m
+
+
+def _replace_binds(sql: str, repl) -> str:
+    out = []
+    pos = 0
+    for m in _bind_matches(sql):
+        out.append(sql[pos:m.start()])
+        out.append(repl(m.group(1)))
+        pos = m.end()
+    out.append(sql[pos:])
+    return ''.join(out)
+
+
+def to_positional(sql: str):
+    names = []
+
+    def repl(name):
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _replace_binds(sql, repl), names
+
+
+def inline_params(sql: str, params: Dict[str, object]) -> str:
+    if not params:
+        return sql
+    return _replace_binds(sql, lambda name: literal(params[name]) if name in params else f":{name}")
+
+
+def original_position(sql: str, position: int) -> int:
+    names = []
+    shift = 0
+    for m in _bind_matches(sql):
+        name = m.group(1)
+        if name not in names:
+            names.append(name)
+        repl_len = len(f"${names.index(name) + 1}")
+        start = m.start() - shift
+        if start >= position - 1:
+            break
+        if position - 1 < start + repl_len:
+            return m.start() + 1
+        shift += (m.end() - m.start()) - repl_len
+    return position + shift
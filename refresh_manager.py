@@ -1,15 +1,30 @@
-from PySide6.QtCore import QStringListModel, Signal, QObject
+import logging
+import threading
+import time
+
+from PySide6.QtCore import QStringListModel, Signal, QObject, QTimer
+
+logger = logging.getLogger("table_manager")
+maintenance_logger = logging.getLogger("maintenance")
 
 
 class TableManager(QObject):
     tablesChanged = Signal(list)
+    snapshotVerified = Signal(object)
 
     def __init__(self, db, parent=None):
         super().__init__(parent)
         self.db = db
         self.model = QStringListModel(parent=self)
         self._tables = []
+        self._row_counts = {}
+        self.snapshotVerified.connect(self._on_snapshot_verified)
+        try:
+            self.db.load_schema_snapshot()
+        except Exception:
+            logger.exception("load_schema_snapshot failed")
         self.refresh()
+        self.verify_snapshot_async()
 
     def refresh(self):
         try:
@@ -17,11 +32,118 @@ class TableManager(QObject):
         except Exception:
             tables = []
         self._tables = tables
+        try:
+            self._row_counts = self.db.table_row_counts(tables)
+        except Exception:
+            logger.exception("table_row_counts failed")
+            self._row_counts = {}
         self.model.setStringList(tables)
         self.tablesChanged.emit(tables)
 
     def tables(self):
         return list(self._tables)
 
+    def row_count(self, table: str):
+        return self._row_counts.get(table)
+
+    def label(self, table: str) -> str:
+        n = self._row_counts.get(table)
+        if n is None:
+            return table
+        return f"{table}  (~{n:,})".replace(',', ' ')
+
+    def verify_snapshot_async(self):
+        def run():
+            try:
+                snapshot = self.db.verify_schema_snapshot()
+            except Exception:
+                logger.exception("verify_schema_snapshot failed")
+                return
+            self.snapshotVerified.emit(snapshot)
+
+        threading.Thread(target=run, name="schema-snapshot", daemon=True).start()
+
+    def _on_snapshot_verified(self, snapshot):
+        if snapshot is not None:
+            self.db.apply_schema_snapshot(snapshot)
+            self.refresh()
+
     def handle_external_change(self, new_name: str = None):
-        self.refresh()
\ No newline at end of file
+        self.refresh()
+        self.verify_snapshot_async()
+
+
+class MaintenanceScheduler(QObject):
+    jobFinished = Signal(str, object)
+    jobFailed = Signal(str, str)
+
+    def __init__(self, db, parent=None, tick_ms=30_000):
+        super().__init__(parent)
+        self.db = db
+        self._jobs = {}
+        self.timer = QTimer(self)
+        self.timer.setInterval(tick_ms)
+        self.timer.timeout.connect(self._tick)
+        self.jobFinished.connect(self._on_job_finished)
+        self.jobFailed.connect(self._on_job_failed)
+
+    def schedule(self, key: str, interval_sec: float, fn, run_now: bool = False):
+        self._jobs[key] = {
+            'interval': float(interval_sec),
+            'fn': fn,
+            'last': None if run_now else time.monotonic(),
+            'running': False,
+        }
+
+    def unschedule(self, key: str):
+        self._jobs.pop(key, None)
+
+    def jobs(self):
+        return {k: {'interval': j['interval'], 'last': j['last'], 'running': j['running']}
+                for k, j in self._jobs.items()}
+
+    def start(self):
+        self.timer.start()
+        self._tick()
+
+    def stop(self):
+        self.timer.stop()
+
+    def run_now(self, key: str):
+        job = self._jobs.get(key)
+        if job is not None and not job['running']:
+            self._run(key, job)
+
+    def _tick(self):
+        now = time.monotonic()
+        for key, job in list(self._jobs.items()):
+            if not job['running'] and (job['last'] is None or now - job['last'] >= job['interval']):
+                self._run(key, job)
+
+    def _run(self, key, job):
+        job['running'] = True
+        job['last'] = time.monotonic()
+        fn = job['fn']
+
+        def run():
+            try:
+                result = fn()
+            except Exception as e:
+                maintenance_logger.exception("job %s failed", key)
+                self.jobFailed.emit(key, str(e))
+                return
+            self.jobFinished.emit(key, result)
+
+        threading.Thread(target=run, name=f"maintenance-{key}", daemon=True).start()
+
+    def _on_job_finished(self, key: str, result):
+        job = self._jobs.get(key)
+        if job is not None:
+            job['running'] = False
+        maintenance_logger.info("%s: %s", key, result)
+
+    def _on_job_failed(self, key: str, error: str):
+        job = self._jobs.get(key)
+        if job is not None:
+            job['running'] = False
+        maintenance_logger.warning("%s: %s", key, error)
@@ -1,21 +1,36 @@
 import re
+from datetime import datetime
 from typing import Dict, List, Tuple
 
-from PySide6.QtGui import QStandardItemModel, QStandardItem
+from PySide6.QtGui import QStandardItemModel, QStandardItem, QTextCharFormat, QTextCursor, QColor
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QGroupBox, QDialog, QComboBox, QLineEdit,
     QFormLayout, QLabel, QListWidget, QTextEdit,
-    QScrollArea, QCheckBox, QFrame, QMessageBox, QSpinBox, QTableView, QListWidgetItem, QAbstractItemView
+    QScrollArea, QCheckBox, QFrame, QMessageBox, QSpinBox, QTableView, QListWidgetItem, QAbstractItemView,
+    QInputDialog, QTableWidget, QTableWidgetItem, QDoubleSpinBox
 )
-from PySide6.QtCore import Qt, Signal
+from PySide6.QtCore import Qt, Signal, QTimer
 import sys
+import threading
 
 from sqlalchemy import text
 
+from config import settings
+from query_history import ORDERINGS, SOURCES, history_for, remember_tables
+
+from query_model import (
+    Aliased, CoalesceRule, Column, Cte, Fragment, Func, GroupBy, Join, Param, Query, Raw, SAMPLE_METHODS, Sample,
+    Value, column_ref, compile_query, fragment, literal, order_item, query_params, quote_ident, render_with
+)
+
 AGG_FUNCS = ['COUNT', 'SUM', 'AVG', 'MIN', 'MAX']
 TEXT_OPS = ['LIKE', '~', '~*', '!~', '!~*', 'SIMILAR TO', 'NOT SIMILAR TO']
 
+def _parts(value):
+    return value if isinstance(value, tuple) else (value,)
+
+
 class WindowDialog(QDialog):
     def __init__(self, columns, parent=None, title='Добавить оконную функцию'):
         super().__init__(parent)
@@ -194,27 +209,32 @@ class WindowDialog(QDialog):
         column_expr = ""
         if func not in ('RANK', 'ROW_NUMBER', 'DENSE_RANK') and self.col_cb.currentText():
             column_expr = self.quot(self.col_cb.currentText())
-        offset_expr = ""
-        default_expr = ""
+        offset_expr = None
+        default_expr = None
         if func in ['LAG', 'LEAD']:
             offset_value = self.offset_spin.value()
-            if offset_value != 1:
-                offset_expr = f", {offset_value}"
             default_text = self.default_le.text().strip()
+            if offset_value != 1 or default_text:
+                offset_expr = Value(offset_value)
             if default_text:
-                if default_text.replace('.', '').isdigit():
-                    default_expr = f", {default_text}"
+                if re.fullmatch(r'\d+', default_text):
+                    default_expr = Value(int(default_text))
+                elif re.fullmatch(r'\d*\.\d+|\d+\.\d*', default_text):
+                    default_expr = Value(float(default_text))
                 else:
-                    default_escaped = default_text.replace("'", "''")
-                    default_expr = f", '{default_escaped}'"
+                    default_expr = Value(default_text)
         args_parts = []
         if column_expr:
             args_parts.append(column_expr)
         if offset_expr:
-            args_parts.append(offset_expr.lstrip(", "))
+            args_parts.append(offset_expr)
         if default_expr:
-            args_parts.append(default_expr.lstrip(", "))
-        func_args = ", ".join(args_parts) if args_parts else ""
+            args_parts.append(default_expr)
+        func_args = []
+        for i, arg in enumerate(args_parts):
+            if i:
+                func_args.append(", ")
+            func_args.append(arg)
         partition_expr = ""
         selected = [it.text() for it in self.partition_list.selectedItems()]
         if selected:
@@ -242,24 +262,25 @@ class WindowDialog(QDialog):
                 if val == 'CURRENT ROW':
                     return 'CURRENT ROW'
                 if val == 'PRECEDING':
-                    return f"{spin} PRECEDING"
+                    return (Value(spin), " PRECEDING")
                 if val == 'FOLLOWING':
-                    return f"{spin} FOLLOWING"
+                    return (Value(spin), " FOLLOWING")
                 return val
 
-            sspin = str(self.frame_start_spin.value())
-            espin = str(self.frame_end_spin.value())
-            stext = part_text(start, sspin)
-            etext = part_text(end, espin)
-            frame_expr = f"{frame_type} BETWEEN {stext} AND {etext}"
+            stext = part_text(start, self.frame_start_spin.value())
+            etext = part_text(end, self.frame_end_spin.value())
+            frame_expr = (f"{frame_type} BETWEEN ",) + _parts(stext) + (" AND ",) + _parts(etext)
         over_parts = []
         if partition_expr:
-            over_parts.append(partition_expr)
+            over_parts.append((partition_expr,))
         if order_expr:
-            over_parts.append(order_expr)
+            over_parts.append((order_expr,))
         if frame_expr:
             over_parts.append(frame_expr)
-        over_clause = "OVER(" + " ".join(over_parts) + ")" if over_parts else "OVER()"
+        over_clause = ("OVER(",)
+        for i, part in enumerate(over_parts):
+            over_clause += ((" ",) if i else ()) + part
+        over_clause += (")",)
         alias_expr = ""
         if alias_text:
             if alias_text.isidentifier():
@@ -267,11 +288,7 @@ class WindowDialog(QDialog):
             else:
                 alias_escaped = alias_text.replace('"', '""')
                 alias_expr = f' AS "{alias_escaped}"'
-        if func_args:
-            final_expr = f"{func}({func_args}) {over_clause}{alias_expr}"
-        else:
-            final_expr = f"{func}() {over_clause}{alias_expr}"
-        return final_expr
+        return fragment(f"{func}(", *func_args, ") ", *over_clause, alias_expr)
 
 class ConditionDialog(QDialog):
     def __init__(self, columns, parent=None, title='Добавить условие'):
@@ -295,19 +312,19 @@ class ConditionDialog(QDialog):
         layout.addRow(add_btn)
 
     def get_condition(self):
-        val = self.val_le.text().replace("'", "''")
         col = self.col_cb.currentText() if self.col_cb.currentIndex() >= 0 else ''
         op = self.op_cb.currentText() if self.op_cb.currentIndex() >= 0 else '='
         if col == '':
             return "1=1"
-        return f"{col} {op} '{val}'"
+        return fragment(f"{col} {op} ", Value(self.val_le.text()))
 
 
 class JoinDialog(QDialog):
-    def __init__(self, schema, parent=None):
+    def __init__(self, schema, parent=None, planner=None):
         super().__init__(parent)
         self.setWindowTitle("Добавить соединение")
         self.schema = schema or {}
+        self.planner = planner
         self.setup_ui()
 
     def setup_ui(self):
@@ -341,6 +358,11 @@ class JoinDialog(QDialog):
             self.left_field_cb.addItems(self.schema.get(lt, []))
         if rt and rt in self.schema:
             self.right_field_cb.addItems(self.schema.get(rt, []))
+        if self.planner is not None and lt and rt:
+            edge = self.planner.direct_edge(lt, rt)
+            if edge:
+                self.left_field_cb.setCurrentText(edge[0])
+                self.right_field_cb.setCurrentText(edge[1])
 
     def get_join(self):
         left = self.left_table_cb.currentText()
@@ -371,7 +393,7 @@ class SubqueryDialog(QDialog):
         layout = QVBoxLayout(self)
         self.sql_widget = SQLStubWindow(db=self.db, parent=self)
         for btn in self.sql_widget.findChildren(QPushButton):
-            if btn.text() == 'Применить':
+            if btn.text() in ('Применить', 'Сохр. запрос', 'Запросы', 'История'):
                 btn.hide()
         layout.addWidget(self.sql_widget)
         btn_row = QHBoxLayout()
@@ -385,10 +407,10 @@ class SubqueryDialog(QDialog):
 
     def on_add(self):
         try:
-            self.sql_widget.update_sql_preview()
-        except Exception:
-            pass
-        self.result_sql = self.sql_widget.sql_preview.toPlainText().strip()
+            self.result_sql = self.sql_widget.build_sql().strip()
+        except Exception as e:
+            QMessageBox.warning(self, 'Ошибка', f'Не удалось построить подзапрос:\n{e}')
+            return
         if not self.result_sql:
             QMessageBox.warning(self, 'Пустой SQL', 'Нельзя добавить пустой подзапрос.')
             return
@@ -581,7 +603,9 @@ class CaseBuilderDialog(QDialog):
 
 
 class SQLStubWindow(QWidget):
-    apply_sql = Signal(str)
+    apply_sql = Signal(str, dict)
+    history_rerun = Signal(str, dict, str)
+    validationFinished = Signal(int, object)
 
     def __init__(self, db=None, parent=None):
         super().__init__(parent)
@@ -603,6 +627,18 @@ class SQLStubWindow(QWidget):
         self.group_mode = None
         self.grouping_sets = []
         self.table_widgets = {}
+        self._rendered_sql = None
+        self._join_planner = None
+        self._validation_gen = 0
+        self._validation_running = False
+        self._validation_pending = None
+        self._validation_inflight = None
+        self._validation_result = None
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(settings.PREVIEW_DEBOUNCE_MS)
+        self._preview_timer.timeout.connect(self._render_preview)
+        self.validationFinished.connect(self._on_validation_finished)
         self._load_schema_from_db()
         self.setup_ui()
         self.update_sql_preview()
@@ -615,6 +651,12 @@ class SQLStubWindow(QWidget):
             tables = self.db.list_tables() or []
         except Exception:
             tables = []
+        missing = [t for t in tables if t not in self.db.metadata.tables]
+        if missing:
+            try:
+                self.db.reflect_tables(missing)
+            except Exception:
+                pass
         schema = {}
         for t in tables:
             try:
@@ -707,7 +749,10 @@ class SQLStubWindow(QWidget):
         add_join_btn.clicked.connect(self.open_add_join_dialog)
         clear_join_btn = QPushButton('Очистить')
         clear_join_btn.clicked.connect(self.clear_join)
+        auto_join_btn = QPushButton('Авто')
+        auto_join_btn.clicked.connect(self.auto_join)
         jbtn_row.addWidget(add_join_btn)
+        jbtn_row.addWidget(auto_join_btn)
         jbtn_row.addWidget(clear_join_btn)
         jbtn_row.addStretch()
         jlayout.addLayout(jbtn_row)
@@ -746,7 +791,10 @@ class SQLStubWindow(QWidget):
         gbtn_row.addWidget(add_group_btn)
         gbtn_row.addWidget(add_agg_btn)
         gbtn_row.addWidget(clear_group_btn)
+        incr_btn = QPushButton('инкр.')
+        incr_btn.clicked.connect(self.create_incremental_summary)
         gbtn_row.addWidget(group_opts_btn)
+        gbtn_row.addWidget(incr_btn)
         gbtn_row.addStretch()
         glayout.addLayout(gbtn_row)
         group_group.setLayout(glayout)
@@ -809,10 +857,44 @@ class SQLStubWindow(QWidget):
         self.sql_preview = QTextEdit()
         self.sql_preview.setReadOnly(True)
         pl.addWidget(self.sql_preview)
+        self.validation_label = QLabel('')
+        self.validation_label.setWordWrap(True)
+        pl.addWidget(self.validation_label)
+        sample_row = QHBoxLayout()
+        self.sample_cb = QCheckBox('Выборка (TABLESAMPLE)')
+        self.sample_method = QComboBox()
+        self.sample_method.addItems(SAMPLE_METHODS)
+        self.sample_percent = QDoubleSpinBox()
+        self.sample_percent.setRange(0.01, 100.0)
+        self.sample_percent.setDecimals(2)
+        self.sample_percent.setSuffix(' %')
+        self.sample_percent.setValue(settings.SAMPLE_DEFAULT_PERCENT)
+        self.sample_seed = QSpinBox()
+        self.sample_seed.setRange(0, 2147483647)
+        self.sample_seed.setPrefix('seed ')
+        self.sample_cb.toggled.connect(self.update_sql_preview)
+        self.sample_method.currentIndexChanged.connect(self.update_sql_preview)
+        self.sample_percent.valueChanged.connect(self.update_sql_preview)
+        self.sample_seed.valueChanged.connect(self.update_sql_preview)
+        sample_row.addWidget(self.sample_cb)
+        sample_row.addWidget(self.sample_method)
+        sample_row.addWidget(self.sample_percent)
+        sample_row.addWidget(self.sample_seed)
+        sample_row.addStretch()
+        pl.addLayout(sample_row)
         btns = QHBoxLayout()
         apply_btn = QPushButton('Применить')
         apply_btn.clicked.connect(self.on_apply_clicked)
+        save_query_btn = QPushButton('Сохр. запрос')
+        save_query_btn.clicked.connect(self.on_save_query_clicked)
+        saved_queries_btn = QPushButton('Запросы')
+        saved_queries_btn.clicked.connect(self.open_saved_queries)
         btns.addWidget(apply_btn)
+        btns.addWidget(save_query_btn)
+        btns.addWidget(saved_queries_btn)
+        history_btn = QPushButton('История')
+        history_btn.clicked.connect(self.open_history)
+        btns.addWidget(history_btn)
         btns.addStretch()
         pl.addLayout(btns)
         preview_group.setLayout(pl)
@@ -925,7 +1007,7 @@ class SQLStubWindow(QWidget):
             if expr:
 
                 self.window_functions.append(expr)
-                self.window_list.addItem(expr)
+                self.window_list.addItem(str(expr))
                 self.update_sql_preview()
 
 
@@ -954,23 +1036,12 @@ class SQLStubWindow(QWidget):
     def _infer_cte_columns(self, cte_sql, cte_name):
 
         if self.db is not None:
+            previous = tuple(
+                Cte(c['name'], c.get('sql') or '') for c in self.ctes if c.get('name') != cte_name
+            )
+            q = render_with(previous + (Cte(cte_name, cte_sql),)) + f"\nSELECT * FROM {quote_ident(cte_name)}"
             try:
-                q = f"WITH {cte_name} AS (\n{cte_sql}\n)\nSELECT * FROM {cte_name} LIMIT 0"
-                try:
-                    exec_res = None
-                    if hasattr(self.db, 'execute'):
-                        exec_res = self.db.execute(q)
-                        desc = getattr(exec_res, 'description', None)
-                        if desc:
-                            return [d[0] for d in desc]
-                    if hasattr(self.db, 'cursor'):
-                        cur = self.db.cursor()
-                        cur.execute(q)
-                        desc = getattr(cur, 'description', None)
-                        if desc:
-                            return [d[0] for d in desc]
-                except Exception:
-                    pass
+                return [name for name, _ in self.db.describe(q)]
             except Exception:
                 pass
 
@@ -1060,7 +1131,7 @@ class SQLStubWindow(QWidget):
             self.update_sql_preview()
 
     def open_add_join_dialog(self):
-        dlg = JoinDialog(self.schema, self)
+        dlg = JoinDialog(self.schema, self, planner=self._get_join_planner())
         if dlg.exec():
             j = dlg.get_join()
             if j['left'] and j['right'] and j['lf'] and j['rf']:
@@ -1071,6 +1142,89 @@ class SQLStubWindow(QWidget):
             else:
                 QMessageBox.warning(self, 'Соединение не добавлено', 'Выберите таблицы и поля для соединения.')
 
+    def _get_join_planner(self):
+        if self._join_planner is None and self.db is not None:
+            cte_names = {c.get('name') for c in self.ctes}
+            try:
+                from join_planner import JoinPlanner
+                self._join_planner = JoinPlanner(self.db, [t for t in self.schema if t not in cte_names])
+            except Exception:
+                return None
+        return self._join_planner
+
+    def _query_tables(self):
+        tables = [t for t, _ in self.selected_columns]
+        for _, col, _ in self.aggregates:
+            if col != '*' and '.' in col:
+                tables.append(col.split('.', 1)[0])
+        tables.extend(g.split('.', 1)[0] for g in self.group_by if '.' in g)
+        return [t for t in dict.fromkeys(tables) if t in self.schema]
+
+    def _add_planned_joins(self, joins):
+        for j in joins:
+            self.joins.append(j)
+            self.join_list.addItem(j['desc'])
+        self.update_sql_preview()
+
+    def auto_join(self):
+        planner = self._get_join_planner()
+        tables = self._query_tables()
+        if planner is None or (len(tables) < 2 and not self.joins):
+            QMessageBox.information(self, 'Соединения', 'Выберите столбцы хотя бы из двух таблиц.')
+            return
+        added, unreachable = planner.plan(tables, self.joins)
+        if added:
+            self._add_planned_joins(added)
+        msg = '\n'.join(j['desc'] for j in added) if added else 'Новых соединений не требуется.'
+        if unreachable:
+            msg += '\n\nНет пути по внешним ключам до: ' + ', '.join(unreachable)
+        QMessageBox.information(self, 'Соединения', msg)
+
+    def _check_cross_join(self):
+        tables = self._query_tables()
+        if len(tables) < 2:
+            return True
+        planner = self._get_join_planner()
+        if planner is None:
+            return True
+        added, unreachable = planner.plan(tables, self.joins)
+        if not added and not unreachable:
+            return True
+        if added:
+            desc = '\n'.join(j['desc'] for j in added)
+            loose = [t for t in tables if t in {j['right'] for j in added}]
+            ans = QMessageBox.question(
+                self, 'Таблицы не соединены',
+                f"Таблицы {', '.join(loose)} не соединены с остальными и будут перемножены (CROSS JOIN).\n"
+                f"Добавить соединения по внешним ключам?\n\n{desc}",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel,
+            )
+            if ans == QMessageBox.Cancel:
+                return False
+            if ans == QMessageBox.Yes:
+                self._add_planned_joins(added)
+                if not unreachable:
+                    return True
+        try:
+            total, _ = planner.cross_join_estimate(tables, self.joins)
+        except Exception:
+            total = None
+        if total is not None and total >= settings.CROSS_JOIN_BLOCK_ROWS:
+            QMessageBox.critical(
+                self, 'Декартово произведение',
+                f"Несоединённые таблицы дадут около {f'{total:,}'.replace(',', ' ')} строк. Добавьте JOIN.",
+            )
+            return False
+        if total is None or total >= settings.CROSS_JOIN_WARN_ROWS:
+            size = 'неизвестное число' if total is None else f"около {total:,}".replace(',', ' ')
+            ans = QMessageBox.question(
+                self, 'Декартово произведение',
+                f"Несоединённые таблицы дадут {size} строк. Продолжить?",
+                QMessageBox.Yes | QMessageBox.No,
+            )
+            return ans == QMessageBox.Yes
+        return True
+
     def remove_selected_join(self):
         row = self.join_list.currentRow()
         if row >= 0:
@@ -1088,7 +1242,7 @@ class SQLStubWindow(QWidget):
             cond = dlg.get_condition()
             if cond:
                 self.where_conditions.append(cond)
-                self.where_list.addItem(cond)
+                self.where_list.addItem(str(cond))
                 self.update_sql_preview()
 
     def remove_selected_where(self):
@@ -1141,6 +1295,29 @@ class SQLStubWindow(QWidget):
         self.grouping_sets = []
         self.update_sql_preview()
 
+    def create_incremental_summary(self):
+        from incremental_agg import IncrementalSummary, list_incremental_summaries
+        name, ok = QInputDialog.getText(self, 'Инкрементальная сводка', 'Имя сводки:')
+        if not ok or not name.strip():
+            return
+        try:
+            summary = IncrementalSummary.from_builder(name.strip(), self)
+            replace = summary.name in list_incremental_summaries(self.db)
+            if replace and QMessageBox.question(
+                    self, 'Сводка существует', f'Сводка {summary.name} уже есть. Пересоздать её?',
+                    QMessageBox.Yes | QMessageBox.No) != QMessageBox.Yes:
+                return
+            summary.create(self.db, replace=replace)
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка', f'Не удалось создать сводку:\n{e}')
+            return
+        QMessageBox.information(
+            self, 'Готово',
+            f'Сводка {summary.name} создана и обновляется триггерами на {summary.base_table}'
+            + (f'; изменения в {", ".join(summary.dimension_tables)} помечают её устаревшей '
+               f'до планового пересчёта' if summary.dimension_tables else '')
+        )
+
     def add_aggregate(self):
         dlg = QDialog(self)
         dlg.setWindowTitle('Добавить агрегат')
@@ -1176,7 +1353,7 @@ class SQLStubWindow(QWidget):
             cond = dlg.get_condition()
             if cond:
                 self.having_conditions.append(cond)
-                self.having_list.addItem(cond)
+                self.having_list.addItem(str(cond))
                 self.update_sql_preview()
 
     def remove_selected_having(self):
@@ -1274,6 +1451,7 @@ class SQLStubWindow(QWidget):
             rule = {'op': op, 'col': col, 'arg': formatted_arg, 'expr': expr}
             self.coalesce_rules.append(rule)
             self.coalesce_list.addItem(f"{op} | {col} | {formatted_arg}")
+            self.update_sql_preview()
             dlg.accept()
 
         add_btn.clicked.connect(do_add)
@@ -1315,40 +1493,10 @@ class SQLStubWindow(QWidget):
                 del self.coalesce_rules[r]
             except Exception:
                 pass
-
+        self.update_sql_preview()
 
     def apply_coalesce(self):
-
-        sql = self.sql_preview.toPlainText()
-        if not sql:
-            QMessageBox.warning(self, "Пустой SQL", "Нет SQL для применения замен.")
-            return
-        new_sql = sql
-        for rule in self.coalesce_rules:
-            col = rule['col']
-            expr = rule['expr']
-            pat = r'(?<![\w])' + re.escape(col) + r'(?![\w])'
-            new_sql = re.sub(pat, expr, new_sql)
-        self.sql_preview.setPlainText(new_sql)
-
-    def apply_coalesce_to_sql(self, sql: str) -> str:
-        if not self.coalesce_rules:
-            return sql
-        new_sql = sql
-        for rule in self.coalesce_rules:
-            col = rule.get('col')
-            expr = rule.get('expr')
-            if not col or not expr:
-                continue
-            pat = r'(?<![\w])' + re.escape(col) + r'(?![\w])'
-            try:
-                new_sql = re.sub(pat, expr, new_sql)
-            except re.error:
-                new_sql = new_sql.replace(col, expr)
-        return new_sql
-
-
-
+        self.update_sql_preview()
 
     def wrap_with_clear(self, widget):
         w = QWidget()
@@ -1370,129 +1518,279 @@ class SQLStubWindow(QWidget):
         l.addWidget(clr)
         return w
 
-    def build_sql(self) -> str:
-        parts = []
-        if self.selected_columns:
-            parts.extend([f"{t}.{c}" for t, c in self.selected_columns])
-        if self.aggregates:
-            for fn, col, alias in self.aggregates:
-                parts.append(f"{fn}({col}) AS {alias}")
-        if self.custom_expressions:
-            parts.extend(self.custom_expressions)
-        if self.window_functions:
-            parts.extend(self.window_functions)
-        select_clause = ', '.join(parts) if parts else '*'
-
-        with_clause = ""
-        try:
-            ctes = getattr(self, 'ctes', None) or []
-            if ctes:
-                cte_parts = []
-                for c in ctes:
-                    name = (c.get('name') if isinstance(c, dict) else None) or str(c)
-                    sql = (c.get('sql') if isinstance(c, dict) else '') or ''
-                    sql = sql.strip()
-                    if sql.endswith(';'):
-                        sql = sql[:-1].rstrip()
-                    if not sql:
-                        sql = "/* empty cte */"
-                    cte_parts.append(f"{name} AS (\n{sql}\n)")
-                if cte_parts:
-                    with_clause = "WITH " + ",\n".join(cte_parts)
-        except Exception:
-            with_clause = ""
+    def build_query(self) -> Query:
+        select = [Column(t, c) for t, c in self.selected_columns]
+        for fn, col, alias in self.aggregates:
+            select.append(Aliased(Func(fn, (column_ref(col),)), alias))
+        select.extend(Raw(e) for e in self.custom_expressions)
+        select.extend(self._bound(e, f"wf{i}") for i, e in enumerate(self.window_functions, 1))
 
-        sql_lines = []
-        if with_clause:
-            sql_lines.append(with_clause)
-        sql_lines.append(f"SELECT {select_clause}")
+        ctes = []
+        for c in getattr(self, 'ctes', None) or []:
+            name = (c.get('name') if isinstance(c, dict) else None) or str(c)
+            ctes.append(Cte(name, (c.get('sql') if isinstance(c, dict) else '') or ''))
 
-        from_clause = ""
-        join_clauses = []
+        joins = []
         if self.joins:
-            used_tables = set()
             base_table = self.joins[0].get('left') or ''
-            if base_table:
-                used_tables.add(base_table)
-                from_clause = base_table
+            from_tables = (base_table,) if base_table else ()
             for j in self.joins:
-                left = j.get('left', '')
-                right = j.get('right', '')
-                lf = j.get('lf', '')
-                rf = j.get('rf', '')
-                jtype = j.get('type', 'INNER')
-                if right:
-                    join_clauses.append(f"{jtype} JOIN {right} ON {left}.{lf} = {right}.{rf}")
-                    used_tables.add(right)
-                    used_tables.add(left)
+                if j.get('right'):
+                    joins.append(Join(
+                        j.get('type', 'INNER'),
+                        Column(j.get('left', ''), j.get('lf', '')),
+                        Column(j['right'], j.get('rf', '')),
+                    ))
+            joined = {base_table} | {j.get('right') for j in self.joins}
+            for t in self._query_tables():
+                if t not in joined:
+                    joins.append(Join('CROSS', Column('', ''), Column(t, '')))
         else:
             tables = set(t for t, _ in self.selected_columns)
-            if len(tables) == 1:
-                from_clause = next(iter(tables))
-            elif len(tables) > 1:
-                from_clause = ', '.join(sorted(tables))
+            if tables:
+                from_tables = tuple(sorted(tables))
             else:
                 all_tables = sorted(self.schema.keys())
-                from_clause = all_tables[0] if all_tables else ''
-
-        if from_clause:
-            sql_lines.append(f"FROM {from_clause}")
-        else:
-            sql_lines.append("FROM /* no table selected */")
-
-        sql_lines.extend(join_clauses)
-
-        if self.where_conditions:
-            sql_lines.append("WHERE " + " AND ".join(self.where_conditions))
+                from_tables = (all_tables[0],) if all_tables else ()
 
+        group_by = None
         if self.group_by:
-            if not self.group_mode:
-                sql_lines.append("GROUP BY " + ", ".join(self.group_by))
-            else:
-                gm = self.group_mode
-                if gm == 'ROLLUP':
-                    sql_lines.append("GROUP BY ROLLUP(" + ", ".join(self.group_by) + ")")
-                elif gm == 'CUBE':
-                    sql_lines.append("GROUP BY CUBE(" + ", ".join(self.group_by) + ")")
-                elif gm == 'GROUPING SETS':
-                    if self.grouping_sets:
-                        sets_parts = []
-                        for s in self.grouping_sets:
-                            if not s:
-                                sets_parts.append("()")
-                            else:
-                                sets_parts.append("(" + ", ".join(s) + ")")
-                        sql_lines.append("GROUP BY GROUPING SETS (" + ", ".join(sets_parts) + ")")
-                    else:
-                        sql_lines.append("GROUP BY " + ", ".join(self.group_by))
-                else:
-                    sql_lines.append("GROUP BY " + ", ".join(self.group_by))
+            group_by = GroupBy(
+                tuple(column_ref(g) for g in self.group_by),
+                self.group_mode if self.group_mode in ('ROLLUP', 'CUBE', 'GROUPING SETS') else None,
+                tuple(tuple(column_ref(g) for g in gs) for gs in self.grouping_sets or ()),
+            )
+
+        coalesce = []
+        for i, rule in enumerate(self.coalesce_rules, 1):
+            col = column_ref(rule.get('col') or '')
+            if isinstance(col, Column) and rule.get('op'):
+                coalesce.append(CoalesceRule(rule['op'], col, self._coalesce_arg(rule.get('arg'), f"c{i}")))
+
+        return Query(
+            select=tuple(select),
+            from_=from_tables,
+            joins=tuple(joins),
+            where=tuple(self._bound(w, f"w{i}") for i, w in enumerate(self.where_conditions, 1)),
+            group_by=group_by,
+            having=tuple(self._bound(h, f"h{i}") for i, h in enumerate(self.having_conditions, 1)),
+            order_by=tuple(order_item(o) for o in self.order_by),
+            ctes=tuple(ctes),
+            coalesce=tuple(coalesce),
+            sample=self.current_sample(),
+        )
+
+    def current_sample(self):
+        if not getattr(self, 'sample_cb', None) or not self.sample_cb.isChecked():
+            return None
+        return Sample(self.sample_method.currentText(), round(self.sample_percent.value(), 2), self.sample_seed.value())
+
+    @staticmethod
+    def _bound(item, prefix):
+        if isinstance(item, Fragment):
+            return item.bind(prefix)
+        return Raw(str(item))
+
+    @staticmethod
+    def _coalesce_arg(arg, name):
+        s = (arg or 'NULL').strip()
+        if s.upper() == 'NULL' or s.startswith('"'):
+            return Raw(s)
+        if s in ('TRUE', 'FALSE'):
+            return Param(name, s == 'TRUE')
+        if s.startswith("'") and s.endswith("'") and len(s) >= 2:
+            return Param(name, s[1:-1].replace("''", "'"))
+        if re.fullmatch(r'[+-]?\d+', s):
+            return Param(name, int(s))
+        if re.fullmatch(r'[+-]?\d+\.\d+', s):
+            return Param(name, float(s))
+        return Raw(s)
 
-        if self.having_conditions:
-            sql_lines.append("HAVING " + " AND ".join(self.having_conditions))
-        if self.order_by:
-            sql_lines.append("ORDER BY " + ", ".join(self.order_by))
+    def build_sql(self) -> str:
+        return compile_query(self.build_query(), inline=True)
 
-        return "\n".join(sql_lines)
+    def build_statement(self):
+        query = self.build_query()
+        return compile_query(query), query_params(query)
 
     def on_apply_clicked(self):
+        if not self._check_cross_join():
+            return
         try:
-            self.update_sql_preview()
-        except Exception:
-            pass
-        sql = self.sql_preview.toPlainText().strip()
-        if not sql:
+            self._render_preview()
+            sql, params = self.build_statement()
+        except Exception as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось построить запрос:\n{e}")
+            return
+        if not sql.strip():
             QMessageBox.warning(self, "Пустой SQL", " нечего применять.")
             return
-        self.apply_sql.emit(sql)
+        self._run_statement(sql, params)
+
+    def _run_statement(self, sql, params):
+        if self._preflight(sql, params):
+            self.apply_sql.emit(sql, params)
+
+    def _preflight(self, sql, params):
+        if self.db is None or not hasattr(self.db, 'validate_query'):
+            return True
+        last = self._validation_result
+        if last is not None and last[0] == self._validation_gen and last[1] == sql and last[2] == params:
+            report = last[3]
+        else:
+            try:
+                report = self.db.validate_query(sql, params)
+            except Exception as e:
+                report = {'ok': False, 'error': str(e)}
+        if report.get('ok'):
+            remember_tables(sql, params, report.get('tables'))
+        if not report.get('ok'):
+            ans = QMessageBox.question(
+                self, 'Проверка запроса',
+                f"Не удалось оценить запрос:\n{report.get('error')}\n\nВсё равно выполнить?",
+                QMessageBox.Yes | QMessageBox.No,
+            )
+            return ans == QMessageBox.Yes
+        cost = report.get('cost') or 0
+        rows = report.get('rows') or 0
+        if cost < settings.PREFLIGHT_CONFIRM_COST and rows < settings.PREFLIGHT_CONFIRM_ROWS:
+            return True
+        cost_text = f"{cost:,.0f}".replace(',', ' ')
+        rows_text = f"{int(rows):,}".replace(',', ' ')
+        ans = QMessageBox.question(
+            self, 'Тяжёлый запрос',
+            f"Оценка планировщика: стоимость {cost_text}, строк ~{rows_text}.\n"
+            f"Результат будет загружаться страницами, но сам запрос может выполняться долго.\n"
+            f"Выполнить?",
+            QMessageBox.Yes | QMessageBox.No,
+        )
+        return ans == QMessageBox.Yes
+
+    def on_save_query_clicked(self):
+        if self.db is None:
+            return
+        name, ok = QInputDialog.getText(self, 'Сохранить запрос', 'Имя запроса:')
+        if not ok or not name.strip():
+            return
+        try:
+            sql, params = self.build_statement()
+            self.db.save_query(name.strip(), sql, params)
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка', f'Не удалось сохранить запрос:\n{e}')
+
+    def open_saved_queries(self):
+        if self.db is None:
+            return
+        dlg = SavedQueriesDialog(self.db, parent=self)
+        dlg.runRequested.connect(self._run_statement)
+        dlg.exec()
+
+    def open_history(self):
+        if self.db is None:
+            return
+        try:
+            dlg = QueryHistoryDialog(self.db, parent=self)
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка', f'Не удалось открыть историю запросов:\n{e}')
+            return
+        dlg.rerunRequested.connect(self.history_rerun)
+        dlg.exec()
 
     def update_sql_preview(self):
+        self._preview_timer.start()
+
+    def _render_preview(self):
+        self._preview_timer.stop()
+        sql, params = None, {}
         try:
-            s = self.build_sql()
+            sql, params = self.build_statement()
+            s = sql
+            if params:
+                s += "\n" + "\n".join(f"-- :{k} = {literal(v)}" for k, v in params.items())
         except Exception as e:
             s = f"Error: {e}"
-        s = self.apply_coalesce_to_sql(s)
+        if s == self._rendered_sql:
+            return
+        self._rendered_sql = s
         self.sql_preview.setPlainText(s)
+        self.sql_preview.setExtraSelections([])
+        if sql is not None:
+            self._request_validation(sql, params)
+        else:
+            self.validation_label.setText('')
+
+    def _request_validation(self, sql, params):
+        if self.db is None or not hasattr(self.db, 'validate_query'):
+            return
+        self._validation_gen += 1
+        self._validation_pending = (self._validation_gen, sql, params)
+        self.validation_label.setStyleSheet('color: gray')
+        self.validation_label.setText('проверка...')
+        if not self._validation_running:
+            self._start_validation()
+
+    def _start_validation(self):
+        gen, sql, params = self._validation_pending
+        self._validation_pending = None
+        self._validation_inflight = (gen, sql, params)
+        self._validation_running = True
+
+        def run():
+            try:
+                report = self.db.validate_query(sql, params)
+            except Exception as e:
+                report = {'ok': False, 'error': str(e), 'position': None}
+            try:
+                self.validationFinished.emit(gen, report)
+            except RuntimeError:
+                pass
+
+        threading.Thread(target=run, name="sql-validate", daemon=True).start()
+
+    def _on_validation_finished(self, gen, report):
+        self._validation_running = False
+        if self._validation_pending is not None:
+            self._start_validation()
+            return
+        if gen != self._validation_gen:
+            return
+        self._validation_result = self._validation_inflight + (report,)
+        if not report.get('ok'):
+            self.validation_label.setStyleSheet('color: red')
+            pos = report.get('position')
+            where = f" (позиция {pos})" if pos else ''
+            self.validation_label.setText(f"Ошибка{where}: {report.get('error')}")
+            if pos:
+                self._mark_error(pos)
+            return
+        cost = report.get('cost') or 0
+        rows = report.get('rows') or 0
+        cost_text = f"{cost:,.0f}".replace(',', ' ')
+        rows_text = f"{int(rows):,}".replace(',', ' ')
+        text_ = f"OK: стоимость {cost_text}, строк ~{rows_text}"
+        if cost >= settings.PREVIEW_COST_WARNING:
+            self.validation_label.setStyleSheet('color: darkorange')
+            self.validation_label.setText(text_ + " — дорогой запрос")
+        else:
+            self.validation_label.setStyleSheet('color: green')
+            self.validation_label.setText(text_)
+
+    def _mark_error(self, position):
+        doc_len = len(self.sql_preview.toPlainText())
+        start = max(0, min(position - 1, doc_len - 1))
+        cursor = QTextCursor(self.sql_preview.document())
+        cursor.setPosition(start)
+        cursor.movePosition(QTextCursor.EndOfWord, QTextCursor.KeepAnchor)
+        if not cursor.hasSelection():
+            cursor.movePosition(QTextCursor.NextCharacter, QTextCursor.KeepAnchor)
+        fmt = QTextCharFormat()
+        fmt.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+        fmt.setUnderlineColor(QColor('red'))
+        fmt.setBackground(QColor(255, 220, 220))
+        selection = QTextEdit.ExtraSelection()
+        selection.cursor = cursor
+        selection.format = fmt
+        self.sql_preview.setExtraSelections([selection])
 
     def clear_join(self):
         self.join_list.clear()
@@ -1619,6 +1917,238 @@ class SQLStubWindow(QWidget):
         cancel_btn.clicked.connect(dlg.reject)
         dlg.exec()
 
+class SavedQueriesDialog(QDialog):
+    runRequested = Signal(str, dict)
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Сохранённые запросы')
+        self.db = db
+        self.queries = {}
+        self.setup_ui()
+        self._load()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        self.query_list = QListWidget()
+        self.query_list.currentTextChanged.connect(self._on_query_selected)
+        layout.addWidget(self.query_list)
+        self.sql_view = QTextEdit()
+        self.sql_view.setReadOnly(True)
+        layout.addWidget(self.sql_view)
+        self.params_table = QTableWidget(0, 2)
+        self.params_table.setHorizontalHeaderLabels(['Параметр', 'Значение'])
+        self.params_table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.params_table)
+        btn_row = QHBoxLayout()
+        run_btn = QPushButton('Выполнить')
+        run_btn.clicked.connect(self._on_run)
+        save_btn = QPushButton('Сохранить значения')
+        save_btn.clicked.connect(self._on_save_values)
+        delete_btn = QPushButton('Удалить')
+        delete_btn.clicked.connect(self._on_delete)
+        close_btn = QPushButton('Закрыть')
+        close_btn.clicked.connect(self.reject)
+        btn_row.addWidget(run_btn)
+        btn_row.addWidget(save_btn)
+        btn_row.addWidget(delete_btn)
+        btn_row.addStretch()
+        btn_row.addWidget(close_btn)
+        layout.addLayout(btn_row)
+
+    def _load(self):
+        self.queries = self.db.saved_queries()
+        self.query_list.clear()
+        self.query_list.addItems(sorted(self.queries))
+        if self.query_list.count():
+            self.query_list.setCurrentRow(0)
+        else:
+            self._on_query_selected('')
+
+    def _on_query_selected(self, name):
+        entry = self.queries.get(name) or {}
+        self.sql_view.setPlainText(entry.get('sql', ''))
+        params = entry.get('params') or {}
+        self.params_table.setRowCount(len(params))
+        for row, (key, value) in enumerate(params.items()):
+            key_item = QTableWidgetItem(key)
+            key_item.setFlags(key_item.flags() & ~Qt.ItemIsEditable)
+            key_item.setData(Qt.UserRole, value)
+            self.params_table.setItem(row, 0, key_item)
+            self.params_table.setItem(row, 1, QTableWidgetItem('' if value is None else str(value)))
+
+    def _current_params(self):
+        params = {}
+        for row in range(self.params_table.rowCount()):
+            key_item = self.params_table.item(row, 0)
+            text_value = self.params_table.item(row, 1).text()
+            original = key_item.data(Qt.UserRole)
+            if isinstance(original, bool):
+                value = text_value.strip().lower() in ('true', 't', '1', 'yes', 'да')
+            elif isinstance(original, int):
+                value = int(text_value)
+            elif isinstance(original, float):
+                value = float(text_value)
+            else:
+                value = text_value
+            params[key_item.text()] = value
+        return params
+
+    def _on_run(self):
+        name = self.query_list.currentItem().text() if self.query_list.currentItem() else ''
+        if not name:
+            return
+        try:
+            params = self._current_params()
+        except ValueError as e:
+            QMessageBox.warning(self, 'Ошибка', f'Некорректное значение параметра:\n{e}')
+            return
+        self.runRequested.emit(self.queries[name]['sql'], params)
+        self.accept()
+
+    def _on_save_values(self):
+        name = self.query_list.currentItem().text() if self.query_list.currentItem() else ''
+        if not name:
+            return
+        try:
+            self.db.save_query(name, self.queries[name]['sql'], self._current_params())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Ошибка', str(e))
+            return
+        self._load()
+
+    def _on_delete(self):
+        name = self.query_list.currentItem().text() if self.query_list.currentItem() else ''
+        if not name:
+            return
+        self.db.delete_saved_query(name)
+        self._load()
+
+
+class QueryHistoryDialog(QDialog):
+    rerunRequested = Signal(str, dict, str)
+
+    SOURCE_LABELS = {'builder': 'конструктор', 'view': 'представление', 'edit': 'изменение'}
+    ORDER_LABELS = {'frequency': 'по частоте', 'total': 'по суммарному времени',
+                    'avg': 'по среднему времени', 'recent': 'последние'}
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('История запросов')
+        self.setMinimumSize(900, 500)
+        self.db = db
+        self.history = history_for(db)
+        self.entries = []
+        self.setup_ui()
+        self._load()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        filter_row = QHBoxLayout()
+        self.search_le = QLineEdit()
+        self.search_le.setPlaceholderText('поиск по тексту запроса')
+        self.search_le.textChanged.connect(self._load)
+        self.source_combo = QComboBox()
+        self.source_combo.addItem('все источники', None)
+        for source in SOURCES:
+            self.source_combo.addItem(self.SOURCE_LABELS[source], source)
+        self.source_combo.currentIndexChanged.connect(self._load)
+        self.order_combo = QComboBox()
+        for order in ORDERINGS:
+            self.order_combo.addItem(self.ORDER_LABELS[order], order)
+        self.order_combo.currentIndexChanged.connect(self._load)
+        filter_row.addWidget(self.search_le)
+        filter_row.addWidget(self.source_combo)
+        filter_row.addWidget(self.order_combo)
+        layout.addLayout(filter_row)
+        self.table = QTableWidget(0, 7)
+        self.table.setHorizontalHeaderLabels(
+            ['Запуски', 'Всего, мс', 'Среднее, мс', 'Строк', 'Последний', 'Источник', 'Запрос'])
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.currentCellChanged.connect(self._on_entry_selected)
+        self.table.cellDoubleClicked.connect(lambda *_: self._on_rerun())
+        layout.addWidget(self.table)
+        self.sql_view = QTextEdit()
+        self.sql_view.setReadOnly(True)
+        layout.addWidget(self.sql_view)
+        btn_row = QHBoxLayout()
+        self.rerun_btn = QPushButton('Повторить')
+        self.rerun_btn.clicked.connect(self._on_rerun)
+        clear_btn = QPushButton('Очистить историю')
+        clear_btn.clicked.connect(self._on_clear)
+        close_btn = QPushButton('Закрыть')
+        close_btn.clicked.connect(self.reject)
+        btn_row.addWidget(self.rerun_btn)
+        btn_row.addWidget(clear_btn)
+        btn_row.addStretch()
+        btn_row.addWidget(close_btn)
+        layout.addLayout(btn_row)
+
+    def _load(self, *_):
+        try:
+            self.entries = self.history.search(self.search_le.text(), self.source_combo.currentData(),
+                                               self.order_combo.currentData())
+        except Exception as e:
+            QMessageBox.warning(self, 'Ошибка', f'Не удалось прочитать историю:\n{e}')
+            self.entries = []
+        self.table.setRowCount(len(self.entries))
+        for row, entry in enumerate(self.entries):
+            runs = f"{entry['runs']}"
+            if entry['cache_hits']:
+                runs += f" ({entry['cache_hits']} из кэша)"
+            if entry['errors']:
+                runs += f", ошибок {entry['errors']}"
+            cells = [
+                runs,
+                f"{entry['total_ms']:.0f}",
+                '' if entry['avg_ms'] is None else f"{entry['avg_ms']:.1f}",
+                '' if entry['avg_rows'] is None else f"{entry['avg_rows']:.0f}",
+                datetime.fromtimestamp(entry['last_at']).strftime('%Y-%m-%d %H:%M:%S'),
+                self.SOURCE_LABELS.get(entry['source'], entry['source']),
+                ' '.join(entry['sql'].split()),
+            ]
+            for col, value in enumerate(cells):
+                self.table.setItem(row, col, QTableWidgetItem(value))
+        if self.entries:
+            self.table.setCurrentCell(0, 0)
+        else:
+            self._on_entry_selected(-1)
+
+    def _current_entry(self):
+        row = self.table.currentRow()
+        return self.entries[row] if 0 <= row < len(self.entries) else None
+
+    def _on_entry_selected(self, row, *_):
+        entry = self._current_entry()
+        if entry is None:
+            self.sql_view.clear()
+            self.rerun_btn.setEnabled(False)
+            return
+        shown = entry['sql']
+        if entry['params']:
+            shown += '\n' + '\n'.join(f"-- :{k} = {literal(v)}" for k, v in entry['params'].items())
+        self.sql_view.setPlainText(shown)
+        self.rerun_btn.setEnabled(entry['source'] != 'edit')
+
+    def _on_rerun(self):
+        entry = self._current_entry()
+        if entry is None or entry['source'] == 'edit':
+            return
+        self.rerunRequested.emit(entry['sql'], entry['params'], entry['source'])
+        self.accept()
+
+    def _on_clear(self):
+        ans = QMessageBox.question(self, 'История запросов', 'Удалить всю историю и кэш результатов?',
+                                   QMessageBox.Yes | QMessageBox.No)
+        if ans != QMessageBox.Yes:
+            return
+        self.history.clear()
+        self._load()
+
+
 class CTEDialog(QDialog):
 
     def __init__(self, db=None, parent=None):
@@ -1,14 +1,17 @@
 from typing import Dict, Any, Optional, List
+import logging
 import re
+import threading
+import time
 from datetime import date, datetime
 
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableView, QMessageBox,
     QDialog, QTextEdit, QLineEdit, QComboBox, QCheckBox, QDateEdit, QDateTimeEdit, QTextEdit,
-    QFormLayout, QDialogButtonBox, QSpinBox, QSizePolicy, QFrame, QSplitter
+    QFormLayout, QDialogButtonBox, QSpinBox, QDoubleSpinBox, QSizePolicy, QFrame, QSplitter, QListWidget, QListWidgetItem, QMenu
 )
-from PySide6.QtGui import QStandardItemModel, QStandardItem, QIntValidator, QDoubleValidator
-from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QStandardItemModel, QStandardItem, QIntValidator, QDoubleValidator, QBrush, QColor
+from PySide6.QtCore import Qt, Signal, QTimer
 
 from sqlalchemy import text, select, update, and_
 from sqlalchemy import Table as SATable
@@ -16,6 +19,18 @@ from sqlalchemy.types import Enum as SAEnum, Boolean, Integer, Float, Date, Date
 
 from edit_form import EditDialog
 from validators import validate_table_data
+from config import settings
+from query_model import SAMPLE_METHODS, Sample, inline_params, quote_ident, render_tablesample, sample_first_relation
+from query_history import history_for, log_execution
+from incremental_agg import (
+    drop_incremental_summary, incremental_summary_status, list_incremental_summaries, refresh_incremental_summary
+)
+
+logger = logging.getLogger("query_history")
+
+_filter_op_re = re.compile(r'^\s*(<=|>=|<>|!=|=|<|>)\s*(.*)$', re.S)
+_keyset_blockers_re = re.compile(
+    r'\b(join|group\s+by|distinct|union|intersect|except)\b|\bfrom\s+[^\s,()]+(\s+\w+)?\s*,', re.IGNORECASE)
 
 class OperationDialog(QDialog):
     def __init__(self, parent=None):
@@ -116,8 +131,62 @@ class ViewsDialog(QDialog):
         control_row.addWidget(QLabel("Выбрать:"))
         control_row.addWidget(self.views_combo)
         control_row.addWidget(self.show_btn)
+        self.sample_cb = QCheckBox("Выборка")
+        self.sample_method = QComboBox()
+        self.sample_method.addItems(SAMPLE_METHODS)
+        self.sample_percent = QDoubleSpinBox()
+        self.sample_percent.setRange(0.01, 100.0)
+        self.sample_percent.setDecimals(2)
+        self.sample_percent.setSuffix(" %")
+        self.sample_percent.setValue(settings.SAMPLE_DEFAULT_PERCENT)
+        self.sample_seed = QSpinBox()
+        self.sample_seed.setRange(0, 2147483647)
+        self.sample_seed.setPrefix("seed ")
+        control_row.addWidget(self.sample_cb)
+        control_row.addWidget(self.sample_method)
+        control_row.addWidget(self.sample_percent)
+        control_row.addWidget(self.sample_seed)
         layout.addLayout(control_row)
 
+        self.matview_row = QWidget()
+        mv_l = QHBoxLayout(self.matview_row)
+        mv_l.setContentsMargins(0, 0, 0, 0)
+        self.stale_label = QLabel()
+        self.refresh_mv_btn = QPushButton("Обновить")
+        self.refresh_mv_btn.clicked.connect(self._on_refresh_matview)
+        self.uidx_btn = QPushButton("Уник. индекс...")
+        self.uidx_btn.clicked.connect(self._on_create_unique_index)
+        self.interval_spin = QSpinBox()
+        self.interval_spin.setRange(0, 7 * 24 * 60)
+        self.interval_spin.setSuffix(" мин")
+        self.interval_spin.setSpecialValueText("вручную")
+        self.save_sched_btn = QPushButton("Сохранить расписание")
+        self.save_sched_btn.clicked.connect(self._on_save_schedule)
+        mv_l.addWidget(self.stale_label, 1)
+        mv_l.addWidget(self.refresh_mv_btn)
+        mv_l.addWidget(self.uidx_btn)
+        mv_l.addWidget(QLabel("Автообновление:"))
+        mv_l.addWidget(self.interval_spin)
+        mv_l.addWidget(self.save_sched_btn)
+        self.matview_row.setVisible(False)
+        layout.addWidget(self.matview_row)
+        self.views_combo.currentTextChanged.connect(self._update_matview_status)
+
+        self.summary_row = QWidget()
+        sm_l = QHBoxLayout(self.summary_row)
+        sm_l.setContentsMargins(0, 0, 0, 0)
+        self.summary_label = QLabel()
+        self.refresh_summary_btn = QPushButton("Пересчитать сводку")
+        self.refresh_summary_btn.clicked.connect(self._on_refresh_summary)
+        self.drop_summary_btn = QPushButton("Удалить сводку")
+        self.drop_summary_btn.clicked.connect(self._on_drop_summary)
+        sm_l.addWidget(self.summary_label, 1)
+        sm_l.addWidget(self.refresh_summary_btn)
+        sm_l.addWidget(self.drop_summary_btn)
+        self.summary_row.setVisible(False)
+        layout.addWidget(self.summary_row)
+        self.views_combo.currentTextChanged.connect(self._update_summary_status)
+
         self.viewer_frame = QFrame()
         self.viewer_layout = QVBoxLayout(self.viewer_frame)
         self.viewer_layout.setContentsMargins(0, 0, 0, 0)
@@ -159,6 +228,138 @@ class ViewsDialog(QDialog):
             items = []
         self.views_combo.clear()
         self.views_combo.addItems(items)
+        self.matview_row.setVisible(self.mat_btn.isChecked())
+        self._update_matview_status()
+        self._update_summary_status()
+
+    def _update_matview_status(self, *_):
+        if not self.mat_btn.isChecked():
+            return
+        sel = self.views_combo.currentText().strip()
+        has_sel = bool(sel)
+        for w in (self.refresh_mv_btn, self.uidx_btn, self.interval_spin, self.save_sched_btn):
+            w.setEnabled(has_sel)
+        if not has_sel:
+            self.stale_label.setText("")
+            return
+        try:
+            st = self.db.matview_staleness(sel)
+            info = next((m for m in self.db.list_matviews() if f"{m['schema']}.{m['name']}" == sel), None)
+        except Exception as e:
+            self.stale_label.setText(f"Состояние неизвестно: {e}")
+            return
+        if st['refreshed_at'] is None:
+            status = "не обновлялось из приложения"
+        elif st['changes'] is None:
+            status = f"обновлено {st['refreshed_at']}, изменения базовых таблиц неизвестны"
+        elif st['changes']:
+            status = f"обновлено {st['refreshed_at']}, устарело: {st['changes']} изменений"
+        else:
+            status = f"обновлено {st['refreshed_at']}, актуально"
+        if info is not None and not info['has_unique_index']:
+            status += "; нет уникального индекса для CONCURRENTLY"
+        self.stale_label.setText(status)
+        self.interval_spin.setValue((st['interval_sec'] or 0) // 60)
+
+    def _selected_summary(self):
+        sel = self.views_combo.currentText().strip()
+        if not self.normal_btn.isChecked() or not sel.startswith('public.'):
+            return None
+        name = sel.split('.', 1)[1]
+        try:
+            return name if name in list_incremental_summaries(self.db) else None
+        except Exception:
+            return None
+
+    def _update_summary_status(self, *_):
+        name = self._selected_summary()
+        self.summary_row.setVisible(name is not None)
+        if name is None:
+            return
+        try:
+            status = incremental_summary_status(self.db, name)
+        except Exception as e:
+            self.summary_label.setText(f"Состояние сводки неизвестно: {e}")
+            return
+        if status is None:
+            self.summary_label.setText("Инкрементальная сводка")
+        elif status['stale_since'] is not None:
+            self.summary_label.setText(f"Сводка устарела с {status['stale_since'].astimezone():%Y-%m-%d %H:%M:%S}: "
+                                       f"изменились таблицы измерений, ждёт планового пересчёта")
+        elif status['refreshed_at'] is not None:
+            self.summary_label.setText(f"Сводка актуальна, пересчитана {status['refreshed_at'].astimezone():%Y-%m-%d %H:%M:%S}")
+        else:
+            self.summary_label.setText("Сводка актуальна")
+
+    def _on_refresh_summary(self):
+        name = self._selected_summary()
+        if name is None:
+            return
+        try:
+            ms = refresh_incremental_summary(self.db, name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось пересчитать сводку:\n{e}")
+            return
+        QMessageBox.information(self, "Готово", f"Сводка пересчитана за {ms:.0f} мс")
+        self._update_summary_status()
+
+    def _on_drop_summary(self):
+        name = self._selected_summary()
+        if name is None:
+            return
+        if QMessageBox.question(self, "Удаление", f"Удалить сводку {name} вместе с её триггерами?",
+                                QMessageBox.Yes | QMessageBox.No) != QMessageBox.Yes:
+            return
+        try:
+            drop_incremental_summary(self.db, name)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось удалить сводку:\n{e}")
+            return
+        self._load_views()
+
+    def _on_refresh_matview(self):
+        sel = self.views_combo.currentText().strip()
+        if not sel:
+            return
+        try:
+            res = self.db.refresh_matview(sel)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось обновить представление:\n{e}")
+            return
+        mode = "CONCURRENTLY" if res['concurrently'] else "с блокировкой чтения"
+        QMessageBox.information(self, "Готово", f"Обновлено {mode} за {res['ms']:.0f} мс")
+        self._update_matview_status()
+
+    def _on_create_unique_index(self):
+        sel = self.views_combo.currentText().strip()
+        if not sel:
+            return
+        try:
+            columns = self.db.matview_columns(sel)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        dlg = MatviewIndexDialog(columns, parent=self)
+        if dlg.exec() != QDialog.Accepted:
+            return
+        try:
+            index_name = self.db.create_matview_unique_index(sel, dlg.selected_columns())
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось создать индекс:\n{e}")
+            return
+        QMessageBox.information(self, "Готово", f"Создан индекс {index_name}")
+        self._update_matview_status()
+
+    def _on_save_schedule(self):
+        sel = self.views_combo.currentText().strip()
+        if not sel:
+            return
+        try:
+            self.db.set_matview_schedule(sel, self.interval_spin.value() * 60 or None)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", str(e))
+            return
+        QMessageBox.information(self, "Готово", "Расписание сохранено")
 
     def _on_show_view(self):
         sel = self.views_combo.currentText().strip()
@@ -173,18 +374,56 @@ class ViewsDialog(QDialog):
             sql = f'SELECT * FROM "{schema}"."{name}"'
         else:
             sql = f'SELECT * FROM "{name}"'
+        if self.sample_cb.isChecked():
+            sample = Sample(self.sample_method.currentText(), round(self.sample_percent.value(), 2),
+                            self.sample_seed.value())
+            try:
+                if self.mat_btn.isChecked():
+                    sql += " " + render_tablesample(sample)
+                else:
+                    sql = sample_first_relation(self.db.view_definition(sel), sample)
+            except Exception as e:
+                QMessageBox.critical(self, "Ошибка", f"Не удалось построить выборку:\n{e}")
+                return
         for i in reversed(range(self.viewer_layout.count())):
             w = self.viewer_layout.itemAt(i).widget()
             if w:
                 w.setParent(None)
         try:
-            viewer = TableResultWidget(self.db, sql, parent=self)
+            viewer = TableResultWidget(self.db, sql, parent=self, source='view')
             self.viewer_layout.addWidget(viewer)
             self._viewer = viewer
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось показать представление:\n{e}")
 
 
+class MatviewIndexDialog(QDialog):
+    def __init__(self, columns, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Уникальный индекс")
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Колонки, однозначно определяющие строку:"))
+        self.list = QListWidget()
+        for c in columns:
+            item = QListWidgetItem(c)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            self.list.addItem(item)
+        layout.addWidget(self.list)
+        btns = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        btns.accepted.connect(self.accept)
+        btns.rejected.connect(self.reject)
+        layout.addWidget(btns)
+
+    def selected_columns(self):
+        out = []
+        for i in range(self.list.count()):
+            item = self.list.item(i)
+            if item.checkState() == Qt.Checked:
+                out.append(item.text())
+        return out
+
+
 class SaveViewDialog(QDialog):
     def __init__(self, db, sql_to_save: str, materialized: bool = False, parent=None):
         super().__init__(parent)
@@ -237,6 +476,11 @@ class SaveViewDialog(QDialog):
         try:
             with self.db.engine.begin() as conn:
                 conn.execute(text(stmt))
+            if self.materialized:
+                try:
+                    self.db.mark_matview_refreshed(name)
+                except Exception:
+                    pass
             QMessageBox.information(self, "Успех", "Представление создано успешно")
             self.accept()
         except Exception as e:
@@ -245,12 +489,18 @@ class SaveViewDialog(QDialog):
 
 class TableResultWidget(QWidget):
     editRequested = Signal(object, dict)
+    countFinished = Signal(int, object)
 
-    def __init__(self, db, sql: str, parent=None, max_rows=1000):
+    def __init__(self, db, sql: str, parent=None, max_rows=1000, params=None, source='builder', use_cache=False):
         super().__init__(parent)
         self.db = db
         self.sql = sql
+        self.params = dict(params or {})
         self.max_rows = max_rows
+        self.source = source
+        self._use_cache = use_cache
+        self._offset = 0
+        self._has_more = False
         self._columns: List[str] = []
         self._rows = []
         self._model: Optional[QStandardItemModel] = None
@@ -258,6 +508,19 @@ class TableResultWidget(QWidget):
         self._primary_table_pk_cols: List[str] = []
         self._current_index = None
         self._sel_connected = False
+        self._sort = None
+        self._filters: Dict[int, str] = {}
+        self._filter_edits: List[QLineEdit] = []
+        self._keyset_stack = []
+        self._keyset_cols: Optional[List[str]] = None
+        self._index_columns = None
+        self._count_key = None
+        self._count_gen = 0
+        self._edits: Dict[int, Dict[str, str]] = {}
+        self._deleted_rows = set()
+        self._row_errors: Dict[int, Dict[str, str]] = {}
+        self._marking = False
+        self.countFinished.connect(self._on_count_finished)
         self.setup_ui()
         self.load_and_build()
 
@@ -290,31 +553,621 @@ class TableResultWidget(QWidget):
         self.save_matview_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         self.save_matview_btn.clicked.connect(self._on_save_matview_clicked)
 
+        self.edit_mode_btn = QPushButton("Правка в таблице")
+        self.edit_mode_btn.setCheckable(True)
+        self.edit_mode_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.edit_mode_btn.toggled.connect(self._on_edit_mode_toggled)
+        self.delete_rows_btn = QPushButton("Удалить строки")
+        self.delete_rows_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.delete_rows_btn.clicked.connect(self._on_delete_rows_clicked)
+        self.save_changes_btn = QPushButton("Сохранить")
+        self.save_changes_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.save_changes_btn.clicked.connect(self._on_save_changes_clicked)
+        self.discard_changes_btn = QPushButton("Отменить")
+        self.discard_changes_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.discard_changes_btn.clicked.connect(self._on_discard_changes_clicked)
+        for w in (self.delete_rows_btn, self.save_changes_btn, self.discard_changes_btn):
+            w.setVisible(False)
+        self.bulk_delete_btn = QPushButton("Удалить выбранные")
+        self.bulk_delete_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.bulk_delete_btn.setVisible(False)
+        self.bulk_delete_btn.clicked.connect(self._on_bulk_delete_clicked)
+
+        self.prev_page_btn = QPushButton("<")
+        self.prev_page_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.prev_page_btn.clicked.connect(self._on_prev_page)
+        self.next_page_btn = QPushButton(">")
+        self.next_page_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.next_page_btn.clicked.connect(self._on_next_page)
+        self.page_label = QLabel("")
+        self.count_label = QLabel("")
+        self.count_btn = QPushButton("точно")
+        self.count_btn.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
+        self.count_btn.setToolTip("Посчитать строки результата через COUNT(*) в фоне")
+        self.count_btn.clicked.connect(self._on_count_clicked)
+
+        info_l.addWidget(self.prev_page_btn)
+        info_l.addWidget(self.page_label)
+        info_l.addWidget(self.next_page_btn)
+        info_l.addWidget(self.count_label)
+        info_l.addWidget(self.count_btn)
         info_l.addStretch()
         info_l.addWidget(self.edit_small_btn)
+        info_l.addWidget(self.bulk_delete_btn)
         info_l.addWidget(self.reset_test_data_btn)
         info_l.addWidget(self.refresh_btn)
 
         info_l.addWidget(self.view_views_btn)
         info_l.addWidget(self.save_view_btn)
         info_l.addWidget(self.save_matview_btn)
+        info_l.addWidget(self.edit_mode_btn)
+        info_l.addWidget(self.delete_rows_btn)
+        info_l.addWidget(self.save_changes_btn)
+        info_l.addWidget(self.discard_changes_btn)
 
         self.layout.addWidget(self.info_row)
+        self.filter_bar = QWidget()
+        self.filter_bar.setFixedHeight(30)
+        self.layout.addWidget(self.filter_bar)
         self.table_view = QTableView()
         self.table_view.clicked.connect(self._on_table_clicked)
+        header = self.table_view.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.sectionClicked.connect(self._on_header_clicked)
+        header.sectionResized.connect(self._layout_filter_edits)
+        header.setContextMenuPolicy(Qt.CustomContextMenu)
+        header.customContextMenuRequested.connect(self._on_header_menu)
+        self.table_view.horizontalScrollBar().valueChanged.connect(self._layout_filter_edits)
         self.layout.addWidget(self.table_view)
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(settings.GRID_FILTER_DEBOUNCE_MS)
+        self._filter_timer.timeout.connect(self._apply_filters)
 
-    def load_and_build(self):
+    def _column_ref(self, index):
+        name = self._columns[index]
+        if self._columns.count(name) != 1:
+            return None
+        return f"_page.{quote_ident(str(name))}"
+
+    def _filter_condition(self, ref, value, name):
+        value = value.strip()
+        lowered = value.lower()
+        if lowered in ('null', 'is null'):
+            return f"{ref} IS NULL", {}
+        if lowered in ('!null', 'not null', 'is not null'):
+            return f"{ref} IS NOT NULL", {}
+        m = _filter_op_re.match(value)
+        if m:
+            op = '<>' if m.group(1) == '!=' else m.group(1)
+            return f"{ref} {op} :{name}", {name: m.group(2).strip()}
+        pattern = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"CAST({ref} AS text) ILIKE :{name}", {name: f"%{pattern}%"}
+
+    def _keyset_columns(self):
+        if self._sort is None or not self._primary_table or not self._primary_table_pk_cols:
+            return None
+        if _keyset_blockers_re.search(self.sql or ''):
+            return None
+        name = self._columns[self._sort[0]]
+        if self._column_ref(self._sort[0]) is None:
+            return None
+        if any(self._columns.count(pk) != 1 for pk in self._primary_table_pk_cols):
+            return None
+        if self._index_columns is None:
+            try:
+                self._index_columns = self.db.index_leading_columns(self._primary_table)
+            except Exception:
+                self._index_columns = {}
+        if not self._index_columns.get(name):
+            return None
+        return [name] + [pk for pk in self._primary_table_pk_cols if pk != name]
+
+    def _body(self):
+        body = (self.sql or '').strip().rstrip(';').rstrip()
+        if not re.match(r'^(select|with|values|table)\b', body, re.IGNORECASE):
+            return None
+        return body
+
+    def _filter_conditions(self, params):
+        conditions = []
+        for index, value in sorted(self._filters.items()):
+            ref = self._column_ref(index) if index < len(self._columns) else None
+            if ref is None or not value.strip():
+                continue
+            cond, extra = self._filter_condition(ref, value, f"_filter_{index}")
+            conditions.append(cond)
+            params.update(extra)
+        return conditions
+
+    def _count_statement(self):
+        body = self._body()
+        if body is None:
+            return None
+        params = dict(self.params)
+        conditions = self._filter_conditions(params)
+        sql = f"SELECT * FROM (\n{body}\n) AS _page"
+        if conditions:
+            sql += "\nWHERE " + " AND ".join(conditions)
+        return sql, params
+
+    def _page_statement(self):
+        body = self._body()
+        if body is None:
+            return self.sql, dict(self.params), False
+        params = dict(self.params, _page_limit=self.max_rows + 1)
+        conditions = self._filter_conditions(params)
+        order = ''
+        self._keyset_cols = self._keyset_columns()
+        if self._keyset_cols:
+            direction = self._sort[1]
+            refs = [f"_page.{quote_ident(c)}" for c in self._keyset_cols]
+            if self._keyset_stack:
+                op = '>' if direction == 'ASC' else '<'
+                keys = [f":_key_{i}" for i in range(len(refs))]
+                if len(refs) == 1:
+                    conditions.append(f"{refs[0]} {op} {keys[0]}")
+                else:
+                    conditions.append(f"{refs[0]} {op}= {keys[0]}")
+                    conditions.append(f"({', '.join(refs)}) {op} ({', '.join(keys)})")
+                params.update({f"_key_{i}": v for i, v in enumerate(self._keyset_stack[-1])})
+            order = ', '.join(f"{r} {direction}" for r in refs)
+        elif self._sort is not None:
+            index, direction = self._sort
+            order = f"{self._column_ref(index) or index + 1} {direction}"
+            if self._primary_table_pk_cols and all(self._columns.count(pk) == 1 for pk in self._primary_table_pk_cols):
+                order += ''.join(f", _page.{quote_ident(pk)}" for pk in self._primary_table_pk_cols)
+        sql = f"SELECT * FROM (\n{body}\n) AS _page"
+        if conditions:
+            sql += "\nWHERE " + " AND ".join(conditions)
+        if order:
+            sql += f"\nORDER BY {order}"
+        if self._keyset_cols:
+            sql += "\nLIMIT :_page_limit"
+        else:
+            sql += "\nLIMIT :_page_limit OFFSET :_page_offset"
+            params['_page_offset'] = self._offset
+        return sql, params, True
+
+    def _reset_paging(self):
+        self._offset = 0
+        self._keyset_stack = []
+
+    def _on_header_clicked(self, index):
+        if index >= len(self._columns):
+            return
+        if self._sort is None or self._sort[0] != index:
+            self._sort = (index, 'ASC')
+        elif self._sort[1] == 'ASC':
+            self._sort = (index, 'DESC')
+        else:
+            self._sort = None
+        self._reset_paging()
+        self.load_and_build()
+
+    def _on_header_menu(self, pos):
+        header = self.table_view.horizontalHeader()
+        index = header.logicalIndexAt(pos)
+        if index < 0 or index >= len(self._columns):
+            return
+        menu = QMenu(self)
+        asc = menu.addAction("Сортировать по возрастанию")
+        desc = menu.addAction("Сортировать по убыванию")
+        profile = menu.addAction("Профиль колонки")
+        name = str(self._columns[index])
+        table_columns = []
+        if self._primary_table:
+            try:
+                table_columns = [c.name for c in self.db.get_table(self._primary_table).columns]
+            except Exception:
+                table_columns = []
+        profile.setEnabled(name in table_columns)
+        chosen = menu.exec(header.mapToGlobal(pos))
+        if chosen is profile:
+            from profile_form import ColumnProfileDialog
+            ColumnProfileDialog(self.db, self._primary_table, name, parent=self).exec()
+        elif chosen in (asc, desc):
+            self._sort = (index, 'ASC' if chosen is asc else 'DESC')
+            self._reset_paging()
+            self.load_and_build()
+
+    def _update_sort_indicator(self):
+        header = self.table_view.horizontalHeader()
+        if self._sort is None:
+            header.setSortIndicatorShown(False)
+            return
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(self._sort[0], Qt.AscendingOrder if self._sort[1] == 'ASC' else Qt.DescendingOrder)
+
+    def _build_filter_edits(self):
+        names = [str(c) for c in self._columns]
+        if [e.property('column') for e in self._filter_edits] == names:
+            return
+        for edit in self._filter_edits:
+            edit.setParent(None)
+            edit.deleteLater()
+        self._filter_edits = []
+        for index, name in enumerate(names):
+            edit = QLineEdit(self.filter_bar)
+            edit.setProperty('column', name)
+            edit.setPlaceholderText("фильтр")
+            edit.setToolTip("текст — поиск по подстроке; =, <>, <, <=, >, >= — сравнение; null / !null")
+            edit.setText(self._filters.get(index, ''))
+            if self._column_ref(index) is None:
+                edit.setEnabled(False)
+                edit.setToolTip("колонка с повторяющимся именем не фильтруется")
+            edit.textChanged.connect(self._filter_timer.start)
+            edit.returnPressed.connect(self._apply_filters)
+            edit.show()
+            self._filter_edits.append(edit)
+        self._layout_filter_edits()
+
+    def _layout_filter_edits(self, *_):
+        header = self.table_view.horizontalHeader()
+        offset = self.table_view.frameWidth() + self.table_view.verticalHeader().width()
+        for index, edit in enumerate(self._filter_edits):
+            edit.setGeometry(offset + header.sectionViewportPosition(index), 0,
+                             header.sectionSize(index), self.filter_bar.height())
+
+    def _apply_filters(self):
+        self._filter_timer.stop()
+        filters = {i: e.text() for i, e in enumerate(self._filter_edits) if e.text().strip()}
+        if filters == self._filters:
+            return
+        self._filters = filters
+        self._reset_paging()
+        self.load_and_build()
+
+    def _on_prev_page(self):
+        self._offset = max(0, self._offset - self.max_rows)
+        if self._keyset_stack:
+            self._keyset_stack.pop()
+        self.load_and_build()
+
+    def _on_next_page(self):
+        if self._has_more:
+            self._offset += self.max_rows
+            if self._keyset_cols and self._rows:
+                last = self._rows[-1]
+                self._keyset_stack.append(tuple(last[self._columns.index(c)] for c in self._keyset_cols))
+            self.load_and_build()
+
+    def _update_page_controls(self, shown, paged):
+        self.prev_page_btn.setEnabled(paged and self._offset > 0)
+        self.next_page_btn.setEnabled(paged and self._has_more)
+        if shown:
+            more = "+" if self._has_more else ""
+            self.page_label.setText(f"строки {self._offset + 1}–{self._offset + shown}{more}")
+        else:
+            self.page_label.setText("нет строк")
+
+    def _update_count(self, shown):
+        stmt = self._count_statement()
+        self.count_label.setVisible(stmt is not None)
+        self.count_btn.setVisible(stmt is not None)
+        if stmt is None:
+            return
+        key = (stmt[0], repr(sorted(stmt[1].items())))
+        if self._offset == 0 and not self._has_more:
+            self._count_key = key
+            self._count_gen += 1
+            self.count_label.setText(f"всего {shown:,}".replace(',', ' '))
+            self.count_btn.setEnabled(False)
+            return
+        if key == self._count_key:
+            return
+        self._count_key = key
+        self._count_gen += 1
         try:
-            with self.db.engine.connect() as conn:
-                result = conn.execute(text(self.sql))
+            estimate = self.db.estimate_rows(*stmt)
+        except Exception:
+            estimate = None
+        if estimate is None:
+            self.count_label.setText("всего: ?")
+        else:
+            self.count_label.setText(f"всего ~{estimate:,} (оценка)".replace(',', ' '))
+        self.count_btn.setEnabled(True)
+
+    def _on_count_clicked(self):
+        stmt = self._count_statement()
+        if stmt is None:
+            return
+        self._count_gen += 1
+        gen = self._count_gen
+        self.count_btn.setEnabled(False)
+        self.count_label.setText("считается…")
+
+        def run():
+            try:
+                result = self.db.exact_row_count(*stmt)
+            except Exception as e:
+                result = e
+            try:
+                self.countFinished.emit(gen, result)
+            except RuntimeError:
+                pass
+
+        threading.Thread(target=run, name="exact-count", daemon=True).start()
+
+    def _on_count_finished(self, gen, result):
+        if gen != self._count_gen:
+            return
+        self.count_btn.setEnabled(True)
+        if isinstance(result, Exception):
+            err = self.db.timeout_error(result, 'export')
+            self.count_label.setText("всего: ошибка подсчёта")
+            self.count_label.setToolTip(str(err if err is not None else result))
+            return
+        self.count_label.setText(f"всего {result:,}".replace(',', ' '))
+        self.count_label.setToolTip("")
+
+    def _cached_page(self, sql, params):
+        try:
+            return history_for(self.db).cached_result(self.db, sql, params)
+        except Exception as e:
+            logger.warning("Не удалось прочитать кэш результатов: %s", e)
+            return None
+
+    def _snapshot_page(self):
+        try:
+            return history_for(self.db).snapshot(self.db, self.sql, self.params)
+        except Exception as e:
+            logger.warning("Не удалось снять счётчики для кэша: %s", e)
+            return [], {}
+
+    def _store_page(self, sql, params, columns, rows, snapshot):
+        try:
+            history_for(self.db).store_result(sql, params, columns, rows, *snapshot)
+        except Exception as e:
+            logger.warning("Не удалось сохранить результат в кэш: %s", e)
+
+    def _pending_changes(self):
+        return len(set(self._edits) | self._deleted_rows)
+
+    def _rows_addressable(self):
+        if not self._primary_table or not self._primary_table_pk_cols:
+            return False
+        if _keyset_blockers_re.search(self.sql or ''):
+            return False
+        return all(self._columns.count(pk) == 1 for pk in self._primary_table_pk_cols)
+
+    def _editable_columns(self):
+        if not self._rows_addressable():
+            return set()
+        try:
+            table_columns = {c.name for c in self.db.get_table(self._primary_table).columns}
+        except Exception:
+            return set()
+        return {i for i, name in enumerate(self._columns)
+                if name in table_columns and self._columns.count(name) == 1
+                and name not in self._primary_table_pk_cols}
+
+    def _apply_edit_mode(self):
+        editing = self.edit_mode_btn.isChecked()
+        editable = self._editable_columns() if editing else set()
+        for w in (self.delete_rows_btn, self.save_changes_btn, self.discard_changes_btn):
+            w.setVisible(editing)
+        if self._model is None:
+            return
+        self._marking = True
+        try:
+            for row in range(len(self._rows)):
+                for col in range(len(self._columns)):
+                    self._model.item(row, col).setEditable(col in editable)
+        finally:
+            self._marking = False
+        self._update_edit_controls()
+
+    def _on_edit_mode_toggled(self, checked):
+        if checked and not self._editable_columns():
+            QMessageBox.information(
+                self, "Правка недоступна",
+                "Правка в таблице доступна для результата из одной таблицы с первичным ключом в колонках",
+            )
+            self.edit_mode_btn.setChecked(False)
+            return
+        if not checked and self._pending_changes():
+            if not self._confirm_discard():
+                self.edit_mode_btn.setChecked(True)
+                return
+            self._clear_changes()
+            self._repaint_rows()
+        self._apply_edit_mode()
+
+    def _confirm_discard(self):
+        ans = QMessageBox.question(
+            self, "Несохранённые изменения",
+            f"Несохранённых строк: {self._pending_changes()}. Отбросить изменения?",
+            QMessageBox.Yes | QMessageBox.No,
+        )
+        return ans == QMessageBox.Yes
+
+    def _clear_changes(self):
+        dirty = set(self._edits) | self._deleted_rows
+        self._edits = {}
+        self._deleted_rows = set()
+        self._row_errors = {}
+        return dirty
+
+    def _original_text(self, row, col):
+        val = self._rows[row][col]
+        return "" if val is None else str(val)
+
+    def _on_item_changed(self, item):
+        if self._marking or item.column() >= len(self._columns):
+            return
+        row, col = item.row(), item.column()
+        name = str(self._columns[col])
+        edits = self._edits.setdefault(row, {})
+        if item.text() == self._original_text(row, col):
+            edits.pop(name, None)
+        else:
+            edits[name] = item.text()
+        if not edits:
+            self._edits.pop(row, None)
+        self._validate_row(row)
+        self._mark_row(row)
+        self._update_edit_controls()
+
+    def _validate_row(self, row):
+        edits = self._edits.get(row)
+        if not edits:
+            self._row_errors.pop(row, None)
+            return {}
+        table = self.db.get_table(self._primary_table)
+        raw = {str(name): self._rows[row][i] for i, name in enumerate(self._columns) if name in table.columns}
+        raw.update(edits)
+        validated, errors = validate_table_data(table, raw)
+        errors = {k: v for k, v in errors.items() if k in edits}
+        if errors:
+            self._row_errors[row] = errors
+        else:
+            self._row_errors.pop(row, None)
+        return {k: validated.get(k) for k in edits}
+
+    def _mark_row(self, row):
+        if self._model is None or row >= self._model.rowCount():
+            return
+        deleted = row in self._deleted_rows
+        edits = self._edits.get(row, {})
+        errors = self._row_errors.get(row, {})
+        self._marking = True
+        try:
+            for col, name in enumerate(self._columns):
+                item = self._model.item(row, col)
+                name = str(name)
+                font = item.font()
+                font.setStrikeOut(deleted)
+                item.setFont(font)
+                if deleted:
+                    item.setBackground(QColor('#f8d7da'))
+                    item.setToolTip("строка будет удалена")
+                elif name in errors:
+                    item.setBackground(QColor('#f5b7b1'))
+                    item.setToolTip(errors[name])
+                elif name in edits:
+                    item.setBackground(QColor('#fff3b0'))
+                    item.setToolTip(f"было: {self._original_text(row, col)}")
+                else:
+                    item.setBackground(QBrush())
+                    item.setToolTip("")
+        finally:
+            self._marking = False
+
+    def _repaint_rows(self, rows=None):
+        for row in rows if rows is not None else range(len(self._rows)):
+            for col in range(len(self._columns)):
+                self._marking = True
                 try:
-                    columns = result.keys()
-                except Exception:
-                    columns = []
-                rows = result.fetchall()
+                    self._model.item(row, col).setText(self._original_text(row, col))
+                finally:
+                    self._marking = False
+            self._mark_row(row)
+
+    def _update_edit_controls(self):
+        pending = self._pending_changes()
+        self.save_changes_btn.setText(f"Сохранить ({pending})" if pending else "Сохранить")
+        self.save_changes_btn.setEnabled(bool(pending) and not self._row_errors)
+        self.discard_changes_btn.setEnabled(bool(pending))
+        if self._row_errors:
+            self.save_changes_btn.setToolTip("Исправьте ячейки, отмеченные красным")
+        else:
+            self.save_changes_btn.setToolTip("")
+
+    def _on_delete_rows_clicked(self):
+        rows = {i.row() for i in self.table_view.selectionModel().selectedIndexes() if i.row() < len(self._rows)}
+        if not rows:
+            QMessageBox.information(self, "Нет выделения", "Выделите строки для удаления")
+            return
+        for row in rows:
+            if row in self._deleted_rows:
+                self._deleted_rows.discard(row)
+            else:
+                self._deleted_rows.add(row)
+            self._mark_row(row)
+        self._update_edit_controls()
+
+    def _on_bulk_delete_clicked(self):
+        if not self._rows_addressable():
+            QMessageBox.information(
+                self, "Удаление недоступно",
+                "Удаление доступно для результата из одной таблицы с первичным ключом в колонках",
+            )
+            return
+        rows = sorted({i.row() for i in self.table_view.selectionModel().selectedIndexes() if i.row() < len(self._rows)})
+        if not rows:
+            QMessageBox.information(self, "Нет выделения", "Выделите строки для удаления")
+            return
+        from delete_form import BulkDeleteDialog
+        dlg = BulkDeleteDialog(self.db, self._primary_table, self._primary_table_pk_cols,
+                               [self._row_pk(r) for r in rows], parent=self)
+        if dlg.exec() == QDialog.Accepted:
+            self._clear_changes()
+            self.load_and_build()
+
+    def _on_discard_changes_clicked(self):
+        self._repaint_rows(sorted(self._clear_changes()))
+        self._update_edit_controls()
+
+    def _row_pk(self, row):
+        return tuple(self._rows[row][self._columns.index(pk)] for pk in self._primary_table_pk_cols)
+
+    def _on_save_changes_clicked(self):
+        if self._row_errors:
+            QMessageBox.warning(self, "Ошибки", "Исправьте ячейки, отмеченные красным")
+            return
+        updates = [(self._row_pk(row), self._validate_row(row))
+                   for row in sorted(self._edits) if row not in self._deleted_rows]
+        deletes = [self._row_pk(row) for row in sorted(self._deleted_rows)]
+        if deletes:
+            ans = QMessageBox.question(self, "Удаление", f"Удалить строк: {len(deletes)}?",
+                                       QMessageBox.Yes | QMessageBox.No)
+            if ans != QMessageBox.Yes:
+                return
+        started = time.perf_counter()
+        try:
+            report = self.db.apply_grid_changes(self._primary_table, self._primary_table_pk_cols, updates, deletes)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка сохранения", f"Изменения не сохранены:\n{e}")
+            return
+        for stmt, params, rows in report['statements']:
+            log_execution(self.db, stmt, params, 'edit', started, rows=rows, tables=[self._primary_table])
+        self._clear_changes()
+        self.load_and_build()
+        QMessageBox.information(self, "Готово", f"Обновлено строк: {report['updated']}\nУдалено строк: {report['deleted']}")
+
+    def load_and_build(self):
+        if self._pending_changes():
+            if not self._confirm_discard():
+                return
+            self._clear_changes()
+        sql, params, paged = self._page_statement()
+        cached = self._cached_page(sql, params) if self._use_cache and paged else None
+        self._use_cache = False
+        snapshot = ([], {})
+        started = time.perf_counter()
+        try:
+            if cached is not None:
+                columns, rows = cached
+            else:
+                if paged:
+                    snapshot = self._snapshot_page()
+                started = time.perf_counter()
+                with self.db.engine.connect() as conn:
+                    self.db.apply_timeouts(conn, 'browse')
+                    result = self.db.execute_prepared(conn, sql, params)
+                    try:
+                        columns = list(result.keys())
+                    except Exception:
+                        columns = []
+                    rows = result.fetchmany(self.max_rows + 1)
         except Exception as e:
-            QMessageBox.critical(self, "Query error", f"Error executing SQL:\n{str(e)}")
+            log_execution(self.db, self.sql, self.params, self.source, started, error=str(e))
+            err = self.db.timeout_error(e, 'browse')
+            if err is not None:
+                QMessageBox.critical(self, "Query error", str(err))
+            else:
+                QMessageBox.critical(self, "Query error", f"Error executing SQL:\n{str(e)}")
             try:
                 self.info_label.setText("Error executing query")
             except Exception:
@@ -322,7 +1175,15 @@ class TableResultWidget(QWidget):
             self.table_view.setModel(QStandardItemModel(0, 0))
             return
 
+        self._has_more = len(rows) > self.max_rows
         displayed_rows = rows[: self.max_rows]
+        log_execution(self.db, self.sql, self.params, self.source, started,
+                      rows=len(displayed_rows), cached=cached is not None)
+        if cached is None and snapshot[0]:
+            self._store_page(sql, params, columns, rows, snapshot)
+        self._update_page_controls(len(displayed_rows), paged)
+        if cached is not None:
+            self.page_label.setText(self.page_label.text() + " (из кэша)")
         model = QStandardItemModel()
         model.setColumnCount(len(columns) + 1)
         header_labels = [str(c) for c in columns] + ["Edit"]
@@ -339,6 +1200,7 @@ class TableResultWidget(QWidget):
             items.append(edit_item)
             model.appendRow(items)
         self.table_view.setModel(model)
+        self._update_sort_indicator()
         if self.table_view.selectionModel() and not self._sel_connected:
             try:
                 self.table_view.selectionModel().selectionChanged.connect(self._on_selection_changed)
@@ -360,6 +1222,10 @@ class TableResultWidget(QWidget):
                     self._primary_table_pk_cols = pk_info.get("constrained_columns", []) or []
                 except Exception:
                     self._primary_table_pk_cols = []
+        model.itemChanged.connect(self._on_item_changed)
+        self._apply_edit_mode()
+        self._build_filter_edits()
+        self._update_count(len(displayed_rows))
 
     def _on_table_clicked(self, index):
         if not index.isValid():
@@ -407,10 +1273,12 @@ class TableResultWidget(QWidget):
         if not indexes:
             self._current_index = None
             self.edit_small_btn.setVisible(False)
+            self.bulk_delete_btn.setVisible(False)
             return
         index = indexes[0]
         self._current_index = index
         self.edit_small_btn.setVisible(True)
+        self.bulk_delete_btn.setVisible(self._rows_addressable())
 
     def _on_action_button_clicked(self):
         sel_indexes = [i for i in self.table_view.selectionModel().selectedIndexes() if i.isValid()]
@@ -442,16 +1310,21 @@ class TableResultWidget(QWidget):
                     params_all = {}
                     params_all.update(bind_params)
                     params_all.update(extra_params)
+                    started = time.perf_counter()
                     try:
-                        conn.execute(text(stmt), params_all)
+                        result = conn.execute(text(stmt), params_all)
                         updated += 1
                     except Exception:
                         try:
-                            conn.execute(text(stmt.replace("SUBSTRING(", "SUBSTR(")), params_all)
+                            stmt = stmt.replace("SUBSTRING(", "SUBSTR(")
+                            result = conn.execute(text(stmt), params_all)
                             updated += 1
-                        except Exception:
+                        except Exception as e:
+                            log_execution(self.db, stmt, params_all, 'edit', started, error=str(e))
                             skipped += 1
                             continue
+                    log_execution(self.db, stmt, params_all, 'edit', started, rows=result.rowcount,
+                                  tables=[self._primary_table])
         self.load_and_build()
         QMessageBox.information(self, "Готово", f"Обновлено: {updated}\nПропущено: {skipped}")
 
@@ -549,7 +1422,7 @@ class TableResultWidget(QWidget):
             QMessageBox.information(self, "Нет SQL", "Нечего сохранять")
             return
         try:
-            dlg = SaveViewDialog(self.db, self.sql, materialized=False, parent=self)
+            dlg = SaveViewDialog(self.db, inline_params(self.sql, self.params), materialized=False, parent=self)
             dlg.exec()
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить представление:\n{e}")
@@ -559,7 +1432,7 @@ class TableResultWidget(QWidget):
             QMessageBox.information(self, "Нет SQL", "Нечего сохранять ")
             return
         try:
-            dlg = SaveViewDialog(self.db, self.sql, materialized=True, parent=self)
+            dlg = SaveViewDialog(self.db, inline_params(self.sql, self.params), materialized=True, parent=self)
             dlg.exec()
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить материализованное представление:\n{e}")